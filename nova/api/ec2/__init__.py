@@ -47,7 +47,8 @@ flags.DEFINE_integer('lockout_minutes', 15,
 flags.DEFINE_integer('lockout_window', 15,
                      'Number of minutes for lockout window.')
 flags.DEFINE_list('lockout_memcached_servers', None,
-                  'Memcached servers or None for in process cache.')
+                  'Memcached servers for the lockout, memcached_servers'
+                  ' is used if unset')
 
 
 class RequestLogging(wsgi.Middleware):
@@ -92,11 +93,11 @@ class Lockout(wsgi.Middleware):
     y = lockout_window flag
     z = lockout_attempts flag
 
-    Uses memcached if lockout_memcached_servers flag is set, otherwise it
-    uses a very simple in-proccess cache. Due to the simplicity of
-    the implementation, the timeout window is started with the first
-    failed request, so it will block if there are x failed logins within
-    that period.
+    Uses memcached if the lockout_memcached_servers or memcached_servers
+    flag is set, otherwise it uses a very simple in-proccess cache. Due to
+    the simplicity of the implementation, the timeout window is started
+    with the first failed request, so it will block if there are x failed
+    logins within that period.
 
     There is a possible race condition where simultaneous requests could
     sneak in before the lockout hits, but this is extremely rare and would
@@ -104,12 +105,12 @@ class Lockout(wsgi.Middleware):
 
     def __init__(self, application):
         """middleware can use fake for testing."""
-        if FLAGS.lockout_memcached_servers:
+        servers = FLAGS.lockout_memcached_servers or FLAGS.memcached_servers
+        if servers:
             import memcache
         else:
             from nova import fakememcache as memcache
-        self.mc = memcache.Client(FLAGS.lockout_memcached_servers,
-                                  debug=0)
+        self.mc = memcache.Client(servers, debug=0)
         super(Lockout, self).__init__(application)
 
     @webob.dec.wsgify(RequestClass=wsgi.Request)
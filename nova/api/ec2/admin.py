@@ -21,12 +21,12 @@ Admin API controller, exposed through http via the api worker.
 """
 
 import base64
-import datetime
 
 from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
+from nova import servicegroup
 from nova import utils
 from nova.api.ec2 import ec2utils
 from nova.auth import manager
@@ -59,21 +59,18 @@ def project_dict(project):
         return {}
 
 
-def host_dict(host, compute_service, instances, volume_service, volumes, now):
+def host_dict(host, compute_service, instances, volume_service, volumes,
+              servicegroup_api):
     """Convert a host model object to a result dict"""
     rv = {'hostname': host, 'instance_count': len(instances),
           'volume_count': len(volumes)}
     if compute_service:
-        latest = compute_service['updated_at'] or compute_service['created_at']
-        delta = now - latest
-        if delta.seconds <= FLAGS.service_down_time:
+        if servicegroup_api.is_up(compute_service):
             rv['compute'] = 'up'
         else:
             rv['compute'] = 'down'
     if volume_service:
-        latest = volume_service['updated_at'] or volume_service['created_at']
-        delta = now - latest
-        if delta.seconds <= FLAGS.service_down_time:
+        if servicegroup_api.is_up(volume_service):
             rv['volume'] = 'up'
         else:
             rv['volume'] = 'down'
@@ -115,6 +112,9 @@ class AdminController(object):
     API Controller for users, hosts, nodes, and workers.
     """
 
+    def __init__(self):
+        self.servicegroup_api = servicegroup.API()
+
     def __str__(self):
         return 'AdminController'
 
@@ -305,7 +305,6 @@ class AdminController(object):
             * Volume Count
         """
         services = db.service_get_all(context)
-        now = datetime.datetime.utcnow()
         hosts = []
         rv = []
         for host in [service['host'] for service in services]:
@@ -323,7 +322,7 @@ class AdminController(object):
                 volume = volume[0]
             volumes = db.volume_get_all_by_host(context, host)
             rv.append(host_dict(host, compute, instances, volume, volumes,
-                                now))
+                                self.servicegroup_api))
         return {'hosts': rv}
 
     def describe_host(self, _context, name, **_kwargs):
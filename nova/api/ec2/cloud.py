@@ -37,6 +37,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import network
+from nova import servicegroup
 from nova import utils
 from nova import volume
 from nova.api.ec2 import ec2utils
@@ -45,7 +46,6 @@ from nova.image import s3
 
 
 FLAGS = flags.FLAGS
-flags.DECLARE('service_down_time', 'nova.scheduler.driver')
 
 LOG = logging.getLogger("nova.api.cloud")
 
@@ -88,6 +88,7 @@ class CloudController(object):
                 network_api=self.network_api,
                 volume_api=self.volume_api,
                 hostname_factory=ec2utils.id_to_ec2_id)
+        self.servicegroup_api = servicegroup.API()
         self.setup()
 
     def __str__(self):
@@ -222,7 +223,6 @@ class CloudController(object):
                                         'zoneState': 'available'}]}
 
         services = db.service_get_all(context)
-        now = datetime.datetime.utcnow()
         hosts = []
         for host in [service['host'] for service in services]:
             if not host in hosts:
@@ -233,8 +233,7 @@ class CloudController(object):
             hsvcs = [service for service in services \
                      if service['host'] == host]
             for svc in hsvcs:
-                delta = now - (svc['updated_at'] or svc['created_at'])
-                alive = (delta.seconds <= FLAGS.service_down_time)
+                alive = self.servicegroup_api.is_up(svc)
                 art = (alive and ":-)") or "XXX"
                 active = 'enabled'
                 if svc['disabled']:
@@ -667,6 +666,8 @@ class CloudController(object):
         #               rather than simply formatting a bunch of instances that
         #               were handed to it
         reservations = {}
+        # NOTE: instances share a few hosts, look each one's zone up once
+        zones = {}
         # NOTE(vish): instance_id is an optional list of ids to filter by
         if instance_id:
             instances = []
@@ -717,8 +718,10 @@ class CloudController(object):
             i['displayName'] = instance['display_name']
             i['displayDescription'] = instance['display_description']
             host = instance['host']
-            zone = self._get_availability_zone_by_host(context, host)
-            i['placement'] = {'availabilityZone': zone}
+            if host not in zones:
+                zones[host] = self._get_availability_zone_by_host(context,
+                                                                  host)
+            i['placement'] = {'availabilityZone': zones[host]}
             if instance['reservation_id'] not in reservations:
                 r = {}
                 r['reservationId'] = instance['reservation_id']
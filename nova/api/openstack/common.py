@@ -20,18 +20,12 @@ import webob.exc
 from nova import exception
 
 
-def limited(items, request, max_limit=1000):
+def get_pagination_params(request, max_limit=1000):
     """
-    Return a slice of items according to requested offset and limit.
+    Return (offset, limit) parsed from the request's GET variables.
 
-    @param items: A sliceable entity
-    @param request: `wsgi.Request` possibly containing 'offset' and 'limit'
-                    GET variables. 'offset' is where to start in the list,
-                    and 'limit' is the maximum number of items to return. If
-                    'limit' is not specified, 0, or > max_limit, we default
-                    to max_limit. Negative values for either offset or limit
-                    will cause exc.HTTPBadRequest() exceptions to be raised.
-    @kwarg max_limit: The maximum number of items to return from 'items'
+    Validates them the way limited() documents, for callers that page in
+    the database rather than slicing a list.
     """
     try:
         offset = int(request.GET.get('offset', 0))
@@ -49,7 +43,34 @@ def limited(items, request, max_limit=1000):
     if offset < 0:
         raise webob.exc.HTTPBadRequest(_('offset param must be positive'))
 
-    limit = min(max_limit, limit or max_limit)
+    return offset, min(max_limit, limit or max_limit)
+
+
+def get_marker(request):
+    """Return the 'marker' GET variable as an int, or None if not given"""
+    marker = request.GET.get('marker')
+    if marker is None:
+        return None
+    try:
+        return int(marker)
+    except ValueError:
+        raise webob.exc.HTTPBadRequest(_('marker param must be an integer'))
+
+
+def limited(items, request, max_limit=1000):
+    """
+    Return a slice of items according to requested offset and limit.
+
+    @param items: A sliceable entity
+    @param request: `wsgi.Request` possibly containing 'offset' and 'limit'
+                    GET variables. 'offset' is where to start in the list,
+                    and 'limit' is the maximum number of items to return. If
+                    'limit' is not specified, 0, or > max_limit, we default
+                    to max_limit. Negative values for either offset or limit
+                    will cause exc.HTTPBadRequest() exceptions to be raised.
+    @kwarg max_limit: The maximum number of items to return from 'items'
+    """
+    offset, limit = get_pagination_params(request, max_limit)
     range_end = offset + limit
     return items[offset:range_end]
 
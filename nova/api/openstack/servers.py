@@ -80,11 +80,30 @@ class Controller(wsgi.Controller):
 
         builder - the response model builder
         """
-        instance_list = self.compute_api.get_all(req.environ['nova.context'])
-        limited_list = common.limited(instance_list, req)
+        offset, limit = common.get_pagination_params(req)
+        marker = common.get_marker(req)
+        # NOTE: the index only shows ids and names, skip the joins
+        columns = None
+        if not is_detail:
+            columns = ('display_name',)
+        try:
+            instance_list = self.compute_api.get_all(
+                    req.environ['nova.context'], limit=limit, marker=marker,
+                    offset=offset, columns=columns)
+        except exception.NotFound:
+            return faults.Fault(exc.HTTPBadRequest(
+                    _('marker %s not found') % marker))
         builder = servers_views.get_view_builder(req)
-        servers = [builder.build(inst, is_detail)['server']
-                for inst in limited_list]
+        resizing = set()
+        if is_detail:
+            resizing = self.compute_api.get_instances_with_finished_migration(
+                    req.environ['nova.context'].elevated(),
+                    [inst['id'] for inst in instance_list])
+        servers = []
+        for inst in instance_list:
+            server = builder.build(inst, is_detail,
+                                   finished_migration=inst['id'] in resizing)
+            servers.append(server['server'])
         return dict(servers=servers)
 
     def show(self, req, id):
@@ -52,20 +52,24 @@ class ViewBuilder(object):
     def __init__(self, addresses_builder):
         self.addresses_builder = addresses_builder
 
-    def build(self, inst, is_detail):
+    def build(self, inst, is_detail, finished_migration=None):
         """
         Coerces into dictionary format, mapping everything to
         Rackspace-like attributes for return
+
+        finished_migration tells whether inst is waiting for a resize to be
+        confirmed, it is looked up when None.  Listings pass it in so they
+        don't look it up one instance at a time.
         """
         if is_detail:
-            return self._build_detail(inst)
+            return self._build_detail(inst, finished_migration)
         else:
             return self._build_simple(inst)
 
     def _build_simple(self, inst):
             return dict(server=dict(id=inst['id'], name=inst['display_name']))
 
-    def _build_detail(self, inst):
+    def _build_detail(self, inst, finished_migration=None):
         power_mapping = {
             None: 'build',
             power_state.NOSTATE: 'build',
@@ -87,10 +91,13 @@ class ViewBuilder(object):
         for k, v in mapped_keys.iteritems():
             inst_dict[k] = inst[v]
 
-        ctxt = nova.context.get_admin_context()
         inst_dict['status'] = power_mapping[inst_dict['status']]
-        compute_api = nova.compute.API()
-        if compute_api.has_finished_migration(ctxt, inst['id']):
+        if finished_migration is None:
+            ctxt = nova.context.get_admin_context()
+            compute_api = nova.compute.API()
+            finished_migration = compute_api.has_finished_migration(ctxt,
+                                                                    inst['id'])
+        if finished_migration:
             inst_dict['status'] = 'resize-confirm'
 
         inst_dict['addresses'] = self.addresses_builder.build(inst)
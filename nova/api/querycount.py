@@ -0,0 +1,55 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Middleware counting the sql statements each api request runs."""
+
+import webob.dec
+
+from nova import log as logging
+from nova import stats
+from nova import wsgi
+from nova.db import querycount
+
+
+LOG = logging.getLogger("nova.api.querycount")
+
+
+class QueryCounter(wsgi.Middleware):
+    """Logs and records the sql statements run for each request.
+
+    The totals go to nova.stats as api.sql.queries and api.sql.seconds, the
+    breakdown by db api function to the debug log.
+
+    It is not in the default pipelines. To profile an api, add querycount
+    to its pipeline in api-paste.ini, right after logrequest or faultwrap.
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        with querycount.counting() as count:
+            response = req.get_response(self.application)
+        stats.incr('api.sql.queries', count.queries)
+        stats.timing('api.sql.seconds', count.seconds)
+        functions = ', '.join('%s:%d' % (function, queries)
+                              for function, (queries, seconds)
+                              in sorted(count.functions.iteritems()))
+        LOG.debug(_('%(method)s %(path)s ran %(queries)d sql statements '
+                    'in %(seconds).3fs (%(functions)s)'),
+                  {'method': req.method, 'path': req.path_info,
+                   'queries': count.queries, 'seconds': count.seconds,
+                   'functions': functions})
+        return response
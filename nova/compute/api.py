@@ -209,44 +209,49 @@ class API(base.Base):
             'metadata': metadata,
             'availability_zone': availability_zone,
             'os_type': os_type}
-        elevated = context.elevated()
-        instances = []
-        LOG.debug(_("Going to run %s instances..."), num_instances)
-        for num in range(num_instances):
-            instance = dict(mac_address=utils.generate_mac(),
-                            launch_index=num,
-                            **base_options)
-            instance = self.db.instance_create(context, instance)
-            instance_id = instance['id']
-
-            elevated = context.elevated()
-            if not security_groups:
-                security_groups = []
-            for security_group_id in security_groups:
-                self.db.instance_add_security_group(elevated,
-                                                    instance_id,
-                                                    security_group_id)
 
+        def _updates(instance_id):
             # Set sane defaults if not specified
             updates = dict(hostname=self.hostname_factory(instance_id))
-            if (not hasattr(instance, 'display_name') or
-                    instance.display_name == None):
+            if display_name is None:
                 updates['display_name'] = "Server %s" % instance_id
+            return updates
 
-            instance = self.update(context, instance_id, **updates)
-            instances.append(instance)
-
-            pid = context.project_id
-            uid = context.user_id
-            LOG.debug(_("Casting to scheduler for %(pid)s/%(uid)s's"
-                    " instance %(instance_id)s") % locals())
+        elevated = context.elevated()
+        LOG.debug(_("Going to run %s instances..."), num_instances)
+        reservation = quota.reserve(context, instances=num_instances,
+                                    cores=num_instances * type_data['vcpus'])
+        try:
+            instances = self.db.instance_create_many(context,
+                    [dict(mac_address=utils.generate_mac(),
+                          launch_index=num,
+                          **base_options)
+                     for num in range(num_instances)],
+                    security_group_ids=security_groups,
+                    updates_factory=_updates)
+        finally:
+            quota.release(context, reservation)
+
+        instance_ids = [instance['id'] for instance in instances]
+        pid = context.project_id
+        uid = context.user_id
+        LOG.debug(_("Casting to scheduler for %(pid)s/%(uid)s's"
+                " instances %(instance_ids)s") % locals())
+        args = {"topic": FLAGS.compute_topic,
+                "availability_zone": availability_zone,
+                "injected_files": injected_files}
+        if FLAGS.scheduler_run_instances:
+            args['instance_ids'] = instance_ids
             rpc.cast(context,
                      FLAGS.scheduler_topic,
-                     {"method": "run_instance",
-                      "args": {"topic": FLAGS.compute_topic,
-                               "instance_id": instance_id,
-                               "availability_zone": availability_zone,
-                               "injected_files": injected_files}})
+                     {"method": "run_instances",
+                      "args": args})
+        else:
+            for instance_id in instance_ids:
+                rpc.cast(context,
+                         FLAGS.scheduler_topic,
+                         {"method": "run_instance",
+                          "args": dict(args, instance_id=instance_id)})
 
         for group_id in security_groups:
             self.trigger_security_group_members_refresh(elevated, group_id)
@@ -263,6 +268,15 @@ class API(base.Base):
         except exception.NotFound:
             return False
 
+    def get_instances_with_finished_migration(self, context, instance_ids):
+        """Returns the set of instance_ids that have a finished migration,
+        with one query however many ids there are"""
+        if not instance_ids:
+            return set()
+        migrations = db.migration_get_all_by_instances_and_status(context,
+                instance_ids, 'finished')
+        return set(migration['instance_id'] for migration in migrations)
+
     def ensure_default_security_group(self, context):
         """ Create security group for the security context if it
         does not already exist
@@ -282,60 +296,27 @@ class API(base.Base):
 
     def trigger_security_group_rules_refresh(self, context, security_group_id):
         """Called when a rule is added to or removed from a security_group"""
-
-        security_group = self.db.security_group_get(context, security_group_id)
-
-        hosts = set()
-        for instance in security_group['instances']:
-            if instance['host'] is not None:
-                hosts.add(instance['host'])
-
-        for host in hosts:
-            rpc.cast(context,
-                     self.db.queue_get_for(context, FLAGS.compute_topic, host),
-                     {"method": "refresh_security_group_rules",
-                      "args": {"security_group_id": security_group.id}})
+        rpc.fanout_cast(context,
+                        FLAGS.compute_topic,
+                        {"method": "refresh_security_group_rules",
+                         "args": {"security_group_id": security_group_id}})
 
     def trigger_security_group_members_refresh(self, context, group_id):
         """Called when a security group gains a new or loses a member
 
-        Sends an update request to each compute node for whom this is
-        relevant."""
-
-        # First, we get the security group rules that reference this group as
-        # the grantee..
-        security_group_rules = \
-                self.db.security_group_rule_get_by_security_group_grantee(
+        Sends an update request to every compute node, each of which
+        refreshes the rules of its own instances that reference this
+        group."""
+        # Nothing needs refreshing unless some rule grants to this group
+        if not self.db.security_group_rule_get_by_security_group_grantee(
                                                                      context,
-                                                                     group_id)
-
-        # ..then we distill the security groups to which they belong..
-        security_groups = set()
-        for rule in security_group_rules:
-            security_group = self.db.security_group_get(
-                                                    context,
-                                                    rule['parent_group_id'])
-            security_groups.add(security_group)
-
-        # ..then we find the instances that are members of these groups..
-        instances = set()
-        for security_group in security_groups:
-            for instance in security_group['instances']:
-                instances.add(instance)
-
-        # ...then we find the hosts where they live...
-        hosts = set()
-        for instance in instances:
-            if instance['host']:
-                hosts.add(instance['host'])
-
-        # ...and finally we tell these nodes to refresh their view of this
-        # particular security group.
-        for host in hosts:
-            rpc.cast(context,
-                     self.db.queue_get_for(context, FLAGS.compute_topic, host),
-                     {"method": "refresh_security_group_members",
-                      "args": {"security_group_id": group_id}})
+                                                                     group_id):
+            return
+
+        rpc.fanout_cast(context,
+                        FLAGS.compute_topic,
+                        {"method": "refresh_security_group_members",
+                         "args": {"security_group_id": group_id}})
 
     def update(self, context, instance_id, **kwargs):
         """Updates the instance in the datastore.
@@ -385,24 +366,32 @@ class API(base.Base):
         return dict(rv.iteritems())
 
     def get_all(self, context, project_id=None, reservation_id=None,
-                fixed_ip=None):
+                fixed_ip=None, limit=None, marker=None, offset=None,
+                columns=None):
         """Get all instances, possibly filtered by one of the
         given parameters. If there is no filter and the context is
-        an admin, it will retreive all instances in the system."""
+        an admin, it will retreive all instances in the system.
+
+        Unless filtered by reservation or fixed ip, instances come back
+        oldest first and can be paged through in the database with limit,
+        offset and marker, the id of the last instance of the previous
+        page.  columns loads just those instance columns, see
+        db.instance_get."""
         if reservation_id is not None:
             return self.db.instance_get_all_by_reservation(context,
                                                              reservation_id)
         if fixed_ip is not None:
             return self.db.fixed_ip_get_instance(context, fixed_ip)
+        filters = {}
         if project_id or not context.is_admin:
             if not context.project:
-                return self.db.instance_get_all_by_user(context,
-                                                        context.user_id)
-            if project_id is None:
-                project_id = context.project_id
-            return self.db.instance_get_all_by_project(context,
-            project_id)
-        return self.db.instance_get_all(context)
+                filters['user_id'] = context.user_id
+            else:
+                filters['project_id'] = project_id or context.project_id
+        return self.db.instance_get_all_by_filters(context, filters,
+                                                   limit=limit, marker=marker,
+                                                   offset=offset,
+                                                   columns=columns)
 
     def _cast_compute_message(self, method, context, instance_id, host=None,
                               params=None):
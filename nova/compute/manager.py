@@ -135,7 +135,8 @@ class ComputeManager(manager.Manager):
     def _update_state(self, context, instance_id):
         """Update the state of an instance from the driver info."""
         # FIXME(ja): include other fields from state?
-        instance_ref = self.db.instance_get(context, instance_id)
+        instance_ref = self.db.instance_get(context, instance_id,
+                                            columns=('id',))
         try:
             info = self.driver.get_info(instance_ref['name'])
             state = info['state']
@@ -643,7 +644,8 @@ class ComputeManager(manager.Manager):
 
         """
         context = context.elevated()
-        instance_ref = self.db.instance_get(context, instance_id)
+        instance_ref = self.db.instance_get(context, instance_id,
+                                            columns=('id',))
 
         LOG.debug(_('instance %s: locking'), instance_id, context=context)
         self.db.instance_update(context, instance_id, {'locked': True})
@@ -655,7 +657,8 @@ class ComputeManager(manager.Manager):
 
         """
         context = context.elevated()
-        instance_ref = self.db.instance_get(context, instance_id)
+        instance_ref = self.db.instance_get(context, instance_id,
+                                            columns=('id',))
 
         LOG.debug(_('instance %s: unlocking'), instance_id, context=context)
         self.db.instance_update(context, instance_id, {'locked': False})
@@ -669,7 +672,8 @@ class ComputeManager(manager.Manager):
         context = context.elevated()
         LOG.debug(_('instance %s: getting locked state'), instance_id,
                   context=context)
-        instance_ref = self.db.instance_get(context, instance_id)
+        instance_ref = self.db.instance_get(context, instance_id,
+                                            columns=('locked',))
         return instance_ref['locked']
 
     @checks_instance_lock
@@ -824,12 +828,45 @@ class ComputeManager(manager.Manager):
     def update_available_resource(self, context):
         """See comments update_resource_info.
 
+        Also publishes the resources, with the cores of the instances on
+        this host, to the schedulers' host states.
+
         :param context: security context
         :returns: See driver.update_available_resource()
 
         """
 
-        return self.driver.update_available_resource(context, self.host)
+        resources = self.driver.update_available_resource(context, self.host)
+        if resources:
+            self._publish_host_state(context, resources)
+        return resources
+
+    def _publish_host_state(self, context, resources):
+        """Sends this host's capacity and usage to every scheduler."""
+        try:
+            service_ref = self.db.service_get_by_args(context, self.host,
+                                                      'nova-compute')
+        except exception.NotFound:
+            return
+        capabilities = dict(resources)
+        capabilities.pop('cpu_info', None)
+        capabilities['disabled'] = service_ref['disabled']
+        capabilities['instance_cores'] = int(
+                self.db.instance_get_vcpu_sum_by_host(context, self.host))
+        rpc.fanout_cast(context, FLAGS.scheduler_topic,
+                        {'method': 'update_host_state',
+                         'args': {'host': self.host,
+                                  'capabilities': capabilities}})
+
+    def periodic_tasks(self, context=None):
+        """Publishes this host's state to the schedulers."""
+        try:
+            self.update_available_resource(context)
+        except Exception:
+            # NOTE: an exception escaping here stops the periodic task
+            #       for good, so log it and try again next interval
+            LOG.exception(_('Failed to publish the state of host %s'),
+                          self.host)
 
     def pre_live_migration(self, context, instance_id):
         """Preparations for live migration at dest host.
@@ -29,7 +29,8 @@ from nova import utils
 
 class RequestContext(object):
     def __init__(self, user, project, is_admin=None, read_deleted=False,
-                 remote_address=None, timestamp=None, request_id=None):
+                 remote_address=None, timestamp=None, request_id=None,
+                 deadline=None):
         if hasattr(user, 'id'):
             self._user = user
             self.user_id = user.id
@@ -60,6 +61,11 @@ class RequestContext(object):
             chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890-'
             request_id = ''.join([random.choice(chars) for x in xrange(20)])
         self.request_id = request_id
+        # NOTE: deadline is the time.time() after which nobody is waiting
+        #       for the result any more. rpc sends the seconds left next to
+        #       the context rather than in to_dict so older services can
+        #       still unpack the context.
+        self.deadline = deadline
 
     @property
     def user(self):
@@ -107,7 +113,8 @@ class RequestContext(object):
                               read_deleted,
                               self.remote_address,
                               self.timestamp,
-                              self.request_id)
+                              self.request_id,
+                              self.deadline)
 
 
 def get_admin_context(read_deleted=False):
@@ -30,11 +30,24 @@ The underlying driver is loaded as a :class:`LazyPluggable`.
 
 :enable_new_services:  when adding a new service to the database, is it in the
                        pool of available hardware (Default: True)
+
+:sql_use_tpool:  run backend calls in eventlet's pool of native threads,
+                 sized by the EVENTLET_THREADPOOL_SIZE environment variable
+                 (Default: False)
+
+:db_cache_ttl:  seconds rows of the tables in `db_cached_tables` are
+                cached for by the getters here (Default: 30)
 """
 
+import sys
+
+from eventlet import tpool
+
 from nova import exception
 from nova import flags
 from nova import utils
+from nova.db import cache
+from nova.db import querycount
 
 
 FLAGS = flags.FLAGS
@@ -46,10 +59,50 @@ flags.DEFINE_string('instance_name_template', 'instance-%08x',
                     'Template string to be used to generate instance names')
 flags.DEFINE_string('volume_name_template', 'volume-%08x',
                     'Template string to be used to generate instance names')
+flags.DEFINE_integer('fixed_ip_allocate_candidates', 32,
+                     'Free fixed ips to pick from at random after losing'
+                     ' an allocation race')
+flags.DEFINE_integer('fixed_ip_allocate_attempts', 10,
+                     'Times to try claiming a free fixed ip before giving up')
+
+
+class TpoolBackend(object):
+    """Proxies a backend, running its calls in native threads if enabled
+
+    With FLAGS.sql_use_tpool set, each call blocks only the green thread
+    making it, so one slow query no longer stalls the whole process.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, key):
+        attr = getattr(self._backend, key)
+        if not callable(attr):
+            return attr
+        attr = querycount.tracked(key, attr)
+        if not FLAGS.sql_use_tpool:
+            return attr
+
+        def _run(*args, **kwargs):
+            # NOTE: tpool prints the traceback of anything raised in a
+            #       thread, and NotFound is raised all the time, so hand
+            #       exceptions back and re-raise them here instead
+            try:
+                return True, attr(*args, **kwargs)
+            except Exception:
+                return False, sys.exc_info()
 
+        def _call(*args, **kwargs):
+            succeeded, result = tpool.execute(_run, *args, **kwargs)
+            if not succeeded:
+                raise result[0], result[1], result[2]
+            return result
+        return _call
 
-IMPL = utils.LazyPluggable(FLAGS['db_backend'],
-                           sqlalchemy='nova.db.sqlalchemy.api')
+
+IMPL = TpoolBackend(utils.LazyPluggable(FLAGS['db_backend'],
+                                        sqlalchemy='nova.db.sqlalchemy.api'))
 
 
 class NoMoreAddresses(exception.Error):
@@ -71,6 +124,11 @@ class NoMoreTargets(exception.Error):
     """No more available blades"""
     pass
 
+
+class QuotaUsageExceeded(exception.Error):
+    """Reserving more of a resource than the project's quota allows."""
+    pass
+
 ###################
 
 
@@ -155,6 +213,15 @@ def service_update(context, service_id, values):
     return IMPL.service_update(context, service_id, values)
 
 
+def service_heartbeat(context, service_id):
+    """Bump the report count and updated_at of a service in one write.
+
+    Raises NotFound if the service does not exist.
+
+    """
+    return IMPL.service_heartbeat(context, service_id)
+
+
 ###################
 
 
@@ -312,6 +379,12 @@ def migration_get_by_instance_and_status(context, instance_id, status):
     return IMPL.migration_get_by_instance_and_status(context, instance_id,
             status)
 
+
+def migration_get_all_by_instances_and_status(context, instance_ids, status):
+    """Finds the migrations with status of any of the instances"""
+    return IMPL.migration_get_all_by_instances_and_status(context,
+            instance_ids, status)
+
 ####################
 
 
@@ -338,6 +411,11 @@ def fixed_ip_create(context, values):
     return IMPL.fixed_ip_create(context, values)
 
 
+def fixed_ip_bulk_create(context, ips):
+    """Create many fixed ips from a list of values dictionaries."""
+    return IMPL.fixed_ip_bulk_create(context, ips)
+
+
 def fixed_ip_disassociate(context, address):
     """Disassociate a fixed ip from an instance by address."""
     return IMPL.fixed_ip_disassociate(context, address)
@@ -395,6 +473,21 @@ def instance_create(context, values):
     return IMPL.instance_create(context, values)
 
 
+def instance_create_many(context, values_list, security_group_ids=None,
+                         updates_factory=None):
+    """Create an instance for each of values_list in one transaction.
+
+    The instances must share one reservation_id.  Every instance is added
+    to the security groups in security_group_ids.  updates_factory, if
+    given, is called with each new instance's id and returns values to set
+    on it that depend on the id.
+
+    """
+    return IMPL.instance_create_many(context, values_list,
+                                     security_group_ids=security_group_ids,
+                                     updates_factory=updates_factory)
+
+
 def instance_data_get_for_project(context, project_id):
     """Get (instance_count, core_count) for project."""
     return IMPL.instance_data_get_for_project(context, project_id)
@@ -405,9 +498,13 @@ def instance_destroy(context, instance_id):
     return IMPL.instance_destroy(context, instance_id)
 
 
-def instance_get(context, instance_id):
-    """Get an instance or raise if it does not exist."""
-    return IMPL.instance_get(context, instance_id)
+def instance_get(context, instance_id, columns=None):
+    """Get an instance or raise if it does not exist.
+
+    Pass columns, a list of column names, to load just those columns
+    without joining the instance's fixed ip, volumes and so on.
+    """
+    return IMPL.instance_get(context, instance_id, columns=columns)
 
 
 def instance_get_all(context):
@@ -425,6 +522,20 @@ def instance_get_all_by_project(context, project_id):
     return IMPL.instance_get_all_by_project(context, project_id)
 
 
+def instance_get_all_by_filters(context, filters, limit=None, marker=None,
+                                offset=None, sort_dir='asc', columns=None):
+    """Get a page of instances matching filters, ordered by creation.
+
+    filters may hold project_id or user_id, and is empty to list every
+    instance.  marker is the id of the last instance of the previous page.
+    columns works as for instance_get.
+    """
+    return IMPL.instance_get_all_by_filters(context, filters, limit=limit,
+                                            marker=marker, offset=offset,
+                                            sort_dir=sort_dir,
+                                            columns=columns)
+
+
 def instance_get_all_by_host(context, host):
     """Get all instance belonging to a host."""
     return IMPL.instance_get_all_by_host(context, host)
@@ -479,6 +590,11 @@ def instance_add_security_group(context, instance_id, security_group_id):
                                             security_group_id)
 
 
+def instance_get_vcpu_sum_by_host(context, hostname):
+    """Get instances.vcpus by host."""
+    return IMPL.instance_get_vcpu_sum_by_host(context, hostname)
+
+
 def instance_get_vcpu_sum_by_host_and_project(context, hostname, proj_id):
     """Get instances.vcpus by host and project."""
     return IMPL.instance_get_vcpu_sum_by_host_and_project(context,
@@ -541,6 +657,7 @@ def key_pair_get_all_by_user(context, user_id):
 ####################
 
 
+@cache.invalidates('networks')
 def network_associate(context, project_id):
     """Associate a free network to a project."""
     return IMPL.network_associate(context, project_id)
@@ -566,6 +683,7 @@ def network_count_reserved_ips(context, network_id):
     return IMPL.network_count_reserved_ips(context, network_id)
 
 
+@cache.invalidates('networks')
 def network_create_safe(context, values):
     """Create a network from the values dict.
 
@@ -576,6 +694,7 @@ def network_create_safe(context, values):
     return IMPL.network_create_safe(context, values)
 
 
+@cache.invalidates('networks')
 def network_delete_safe(context, network_id):
     """Delete network with key network_id.
     This method assumes that the network is not associated with any project
@@ -588,16 +707,19 @@ def network_create_fixed_ips(context, network_id, num_vpn_clients):
     return IMPL.network_create_fixed_ips(context, network_id, num_vpn_clients)
 
 
+@cache.invalidates('networks')
 def network_disassociate(context, network_id):
     """Disassociate the network from project or raise if it does not exist."""
     return IMPL.network_disassociate(context, network_id)
 
 
+@cache.invalidates('networks')
 def network_disassociate_all(context):
     """Disassociate all networks from projects."""
     return IMPL.network_disassociate_all(context)
 
 
+@cache.cached('networks')
 def network_get(context, network_id):
     """Get an network or raise if it does not exist."""
     return IMPL.network_get(context, network_id)
@@ -614,6 +736,7 @@ def network_get_associated_fixed_ips(context, network_id):
     return IMPL.network_get_associated_fixed_ips(context, network_id)
 
 
+@cache.cached('networks')
 def network_get_by_bridge(context, bridge):
     """Get a network by bridge or raise if it does not exist."""
     return IMPL.network_get_by_bridge(context, bridge)
@@ -644,16 +767,19 @@ def network_get_vpn_ip(context, network_id):
     return IMPL.network_get_vpn_ip(context, network_id)
 
 
+@cache.invalidates('networks')
 def network_set_cidr(context, network_id, cidr):
     """Set the Classless Inner Domain Routing for the network."""
     return IMPL.network_set_cidr(context, network_id, cidr)
 
 
+@cache.invalidates('networks')
 def network_set_host(context, network_id, host_id):
     """Safely set the host for network."""
     return IMPL.network_set_host(context, network_id, host_id)
 
 
+@cache.invalidates('networks')
 def network_update(context, network_id, values):
     """Set the given properties on an network and update it.
 
@@ -771,6 +897,28 @@ def quota_destroy(context, project_id):
     return IMPL.quota_destroy(context, project_id)
 
 
+def quota_usage_get_all_by_project(context, project_id):
+    """Get {resource: {'in_use': n, 'reserved': n}} for a project."""
+    return IMPL.quota_usage_get_all_by_project(context, project_id)
+
+
+def quota_reserve(context, project_id, deltas, limits, expire=None):
+    """Reserve deltas of resources if that keeps usage within limits.
+
+    Raises QuotaUsageExceeded, reserving nothing, if any of them would not.
+    First drops the reservations of usage rows unchanged for expire
+    seconds, those were left behind by a process that died.
+
+    """
+    return IMPL.quota_reserve(context, project_id, deltas, limits,
+                              expire=expire)
+
+
+def quota_release(context, project_id, deltas):
+    """Release resources reserved by quota_reserve."""
+    return IMPL.quota_release(context, project_id, deltas)
+
+
 ###################
 
 
@@ -1113,31 +1261,37 @@ def console_get(context, console_id, instance_id=None):
     ##################
 
 
+@cache.invalidates('instance_types')
 def instance_type_create(context, values):
     """Create a new instance type"""
     return IMPL.instance_type_create(context, values)
 
 
+@cache.cached('instance_types')
 def instance_type_get_all(context, inactive=False):
     """Get all instance types"""
     return IMPL.instance_type_get_all(context, inactive)
 
 
+@cache.cached('instance_types')
 def instance_type_get_by_name(context, name):
     """Get instance type by name"""
     return IMPL.instance_type_get_by_name(context, name)
 
 
+@cache.cached('instance_types')
 def instance_type_get_by_flavor_id(context, id):
     """Get instance type by name"""
     return IMPL.instance_type_get_by_flavor_id(context, id)
 
 
+@cache.invalidates('instance_types')
 def instance_type_destroy(context, name):
     """Delete a instance type"""
     return IMPL.instance_type_destroy(context, name)
 
 
+@cache.invalidates('instance_types')
 def instance_type_purge(context, name):
     """Purges (removes) an instance type from DB
        Use instance_type_destroy for most cases
@@ -1148,26 +1302,44 @@ def instance_type_purge(context, name):
 ####################
 
 
+@cache.invalidates('zones')
 def zone_create(context, values):
     """Create a new child Zone entry."""
     return IMPL.zone_create(context, values)
 
 
+@cache.invalidates('zones')
 def zone_update(context, zone_id, values):
     """Update a child Zone entry."""
-    return IMPL.zone_update(context, values)
+    return IMPL.zone_update(context, zone_id, values)
 
 
+@cache.invalidates('zones')
 def zone_delete(context, zone_id):
     """Delete a child Zone."""
     return IMPL.zone_delete(context, zone_id)
 
 
+@cache.cached('zones')
 def zone_get(context, zone_id):
     """Get a specific child Zone."""
     return IMPL.zone_get(context, zone_id)
 
 
+@cache.cached('zones')
 def zone_get_all(context):
     """Get all child Zones."""
     return IMPL.zone_get_all(context)
+
+
+###################
+
+
+def archive_deleted_rows(context, days, batch_size=1000, max_batches=None):
+    """Move rows soft-deleted more than days ago to the shadow tables.
+
+    Returns a list of (table name, rows moved, seconds taken) per batch.
+
+    """
+    return IMPL.archive_deleted_rows(context, days, batch_size=batch_size,
+                                     max_batches=max_batches)
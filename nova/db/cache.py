@@ -0,0 +1,156 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Process-local cache for rarely changing tables.
+
+Getters in nova.db.api are wrapped with :func:`cached` and the calls that
+change the same table with :func:`invalidates`.  Writes made through this
+process drop the table's entries straight away.  Writes made by other
+processes show up once the entries expire, after `db_cache_ttl` seconds.
+
+**Related Flags**
+
+:db_cache_ttl:  seconds a cached row is used for, 0 disables the cache
+:db_cached_tables:  tables to cache, out of instance_types, zones and
+                    networks.  networks is off by default: other processes
+                    change a network's host, and compute must not act on a
+                    stale one
+"""
+
+import copy
+import functools
+import time
+
+from nova import flags
+from nova import stats
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('db_cache_ttl', 30,
+                     'Seconds rows of rarely changing tables are cached for')
+flags.DEFINE_list('db_cached_tables', ['instance_types', 'zones'],
+                  'Tables whose rows are cached for db_cache_ttl seconds,'
+                  ' out of instance_types, zones and networks')
+
+
+class TTLCache(object):
+    """Dictionary whose entries expire ttl seconds after they are set"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key):
+        """Returns (True, value) for a live entry, else (False, None)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if time.time() >= expires:
+            del self._entries[key]
+            return False, None
+        return True, value
+
+    def set(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_CACHES = {}
+_KEY_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+def get_cache(table):
+    """Returns the cache of table, or None if it is not cached"""
+    if FLAGS.db_cache_ttl <= 0 or table not in FLAGS.db_cached_tables:
+        return None
+    cache = _CACHES.get(table)
+    if cache is None or cache.ttl != FLAGS.db_cache_ttl:
+        cache = _CACHES[table] = TTLCache(FLAGS.db_cache_ttl)
+    return cache
+
+
+def invalidate(table):
+    """Drops every cached row of table"""
+    cache = _CACHES.get(table)
+    if cache is not None:
+        cache.clear()
+
+
+def reset():
+    """Drops every cached row of every table"""
+    _CACHES.clear()
+
+
+def _copy(value):
+    """Copies a cached value so callers can change what they get"""
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if isinstance(value, dict):
+        return copy.deepcopy(value)
+    if hasattr(value, '__table__'):
+        # NOTE: a model is copied by its columns, deepcopy would copy the
+        #       sqlalchemy state along with it
+        clone = value.__class__()
+        for column in value.__table__.columns:
+            setattr(clone, column.name, getattr(value, column.name))
+        return clone
+    return value
+
+
+def cached(table):
+    """Caches what a db api getter returns, per context owner and arguments
+
+    Contexts that read deleted rows, and arguments other than plain values,
+    always go to the database.  Callers get their own copy of what is
+    cached.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(context, *args, **kwargs):
+            cache = get_cache(table)
+            if (cache is None or context.read_deleted or
+                not all(isinstance(arg, _KEY_TYPES)
+                        for arg in args + tuple(kwargs.values()))):
+                return f(context, *args, **kwargs)
+            owner = not context.is_admin and context.project_id or None
+            key = (f.__name__, owner) + args + tuple(sorted(kwargs.items()))
+            hit, value = cache.get(key)
+            if hit:
+                stats.incr('db.cache.%s.hits' % table)
+            else:
+                stats.incr('db.cache.%s.misses' % table)
+                value = f(context, *args, **kwargs)
+                cache.set(key, value)
+            return _copy(value)
+        return wrapper
+    return decorator
+
+
+def invalidates(table):
+    """Drops the cached rows of table whenever the wrapped call runs"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            try:
+                return f(*args, **kwargs)
+            finally:
+                invalidate(table)
+        return wrapper
+    return decorator
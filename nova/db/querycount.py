@@ -0,0 +1,112 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Counting of the sql statements run for a request or a test.
+
+While a :func:`counting` block is active in a green thread, each statement
+the sqlalchemy engine runs for it is added to the block's QueryCount, with
+the time it took and the db api function that ran it.  Calls made through
+nova.db.api are wrapped with :func:`tracked` to know that function, also
+when they run in eventlet's native thread pool.
+
+**Related Flags**
+
+:sql_query_stats:  also record every statement in nova.stats, as
+                   sql.queries.<function> and sql.query.<function>
+"""
+
+import contextlib
+
+from eventlet import corolocal
+
+from nova import flags
+from nova import stats
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_boolean('sql_query_stats', False,
+                     'Record sql statements per db api function in stats')
+
+_local = corolocal.local()
+
+
+class QueryCount(object):
+    """Statements run, and seconds spent on them, per db api function"""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.functions = {}
+
+    def add(self, function, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        queries, total = self.functions.get(function, (0, 0.0))
+        self.functions[function] = (queries + 1, total + seconds)
+
+
+def _state():
+    """Returns the counting state of the current green thread"""
+    if not hasattr(_local, 'counts'):
+        _local.counts = []
+        _local.function = None
+    return _local
+
+
+@contextlib.contextmanager
+def counting():
+    """Counts the statements run in the block, yields the QueryCount"""
+    count = QueryCount()
+    state = _state()
+    state.counts.append(count)
+    try:
+        yield count
+    finally:
+        state.counts.remove(count)
+
+
+def tracked(function, method):
+    """Wraps a db api method to count its statements as function's
+
+    The counts active where tracked is called are used, so the method may
+    run in another thread.  The method is returned as is when nothing
+    would record its statements.
+    """
+    counts = list(_state().counts)
+    if not counts and not FLAGS.sql_query_stats:
+        return method
+
+    def _tracked(*args, **kwargs):
+        state = _state()
+        saved = (state.function, state.counts)
+        state.function, state.counts = function, counts
+        try:
+            return method(*args, **kwargs)
+        finally:
+            state.function, state.counts = saved
+    return _tracked
+
+
+def record(seconds):
+    """Adds a statement that took seconds to the active counts"""
+    state = _state()
+    function = state.function or 'other'
+    for count in state.counts:
+        count.add(function, seconds)
+    if FLAGS.sql_query_stats:
+        stats.incr('sql.queries.%s' % function)
+        stats.timing('sql.query.%s' % function, seconds)
@@ -20,23 +20,38 @@ Implementation of SQLAlchemy backend.
 """
 
 import datetime
+import random
+import time
 import warnings
 
 from nova import db
 from nova import exception
 from nova import flags
+from nova import log as logging
+from nova import stats
 from nova import utils
 from nova.db.sqlalchemy import models
 from nova.db.sqlalchemy.session import get_session
+from sqlalchemy import MetaData
+from sqlalchemy import Table
+from sqlalchemy import and_
+from sqlalchemy import asc
+from sqlalchemy import desc
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm import defer
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
+from sqlalchemy.sql import bindparam
 from sqlalchemy.sql import exists
 from sqlalchemy.sql import func
+from sqlalchemy.sql import select
 from sqlalchemy.sql.expression import literal_column
 
 FLAGS = flags.FLAGS
+LOG = logging.getLogger('nova.db.sqlalchemy.api')
 
 
 def is_admin_context(context):
@@ -144,7 +159,7 @@ def service_get(context, service_id, session=None):
 
 @require_admin_context
 def service_get_all(context, disabled=False):
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Service).\
                    filter_by(deleted=can_read_deleted(context)).\
                    filter_by(disabled=disabled).\
@@ -174,7 +189,7 @@ def service_get_by_host_and_topic(context, host, topic):
 
 @require_admin_context
 def service_get_all_by_host(context, host):
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Service).\
                    filter_by(deleted=False).\
                    filter_by(host=host).\
@@ -306,6 +321,19 @@ def service_update(context, service_id, values):
         service_ref.save(session=session)
 
 
+@require_admin_context
+def service_heartbeat(context, service_id):
+    session = get_session()
+    rows = session.query(models.Service).\
+                   filter_by(id=service_id).\
+                   filter_by(deleted=False).\
+                   update({'report_count': models.Service.report_count + 1,
+                           'updated_at': utils.utcnow()},
+                          synchronize_session=False)
+    if not rows:
+        raise exception.NotFound(_('No service for id %s') % service_id)
+
+
 ###################
 
 
@@ -441,6 +469,7 @@ def floating_ip_allocate_address(context, host, project_id):
             raise db.NoMoreAddresses()
         floating_ip_ref['project_id'] = project_id
         session.add(floating_ip_ref)
+        _quota_usage_add(session, project_id, {'floating_ips': 1})
     return floating_ip_ref['address']
 
 
@@ -485,6 +514,8 @@ def floating_ip_deallocate(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        _quota_usage_add(session, floating_ip_ref['project_id'],
+                         {'floating_ips': -1})
         floating_ip_ref['project_id'] = None
         floating_ip_ref.save(session=session)
 
@@ -497,6 +528,8 @@ def floating_ip_destroy(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        _quota_usage_add(session, floating_ip_ref['project_id'],
+                         {'floating_ips': -1})
         floating_ip_ref.delete(session=session)
 
 
@@ -521,7 +554,7 @@ def floating_ip_disassociate(context, address):
 
 @require_admin_context
 def floating_ip_get_all(context):
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.FloatingIp).\
                    options(joinedload_all('fixed_ip.instance')).\
                    filter_by(deleted=False).\
@@ -541,7 +574,7 @@ def floating_ip_get_all_by_host(context, host):
 @require_context
 def floating_ip_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.FloatingIp).\
                    options(joinedload_all('fixed_ip.instance')).\
                    filter_by(project_id=project_id).\
@@ -600,30 +633,45 @@ def fixed_ip_associate(context, address, instance_id):
 
 @require_admin_context
 def fixed_ip_associate_pool(context, network_id, instance_id):
-    session = get_session()
-    with session.begin():
-        network_or_none = or_(models.FixedIp.network_id == network_id,
-                              models.FixedIp.network_id == None)
-        fixed_ip_ref = session.query(models.FixedIp).\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(deleted=False).\
-                               filter_by(instance=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
-            raise db.NoMoreAddresses()
-        if not fixed_ip_ref.network:
-            fixed_ip_ref.network = network_get(context,
-                                           network_id,
-                                           session=session)
-        fixed_ip_ref.instance = instance_get(context,
-                                             instance_id,
-                                             session=session)
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+    # NOTE: rather than locking the first free row, which every concurrent
+    #       allocation queues behind (and which sqlite can't lock at all),
+    #       claim a row with an update that only matches while it is still
+    #       free. Whoever loses the race retries on a random free row, so
+    #       concurrent allocators spread out instead of colliding again.
+    session = get_session()
+    network_or_none = or_(models.FixedIp.network_id == network_id,
+                          models.FixedIp.network_id == None)
+    candidates = 1
+    for attempt in xrange(FLAGS.fixed_ip_allocate_attempts):
+        with session.begin():
+            free = session.query(models.FixedIp.id, models.FixedIp.address).\
+                           filter(network_or_none).\
+                           filter_by(reserved=False).\
+                           filter_by(deleted=False).\
+                           filter_by(instance_id=None).\
+                           limit(candidates).\
+                           all()
+            if not free:
+                raise db.NoMoreAddresses()
+            if not attempt:
+                # NOTE: running out of addresses is reported ahead of an
+                #       unknown instance, as it was before
+                instance_get(context, instance_id, session=session,
+                             columns=['id'])
+            fixed_ip_id, address = random.choice(free)
+            network = func.coalesce(models.FixedIp.network_id, network_id)
+            claimed = session.query(models.FixedIp).\
+                              filter_by(id=fixed_ip_id).\
+                              filter_by(deleted=False).\
+                              filter_by(instance_id=None).\
+                              update({'instance_id': instance_id,
+                                      'network_id': network},
+                                     synchronize_session=False)
+        if claimed:
+            return address
+        stats.incr('db.fixed_ip_associate_pool.conflicts')
+        candidates = FLAGS.fixed_ip_allocate_candidates
+    raise db.NoMoreAddresses()
 
 
 @require_context
@@ -634,6 +682,17 @@ def fixed_ip_create(_context, values):
     return fixed_ip_ref['address']
 
 
+@require_admin_context
+def fixed_ip_bulk_create(_context, ips, chunk_size=1000):
+    # NOTE: executemany of a plain insert lets the driver send multi-row
+    #       inserts instead of one statement and session per address
+    session = get_session()
+    table = models.FixedIp.__table__
+    with session.begin():
+        for start in xrange(0, len(ips), chunk_size):
+            session.execute(table.insert(), ips[start:start + chunk_size])
+
+
 @require_context
 def fixed_ip_disassociate(context, address):
     session = get_session()
@@ -777,9 +836,82 @@ def instance_create(context, values):
     session = get_session()
     with session.begin():
         instance_ref.save(session=session)
+        _quota_usage_add(session, instance_ref.project_id,
+                         {'instances': 1, 'cores': instance_ref.vcpus or 0})
     return instance_ref
 
 
+@require_context
+def instance_create_many(context, values_list, security_group_ids=None,
+                         updates_factory=None):
+    """Create Instance records for each of values_list in one transaction.
+
+    values_list - column values of the instances, which all share the
+                  reservation_id the new rows are read back by.
+    security_group_ids - security groups to add every instance to.
+    updates_factory - called with each new instance's id, returns values
+                      that depend on it, such as the hostname.
+    """
+    # NOTE: every step is a single executemany or select however many
+    #       instances there are, rather than a few statements per instance
+    if not values_list:
+        return []
+    values_list = [dict(values) for values in values_list]
+    metadata = [values.pop('metadata', None) or [] for values in values_list]
+    reservation_id = values_list[0]['reservation_id']
+    instances = models.Instance.__table__
+    session = get_session()
+    with session.begin():
+        session.execute(instances.insert(), values_list)
+        instance_ids = [row[0] for row in session.execute(
+                select([instances.c.id],
+                       and_(instances.c.reservation_id == reservation_id,
+                            instances.c.deleted == False)).\
+                order_by(instances.c.id))]
+
+        metadata_rows = [dict(item, instance_id=instance_id)
+                         for instance_id, items in zip(instance_ids, metadata)
+                         for item in items]
+        if metadata_rows:
+            session.execute(models.InstanceMetadata.__table__.insert(),
+                            metadata_rows)
+        if security_group_ids:
+            session.execute(
+                    models.SecurityGroupInstanceAssociation.__table__.insert(),
+                    [{'instance_id': instance_id,
+                      'security_group_id': security_group_id}
+                     for instance_id in instance_ids
+                     for security_group_id in security_group_ids])
+        if updates_factory:
+            updates = [updates_factory(instance_id)
+                       for instance_id in instance_ids]
+            statement = instances.update().\
+                    where(instances.c.id == bindparam('_id')).\
+                    values(dict((key, bindparam('_%s' % key))
+                                for key in updates[0]))
+            session.execute(statement,
+                            [dict([('_%s' % key, value)
+                                   for key, value in values.iteritems()],
+                                  _id=instance_id)
+                             for instance_id, values
+                             in zip(instance_ids, updates)])
+
+        deltas = {}
+        for values in values_list:
+            usage = deltas.setdefault(values.get('project_id'),
+                                      {'instances': 0, 'cores': 0})
+            usage['instances'] += 1
+            usage['cores'] += values.get('vcpus') or 0
+        for project_id, usage in deltas.iteritems():
+            _quota_usage_add(session, project_id, usage)
+
+        return session.query(models.Instance).\
+                       options(joinedload('metadata')).\
+                       filter(models.Instance.id.in_(instance_ids)).\
+                       order_by(models.Instance.id).\
+                       all()
+
+
 @require_admin_context
 def instance_data_get_for_project(context, project_id):
     session = get_session()
@@ -796,11 +928,20 @@ def instance_data_get_for_project(context, project_id):
 def instance_destroy(context, instance_id):
     session = get_session()
     with session.begin():
-        session.query(models.Instance).\
-                filter_by(id=instance_id).\
-                update({'deleted': 1,
-                        'deleted_at': datetime.datetime.utcnow(),
-                        'updated_at': literal_column('updated_at')})
+        instance_ref = session.query(models.Instance.project_id,
+                                     models.Instance.vcpus).\
+                               filter_by(id=instance_id).\
+                               filter_by(deleted=False).\
+                               first()
+        if instance_ref:
+            session.query(models.Instance).\
+                    filter_by(id=instance_id).\
+                    update({'deleted': 1,
+                            'deleted_at': datetime.datetime.utcnow(),
+                            'updated_at': literal_column('updated_at')})
+            _quota_usage_add(session, instance_ref.project_id,
+                             {'instances': -1,
+                              'cores': -(instance_ref.vcpus or 0)})
         session.query(models.SecurityGroupInstanceAssociation).\
                 filter_by(instance_id=instance_id).\
                 update({'deleted': 1,
@@ -814,31 +955,37 @@ def instance_destroy(context, instance_id):
 
 
 @require_context
-def instance_get(context, instance_id, session=None):
+def instance_get(context, instance_id, session=None, columns=None):
     if not session:
         session = get_session()
     result = None
 
+    if columns:
+        query = session.query(models.Instance).\
+                        options(*_load_only(models.Instance, columns))
+    elif is_admin_context(context):
+        query = session.query(models.Instance).\
+                        options(joinedload_all('fixed_ip.floating_ips')).\
+                        options(joinedload_all('security_groups.rules')).\
+                        options(joinedload('volumes')).\
+                        options(joinedload_all('fixed_ip.network')).\
+                        options(joinedload('metadata'))
+    else:
+        query = session.query(models.Instance).\
+                        options(joinedload_all('fixed_ip.floating_ips')).\
+                        options(joinedload_all('security_groups.rules')).\
+                        options(joinedload('volumes')).\
+                        options(joinedload('metadata'))
+
     if is_admin_context(context):
-        result = session.query(models.Instance).\
-                         options(joinedload_all('fixed_ip.floating_ips')).\
-                         options(joinedload_all('security_groups.rules')).\
-                         options(joinedload('volumes')).\
-                         options(joinedload_all('fixed_ip.network')).\
-                         options(joinedload('metadata')).\
-                         filter_by(id=instance_id).\
-                         filter_by(deleted=can_read_deleted(context)).\
-                         first()
+        result = query.filter_by(id=instance_id).\
+                       filter_by(deleted=can_read_deleted(context)).\
+                       first()
     elif is_user_context(context):
-        result = session.query(models.Instance).\
-                         options(joinedload_all('fixed_ip.floating_ips')).\
-                         options(joinedload_all('security_groups.rules')).\
-                         options(joinedload('volumes')).\
-                         options(joinedload('metadata')).\
-                         filter_by(project_id=context.project_id).\
-                         filter_by(id=instance_id).\
-                         filter_by(deleted=False).\
-                         first()
+        result = query.filter_by(project_id=context.project_id).\
+                       filter_by(id=instance_id).\
+                       filter_by(deleted=False).\
+                       first()
     if not result:
         raise exception.InstanceNotFound(_('Instance %s not found')
                                          % instance_id,
@@ -849,7 +996,7 @@ def instance_get(context, instance_id, session=None):
 
 @require_admin_context
 def instance_get_all(context):
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Instance).\
                    options(joinedload_all('fixed_ip.floating_ips')).\
                    options(joinedload('security_groups')).\
@@ -860,7 +1007,7 @@ def instance_get_all(context):
 
 @require_admin_context
 def instance_get_all_by_user(context, user_id):
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Instance).\
                    options(joinedload_all('fixed_ip.floating_ips')).\
                    options(joinedload('security_groups')).\
@@ -870,6 +1017,86 @@ def instance_get_all_by_user(context, user_id):
                    all()
 
 
+@require_context
+def instance_get_all_by_filters(context, filters, limit=None, marker=None,
+                                offset=None, sort_dir='asc', columns=None):
+    if 'project_id' in filters:
+        authorize_project_context(context, filters['project_id'])
+    elif 'user_id' in filters:
+        authorize_user_context(context, filters['user_id'])
+    elif not is_admin_context(context):
+        raise exception.NotAuthorized()
+
+    session = get_session(read_only=True)
+    if columns:
+        query = session.query(models.Instance).\
+                        options(*_load_only(models.Instance, columns))
+    else:
+        query = session.query(models.Instance).\
+                        options(joinedload_all('fixed_ip.floating_ips')).\
+                        options(joinedload('security_groups')).\
+                        options(joinedload_all('fixed_ip.network')).\
+                        options(joinedload('metadata'))
+    query = query.filter_by(deleted=can_read_deleted(context))
+    if filters:
+        # NOTE: an empty filter_by() leaves a dangling AND in the where
+        #       clause on sqlalchemy 0.6
+        query = query.filter_by(**filters)
+    return _paginate_query(session, query, models.Instance, limit=limit,
+                           marker=marker, offset=offset,
+                           sort_dir=sort_dir).all()
+
+
+def _load_only(model, columns):
+    """Returns query options that load just columns of model
+
+    Every other column is deferred and no relationship is joined, so the
+    rows come back from a single narrow select.  The primary key is always
+    loaded.  Only the named columns (and properties built on them, like
+    Instance.name) can be read from the result once its session is gone.
+    """
+    mapper = class_mapper(model)
+    keep = set(columns) | set(column.key for column in mapper.primary_key)
+    return [defer(prop.key) for prop in mapper.iterate_properties
+            if isinstance(prop, ColumnProperty) and prop.key not in keep]
+
+
+def _paginate_query(session, query, model, limit=None, marker=None,
+                    offset=None, sort_dir='asc'):
+    """Orders query by (created_at, id) and returns the requested page
+
+    The page starts right after the row whose id is marker, found by
+    comparing keys instead of counting rows, so its cost does not grow
+    with how far into the listing it is.  The marker has to be a row of
+    query itself, so it can't probe rows the caller may not list.
+    """
+    if sort_dir == 'desc':
+        order = desc
+        after = lambda column, value: column < value
+        after_or_at = lambda column, value: column <= value
+    else:
+        order = asc
+        after = lambda column, value: column > value
+        after_or_at = lambda column, value: column >= value
+
+    if marker is not None:
+        marker_ref = query.filter(model.id == marker).first()
+        if not marker_ref:
+            raise exception.NotFound(_('Marker %s not found') % marker)
+        # NOTE: the redundant first bound lets the index seek to the marker
+        query = query.filter(and_(
+                after_or_at(model.created_at, marker_ref.created_at),
+                or_(after(model.created_at, marker_ref.created_at),
+                    after(model.id, marker_ref.id))))
+
+    query = query.order_by(order(model.created_at), order(model.id))
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
 @require_admin_context
 def instance_get_all_by_host(context, host):
     session = get_session()
@@ -886,7 +1113,7 @@ def instance_get_all_by_host(context, host):
 def instance_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
 
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Instance).\
                    options(joinedload_all('fixed_ip.floating_ips')).\
                    options(joinedload('security_groups')).\
@@ -978,10 +1205,13 @@ def instance_set_state(context, instance_id, state, description=None):
     from nova.compute import power_state
     if not description:
         description = power_state.name(state)
-    db.instance_update(context,
-                       instance_id,
-                       {'state': state,
-                        'state_description': description})
+    session = get_session()
+    with session.begin():
+        instance_ref = instance_get(context, instance_id, session=session,
+                                    columns=('state', 'state_description'))
+        instance_ref.update({'state': state,
+                             'state_description': description})
+        instance_ref.save(session=session)
 
 
 @require_context
@@ -989,8 +1219,12 @@ def instance_update(context, instance_id, values):
     session = get_session()
     with session.begin():
         instance_ref = instance_get(context, instance_id, session=session)
+        vcpus = instance_ref.vcpus or 0
         instance_ref.update(values)
         instance_ref.save(session=session)
+        if 'vcpus' in values:
+            _quota_usage_add(session, instance_ref.project_id,
+                             {'cores': (instance_ref.vcpus or 0) - vcpus})
         return instance_ref
 
 
@@ -1006,6 +1240,18 @@ def instance_add_security_group(context, instance_id, security_group_id):
         instance_ref.save(session=session)
 
 
+@require_context
+def instance_get_vcpu_sum_by_host(context, hostname):
+    session = get_session()
+    result = session.query(models.Instance).\
+                      filter_by(host=hostname).\
+                      filter_by(deleted=False).\
+                      value(func.sum(models.Instance.vcpus))
+    if not result:
+        return 0
+    return result
+
+
 @require_context
 def instance_get_vcpu_sum_by_host_and_project(context, hostname, proj_id):
     session = get_session()
@@ -1519,6 +1765,116 @@ def quota_destroy(context, project_id):
         quota_ref.delete(session=session)
 
 
+def _quota_usage_insert(session, project_id, resource, values):
+    """Inserts a usage row, returns False if another one got there first"""
+    usage_ref = models.QuotaUsage()
+    usage_ref.update({'project_id': project_id,
+                      'resource': resource,
+                      'in_use': 0,
+                      'reserved': 0})
+    usage_ref.update(values)
+    if session.bind.dialect.name == 'sqlite':
+        # NOTE: sqlite locks the database for the whole transaction from
+        #       its first write, so no one can insert the row meanwhile,
+        #       and pysqlite would commit the transaction on a SAVEPOINT
+        usage_ref.save(session=session)
+        return True
+    try:
+        with session.begin_nested():
+            usage_ref.save(session=session)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _quota_usage_add(session, project_id, deltas, column='in_use'):
+    """Adds deltas to column of the project's usage rows within session"""
+    if project_id is None:
+        return
+    usage = models.QuotaUsage
+    for resource, delta in deltas.iteritems():
+        if not delta:
+            continue
+        query = session.query(usage).\
+                        filter_by(project_id=project_id).\
+                        filter_by(resource=resource)
+        values = {column: getattr(usage, column) + delta}
+        if query.update(values, synchronize_session=False):
+            continue
+        # NOTE: a concurrent first request for the project may create the
+        #       row between our update and insert, then it is there to
+        #       update
+        if not _quota_usage_insert(session, project_id, resource,
+                                   {column: delta}):
+            query.update(values, synchronize_session=False)
+
+
+@require_admin_context
+def quota_usage_get_all_by_project(context, project_id):
+    session = get_session()
+    result = session.query(models.QuotaUsage).\
+                     filter_by(project_id=project_id).\
+                     all()
+    return dict((usage_ref.resource, {'in_use': usage_ref.in_use,
+                                      'reserved': usage_ref.reserved})
+                for usage_ref in result)
+
+
+@require_admin_context
+def quota_reserve(context, project_id, deltas, limits, expire=None):
+    # NOTE: the limit is part of the update's where clause, so two
+    #       reservations racing for the last of a resource can't both win
+    usage = models.QuotaUsage
+    session = get_session()
+    with session.begin():
+        if expire:
+            # NOTE: reservations only live while their resources are
+            #       created, so a row holding some that hasn't changed for
+            #       expire seconds holds ones whose process died
+            cutoff = utils.utcnow() - datetime.timedelta(seconds=expire)
+            session.query(usage).\
+                    filter_by(project_id=project_id).\
+                    filter(usage.reserved != 0).\
+                    filter(func.coalesce(usage.updated_at,
+                                         usage.created_at) < cutoff).\
+                    update({'reserved': 0}, synchronize_session=False)
+        for resource, delta in deltas.iteritems():
+            if not delta:
+                continue
+            query = session.query(usage).\
+                            filter_by(project_id=project_id).\
+                            filter_by(resource=resource).\
+                            filter(usage.in_use + usage.reserved + delta <=
+                                   limits[resource])
+            values = {'reserved': usage.reserved + delta}
+            if query.update(values, synchronize_session=False):
+                continue
+            exists = session.query(usage.id).\
+                             filter_by(project_id=project_id).\
+                             filter_by(resource=resource).\
+                             first()
+            if exists or delta > limits[resource]:
+                raise db.QuotaUsageExceeded(resource)
+            if _quota_usage_insert(session, project_id, resource,
+                                   {'reserved': delta}):
+                continue
+            # NOTE: a concurrent first reservation created the row, so
+            #       check the limit against it after all
+            if not query.update(values, synchronize_session=False):
+                raise db.QuotaUsageExceeded(resource)
+    return deltas
+
+
+@require_admin_context
+def quota_release(context, project_id, deltas):
+    session = get_session()
+    with session.begin():
+        _quota_usage_add(session, project_id,
+                         dict((resource, -delta)
+                              for resource, delta in deltas.iteritems()),
+                         column='reserved')
+
+
 ###################
 
 
@@ -1580,6 +1936,8 @@ def volume_create(context, values):
     session = get_session()
     with session.begin():
         volume_ref.save(session=session)
+        _quota_usage_add(session, volume_ref.project_id,
+                         {'volumes': 1, 'gigabytes': volume_ref.size or 0})
     return volume_ref
 
 
@@ -1599,11 +1957,20 @@ def volume_data_get_for_project(context, project_id):
 def volume_destroy(context, volume_id):
     session = get_session()
     with session.begin():
-        session.query(models.Volume).\
-                filter_by(id=volume_id).\
-                update({'deleted': 1,
-                        'deleted_at': datetime.datetime.utcnow(),
-                        'updated_at': literal_column('updated_at')})
+        volume_ref = session.query(models.Volume.project_id,
+                                   models.Volume.size).\
+                             filter_by(id=volume_id).\
+                             filter_by(deleted=False).\
+                             first()
+        if volume_ref:
+            session.query(models.Volume).\
+                    filter_by(id=volume_id).\
+                    update({'deleted': 1,
+                            'deleted_at': datetime.datetime.utcnow(),
+                            'updated_at': literal_column('updated_at')})
+            _quota_usage_add(session, volume_ref.project_id,
+                             {'volumes': -1,
+                              'gigabytes': -(volume_ref.size or 0)})
         session.query(models.ExportDevice).\
                 filter_by(volume_id=volume_id).\
                 update({'volume_id': None})
@@ -1652,7 +2019,7 @@ def volume_get(context, volume_id, session=None):
 
 @require_admin_context
 def volume_get_all(context):
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Volume).\
                    options(joinedload('instance')).\
                    filter_by(deleted=can_read_deleted(context)).\
@@ -1685,7 +2052,7 @@ def volume_get_all_by_instance(context, instance_id):
 def volume_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
 
-    session = get_session()
+    session = get_session(read_only=True)
     return session.query(models.Volume).\
                    options(joinedload('instance')).\
                    filter_by(project_id=project_id).\
@@ -2225,6 +2592,15 @@ def migration_get_by_instance_and_status(context, instance_id, status):
     return result
 
 
+@require_admin_context
+def migration_get_all_by_instances_and_status(context, instance_ids, status):
+    session = get_session()
+    return session.query(models.Migration).\
+                   filter(models.Migration.instance_id.in_(instance_ids)).\
+                   filter_by(status=status).\
+                   all()
+
+
 ##################
 
 
@@ -2432,11 +2808,12 @@ def zone_create(context, values):
 
 @require_admin_context
 def zone_update(context, zone_id, values):
+    session = get_session()
     zone = session.query(models.Zone).filter_by(id=zone_id).first()
     if not zone:
         raise exception.NotFound(_("No zone with id %(zone_id)s") % locals())
     zone.update(values)
-    zone.save()
+    zone.save(session=session)
     return zone
 
 
@@ -2462,3 +2839,94 @@ def zone_get(context, zone_id):
 def zone_get_all(context):
     session = get_session()
     return session.query(models.Zone).all()
+
+
+####################
+
+
+# NOTE: rows referencing a table are archived before the table itself
+ARCHIVED_TABLES = ['instance_actions', 'instance_metadata',
+                   'security_group_instance_association',
+                   'security_group_rules', 'security_groups', 'migrations',
+                   'instances', 'auth_tokens']
+
+_SHADOW_TABLES = {}
+
+
+def _shadow_table(table, session):
+    """Returns the shadow_<name> table that table is archived to
+
+    The shadow tables are created by migration 016, so they are read from
+    the database rather than built again here.
+    """
+    if table.name not in _SHADOW_TABLES:
+        _SHADOW_TABLES[table.name] = Table('shadow_%s' % table.name,
+                                           MetaData(), autoload=True,
+                                           autoload_with=session.bind)
+    return _SHADOW_TABLES[table.name]
+
+
+def _unreferenced(table):
+    """Returns clauses matching rows of table no other row points at"""
+    clauses = []
+    for other in models.BASE.metadata.sorted_tables:
+        for foreign_key in other.foreign_keys:
+            if foreign_key.column.table is table:
+                clauses.append(~exists().where(
+                        foreign_key.parent == foreign_key.column))
+    return clauses
+
+
+@require_admin_context
+def archive_deleted_rows(context, days, batch_size=1000, max_batches=None):
+    """Moves rows soft-deleted more than days ago to the shadow tables
+
+    Works in transactions of at most batch_size rows per table, so it
+    never holds locks for long, and stops after max_batches of them.
+    Rows still referenced by live rows are left alone.  Returns a list of
+    (table name, rows moved, seconds taken) for every batch.
+    """
+    cutoff = utils.utcnow() - datetime.timedelta(days=days)
+    batches = []
+    for table in [models.BASE.metadata.tables[name]
+                  for name in ARCHIVED_TABLES]:
+        shadow = _shadow_table(table, get_session())
+        key = list(table.primary_key.columns)[0]
+        query = select([key],
+                       and_(table.c.deleted == True,
+                            table.c.deleted_at < cutoff,
+                            *_unreferenced(table))).\
+                order_by(key).\
+                limit(batch_size)
+        while max_batches is None or len(batches) < max_batches:
+            start = time.time()
+            session = get_session()
+            try:
+                with session.begin():
+                    keys = [row[0] for row in session.execute(query)]
+                    if keys:
+                        rows = session.execute(
+                                table.select().where(key.in_(keys)))
+                        session.execute(shadow.insert(),
+                                        [dict(row) for row in rows])
+                        session.execute(table.delete().where(
+                                key.in_(keys)))
+            except IntegrityError, e:
+                # NOTE: most likely another archiver got to these rows
+                #       first, but the rows stay put either way
+                LOG.error(_('Stopped archiving %(table)s, moving rows '
+                            '%(first)s to %(last)s failed, another archiver '
+                            'may be running or shadow_%(table)s may already '
+                            'hold them: %(error)s'),
+                          {'table': table.name, 'first': keys[0],
+                           'last': keys[-1], 'error': e})
+                break
+            if not keys:
+                break
+            elapsed = time.time() - start
+            stats.incr('db.archive.%s' % table.name, len(keys))
+            stats.timing('db.archive.batch', elapsed)
+            batches.append((table.name, len(keys), elapsed))
+            if len(keys) < batch_size:
+                break
+    return batches
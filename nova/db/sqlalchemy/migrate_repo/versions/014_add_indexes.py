@@ -0,0 +1,126 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+
+# Table stub-definitions
+# Just the columns the indexes are on, these are not the actual
+# definitions of the tables.
+#
+instances = Table('instances', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('host', String(length=255)),
+        Column('project_id', String(length=255)),
+        Column('reservation_id', String(length=255)),
+        )
+
+fixed_ips = Table('fixed_ips', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('address', String(length=255)),
+        Column('network_id', Integer()),
+        Column('instance_id', Integer()),
+        Column('reserved', Boolean(create_constraint=True, name=None)),
+        )
+
+floating_ips = Table('floating_ips', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('address', String(length=255)),
+        Column('project_id', String(length=255)),
+        )
+
+services = Table('services', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('host', String(length=255)),
+        Column('binary', String(length=255)),
+        Column('topic', String(length=255)),
+        )
+
+migrations = Table('migrations', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('instance_id', Integer()),
+        Column('status', String(length=255)),
+        )
+
+
+#
+# Indexes to add, each matching the filter_by() calls of the queries in
+# nova/db/sqlalchemy/api.py named next to it.  auth_tokens needs none, as
+# token_hash is its primary key.
+#
+indexes = [
+    # instance_get_all_by_host, instance_get_all_by_project,
+    # instance_get_all_by_reservation
+    Index('instances_host_deleted_idx',
+          instances.c.host, instances.c.deleted),
+    Index('instances_project_id_deleted_idx',
+          instances.c.project_id, instances.c.deleted),
+    Index('instances_reservation_id_deleted_idx',
+          instances.c.reservation_id, instances.c.deleted),
+    # fixed_ip_get_by_address, fixed_ip_associate
+    Index('fixed_ips_address_deleted_idx',
+          fixed_ips.c.address, fixed_ips.c.deleted),
+    # fixed_ip_associate_pool, network_count_*, network_get_associated_*
+    Index('fixed_ips_network_id_reserved_deleted_idx',
+          fixed_ips.c.network_id, fixed_ips.c.reserved, fixed_ips.c.deleted),
+    # fixed_ip_get_all_by_instance
+    Index('fixed_ips_instance_id_deleted_idx',
+          fixed_ips.c.instance_id, fixed_ips.c.deleted),
+    # floating_ip_get_by_address, floating_ip_get_all_by_project
+    Index('floating_ips_address_deleted_idx',
+          floating_ips.c.address, floating_ips.c.deleted),
+    Index('floating_ips_project_id_deleted_idx',
+          floating_ips.c.project_id, floating_ips.c.deleted),
+    # service_get_all_by_topic, service_get_by_host_and_topic,
+    # service_get_by_args
+    Index('services_topic_host_deleted_idx',
+          services.c.topic, services.c.host, services.c.deleted),
+    Index('services_host_binary_deleted_idx',
+          services.c.host, services.c.binary, services.c.deleted),
+    # migration_get_by_instance_and_status
+    Index('migrations_instance_id_status_idx',
+          migrations.c.instance_id, migrations.c.status),
+    ]
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    for index in indexes:
+        try:
+            index.create(migrate_engine)
+        except Exception:
+            logging.info(repr(index))
+            logging.exception('Exception while creating index')
+            raise
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for index in indexes:
+        index.drop(migrate_engine)
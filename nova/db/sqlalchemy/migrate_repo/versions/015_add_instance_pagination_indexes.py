@@ -0,0 +1,78 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+
+# Table stub-definitions
+# Just the columns the indexes are on, these are not the actual
+# definitions of the tables.
+#
+instances = Table('instances', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('created_at', DateTime(timezone=False)),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('project_id', String(length=255)),
+        Column('user_id', String(length=255)),
+        )
+
+
+#
+# instance_get_all_by_filters orders by (created_at, id), so these let it
+# read a page straight off the index instead of sorting every match.
+#
+project_idx = Index('instances_project_id_deleted_idx',
+                    instances.c.project_id, instances.c.deleted)
+
+indexes = [
+    Index('instances_project_id_deleted_created_at_id_idx',
+          instances.c.project_id, instances.c.deleted,
+          instances.c.created_at, instances.c.id),
+    Index('instances_user_id_deleted_created_at_id_idx',
+          instances.c.user_id, instances.c.deleted,
+          instances.c.created_at, instances.c.id),
+    Index('instances_deleted_created_at_id_idx',
+          instances.c.deleted, instances.c.created_at, instances.c.id),
+    ]
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    for index in indexes:
+        try:
+            index.create(migrate_engine)
+        except Exception:
+            logging.info(repr(index))
+            logging.exception('Exception while creating index')
+            raise
+    # NOTE: a prefix of the new project index, so no longer needed
+    project_idx.drop(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    project_idx.create(migrate_engine)
+    for index in indexes:
+        index.drop(migrate_engine)
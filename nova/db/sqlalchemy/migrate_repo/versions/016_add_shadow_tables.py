@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+
+#
+# Soft-deleted rows of these tables are moved to shadow_<table> by
+# db.archive_deleted_rows.  The shadow tables have the same columns, but
+# no foreign keys or indexes, so archiving never has to update them.
+#
+tables = ['instance_actions', 'instance_metadata',
+          'security_group_instance_association', 'security_group_rules',
+          'security_groups', 'migrations', 'instances', 'auth_tokens']
+
+
+def _shadow(table):
+    columns = [Column(column.name, column.type,
+                      primary_key=column.primary_key,
+                      autoincrement=False)
+               for column in table.columns]
+    return Table('shadow_%s' % table.name, meta, *columns)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    for name in tables:
+        shadow = _shadow(Table(name, meta, autoload=True))
+        try:
+            shadow.create()
+        except Exception:
+            logging.info(repr(shadow))
+            logging.exception('Exception while creating table')
+            raise
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for name in tables:
+        Table('shadow_%s' % name, meta, autoload=True).drop()
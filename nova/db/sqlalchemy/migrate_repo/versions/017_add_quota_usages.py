@@ -0,0 +1,112 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+from nova import log as logging
+
+
+meta = MetaData()
+
+# Just the columns usage is counted from, these are not the actual
+# definitions of the tables.
+instances = Table('instances', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('project_id', String(length=255)),
+        Column('vcpus', Integer()),
+        )
+
+volumes = Table('volumes', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('project_id', String(length=255)),
+        Column('size', Integer()),
+        )
+
+floating_ips = Table('floating_ips', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('project_id', String(length=255)),
+        )
+
+#
+# New Tables
+#
+
+quota_usages = Table('quota_usages', meta,
+        Column('created_at', DateTime(timezone=False)),
+        Column('updated_at', DateTime(timezone=False)),
+        Column('deleted_at', DateTime(timezone=False)),
+        Column('deleted', Boolean(create_constraint=True, name=None)),
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('project_id', String(length=255)),
+        Column('resource', String(length=255)),
+        Column('in_use', Integer()),
+        Column('reserved', Integer()),
+        UniqueConstraint('project_id', 'resource'),
+        )
+
+
+def _counts(table, resource, amount=None):
+    """Yields (project_id, resource, in_use) for the live rows of table"""
+    if amount is None:
+        amount = table.c.id
+        total = func.count(amount)
+    else:
+        total = func.sum(amount)
+    query = select([table.c.project_id, total],
+                   and_(table.c.deleted == False,
+                        table.c.project_id != None)).\
+            group_by(table.c.project_id)
+    for project_id, in_use in query.execute():
+        yield project_id, resource, in_use or 0
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    try:
+        quota_usages.create()
+    except Exception:
+        logging.info(repr(quota_usages))
+        logging.exception('Exception while creating table')
+        raise
+
+    # NOTE: start the counters from what the projects use right now
+    usages = []
+    for table, resource, amount in ((instances, 'instances', None),
+                                    (instances, 'cores', instances.c.vcpus),
+                                    (volumes, 'volumes', None),
+                                    (volumes, 'gigabytes', volumes.c.size),
+                                    (floating_ips, 'floating_ips', None)):
+        usages.extend(_counts(table, resource, amount))
+    if usages:
+        quota_usages.insert().execute([{'deleted': False,
+                                        'project_id': project_id,
+                                        'resource': resource,
+                                        'in_use': in_use,
+                                        'reserved': 0}
+                                       for project_id, resource, in_use
+                                       in usages])
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    quota_usages.drop()
@@ -321,6 +321,24 @@ class Quota(BASE, NovaBase):
     metadata_items = Column(Integer)
 
 
+class QuotaUsage(BASE, NovaBase):
+    """Represents how much of a resource a project uses and has reserved.
+
+    Kept up to date by the db calls that create and destroy the resources,
+    so checking a quota never has to count rows.
+    """
+    __tablename__ = 'quota_usages'
+    __table_args__ = (schema.UniqueConstraint('project_id', 'resource'),
+                      {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, primary_key=True)
+
+    project_id = Column(String(255))
+    resource = Column(String(255))
+
+    in_use = Column(Integer, default=0)
+    reserved = Column(Integer, default=0)
+
+
 class ExportDevice(BASE, NovaBase):
     """Represates a shelf and blade that a volume can be exported on."""
     __tablename__ = 'export_devices'
@@ -649,7 +667,7 @@ def register_models():
               Network, SecurityGroup, SecurityGroupIngressRule,
               SecurityGroupInstanceAssociation, AuthToken, User,
               Project, Certificate, ConsolePool, Console, Zone,
-              InstanceMetadata, Migration)
+              InstanceMetadata, Migration, QuotaUsage)
     engine = create_engine(FLAGS.sql_connection, echo=False)
     for model in models:
         model.metadata.create_all(engine)
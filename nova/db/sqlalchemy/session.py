@@ -19,37 +19,163 @@
 Session Handling for SQLAlchemy backend
 """
 
+import os
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy import exc
+from sqlalchemy import interfaces
 from sqlalchemy import pool
 from sqlalchemy.orm import sessionmaker
 
 from nova import exception
 from nova import flags
+from nova import log as logging
+from nova import stats
+from nova.db import querycount
 
 FLAGS = flags.FLAGS
+LOG = logging.getLogger('nova.db.sqlalchemy.session')
 
 _ENGINE = None
 _MAKER = None
+_SLAVE_ENGINE = None
+_SLAVE_MAKER = None
+
+
+class StatsQueuePool(pool.QueuePool):
+    """QueuePool that records its size and checkout waits in nova.stats
+
+    A checkout waits when every connection is in use and no more overflow
+    is allowed; those are counted as sql.pool.waits and timed as
+    sql.pool.wait.
+    """
+
+    def do_get(self):
+        exhausted = (self._max_overflow > -1 and
+                     self.checkedout() >= self.size() + self._max_overflow)
+        start = time.time()
+        try:
+            return super(StatsQueuePool, self).do_get()
+        finally:
+            if exhausted:
+                stats.incr('sql.pool.waits')
+                stats.timing('sql.pool.wait', time.time() - start)
+            self._record()
+
+    def do_return_conn(self, conn):
+        super(StatsQueuePool, self).do_return_conn(conn)
+        self._record()
+
+    def _record(self):
+        stats.gauge('sql.pool.size', self.size())
+        stats.gauge('sql.pool.checked_out', self.checkedout())
+        stats.gauge('sql.pool.overflow', max(self.overflow(), 0))
+
+    def recreate(self):
+        LOG.info(_('Recreating sql connection pool'))
+        return StatsQueuePool(self._creator, pool_size=self._pool.maxsize,
+                              max_overflow=self._max_overflow,
+                              timeout=self._timeout,
+                              recycle=self._recycle, echo=self.echo,
+                              logging_name=self._orig_logging_name,
+                              use_threadlocal=self._use_threadlocal,
+                              listeners=self.listeners)
+
+
+class PingListener(interfaces.PoolListener):
+    """Replaces connections that died while sitting in the pool
+
+    Raising DisconnectionError makes the pool throw the connection away
+    and check out a new one, so a database failover doesn't surface as a
+    burst of DBErrors.
+    """
 
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        try:
+            dbapi_con.cursor().execute('SELECT 1')
+        except Exception, e:
+            LOG.warn(_('Replacing dead sql connection: %s'), e)
+            stats.incr('sql.pool.reconnects')
+            raise exc.DisconnectionError(str(e))
 
-def get_session(autocommit=True, expire_on_commit=False):
-    """Helper method to grab session"""
+
+class QueryCountingProxy(interfaces.ConnectionProxy):
+    """Adds every statement run, and how long it took, to the query counts
+
+    See nova.db.querycount.
+    """
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        start = time.time()
+        try:
+            return execute(cursor, statement, parameters, context)
+        finally:
+            querycount.record(time.time() - start)
+
+
+def get_session(autocommit=True, expire_on_commit=False, read_only=False):
+    """Helper method to grab session
+
+    Pass read_only=True for queries that can tolerate replication lag,
+    like listings: they then go to FLAGS.sql_slave_connection if it is set.
+    Never use it for writes or with_lockmode('update'), for reading back
+    rows just written, or for reads that scheduling, liveness or a
+    service's own startup act on.
+    """
     global _ENGINE
     global _MAKER
-    if not _MAKER:
-        if not _ENGINE:
-            kwargs = {'pool_recycle': FLAGS.sql_idle_timeout,
-                      'echo': False}
-
-            if FLAGS.sql_connection.startswith('sqlite'):
-                kwargs['poolclass'] = pool.NullPool
-
-            _ENGINE = create_engine(FLAGS.sql_connection,
-                                    **kwargs)
-        _MAKER = (sessionmaker(bind=_ENGINE,
-                                autocommit=autocommit,
-                                expire_on_commit=expire_on_commit))
-    session = _MAKER()
+    global _SLAVE_ENGINE
+    global _SLAVE_MAKER
+    if read_only and FLAGS.sql_slave_connection:
+        if not _SLAVE_MAKER:
+            if not _SLAVE_ENGINE:
+                _SLAVE_ENGINE = create_engine(
+                        FLAGS.sql_slave_connection,
+                        **_engine_kwargs(FLAGS.sql_slave_connection))
+            _SLAVE_MAKER = (sessionmaker(bind=_SLAVE_ENGINE,
+                                         autocommit=autocommit,
+                                         expire_on_commit=expire_on_commit))
+        maker = _SLAVE_MAKER
+    else:
+        if not _MAKER:
+            if not _ENGINE:
+                _ENGINE = create_engine(
+                        FLAGS.sql_connection,
+                        **_engine_kwargs(FLAGS.sql_connection))
+            _MAKER = (sessionmaker(bind=_ENGINE,
+                                    autocommit=autocommit,
+                                    expire_on_commit=expire_on_commit))
+        maker = _MAKER
+    session = maker()
     session.query = exception.wrap_db_error(session.query)
     session.flush = exception.wrap_db_error(session.flush)
     return session
+
+
+def _tpool_size():
+    """Returns the number of native threads eventlet's tpool runs"""
+    return int(os.environ.get('EVENTLET_THREADPOOL_SIZE', 20))
+
+
+def _engine_kwargs(connection):
+    """Returns create_engine arguments for the connection string"""
+    kwargs = {'pool_recycle': FLAGS.sql_idle_timeout,
+              'echo': False,
+              'proxy': QueryCountingProxy()}
+    if FLAGS.sql_pool_pre_ping:
+        kwargs['listeners'] = [PingListener()]
+
+    if connection.startswith('sqlite'):
+        kwargs['poolclass'] = pool.NullPool
+    else:
+        kwargs['poolclass'] = StatsQueuePool
+        kwargs['pool_size'] = FLAGS.sql_pool_size
+        if FLAGS.sql_use_tpool:
+            # NOTE: a connection per thread, so no call ever waits on the
+            #       pool while holding a thread
+            kwargs['pool_size'] = max(FLAGS.sql_pool_size, _tpool_size())
+        kwargs['max_overflow'] = FLAGS.sql_max_overflow
+        kwargs['pool_timeout'] = FLAGS.sql_pool_timeout
+    return kwargs
@@ -35,6 +35,15 @@ class Client(object):
             return value
         return None
 
+    def get_multi(self, keys):
+        """Retrieves a dict of the values of the keys that are set."""
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
         timeout = 0
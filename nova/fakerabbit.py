@@ -18,10 +18,8 @@
 
 """Based a bit on the carrot.backeds.queue backend... but a lot better."""
 
-import Queue as queue
-
 from carrot.backends import base
-from eventlet import greenthread
+from eventlet import queue
 
 from nova import log as logging
 
@@ -37,31 +35,49 @@ class Message(base.BaseMessage):
     pass
 
 
+class PreconditionFailed(Exception):
+    """Raised like AMQP's 406 when an exchange is redeclared differently"""
+    pass
+
+
 class Exchange(object):
-    def __init__(self, name, exchange_type):
+    def __init__(self, name, exchange_type, durable=True, auto_delete=False):
         self.name = name
         self.exchange_type = exchange_type
-        self._queue = queue.Queue()
+        self.durable = durable
+        self.auto_delete = auto_delete
         self._routes = {}
 
+    def check_declare(self, exchange_type, durable, auto_delete):
+        """Fails unless a redeclaration matches, as a real broker does"""
+        declared = (self.exchange_type, self.durable, self.auto_delete)
+        if declared != (exchange_type, durable, auto_delete):
+            raise PreconditionFailed(
+                    _('Exchange %(name)s declared as %(declared)s, '
+                      'redeclared as %(redeclared)s') %
+                    {'name': self.name, 'declared': declared,
+                     'redeclared': (exchange_type, durable, auto_delete)})
+
     def publish(self, message, routing_key=None):
-        nm = self.name
         LOG.debug(_('(%(nm)s) publish (key: %(routing_key)s)'
-                ' %(message)s') % locals())
-        if routing_key in self._routes:
-            for f in self._routes[routing_key]:
-                LOG.debug(_('Publishing to route %s'), f)
-                f(message, routing_key=routing_key)
+                ' %(message)s'), {'nm': self.name,
+                                  'routing_key': routing_key,
+                                  'message': message})
+        for f in self._routes.get(routing_key, ()):
+            f(message, routing_key=routing_key)
 
     def bind(self, callback, routing_key):
-        self._routes.setdefault(routing_key, [])
-        self._routes[routing_key].append(callback)
+        # NOTE: like AMQP, binding a queue twice with one key is a no-op,
+        #       otherwise services sharing a topic queue get duplicates
+        routes = self._routes.setdefault(routing_key, [])
+        if callback not in routes:
+            routes.append(callback)
 
 
 class Queue(object):
     def __init__(self, name):
         self.name = name
-        self._queue = queue.Queue()
+        self._queue = queue.LightQueue()
 
     def __repr__(self):
         return '<Queue: %s>' % self.name
@@ -83,11 +99,15 @@ class Backend(base.BaseBackend):
             LOG.debug(_('Declaring queue %s'), queue)
             QUEUES[queue] = Queue(queue)
 
-    def exchange_declare(self, exchange, type, *args, **kwargs):
+    def exchange_declare(self, exchange, type, durable=True,
+                         auto_delete=False, *args, **kwargs):
         global EXCHANGES
         if exchange not in EXCHANGES:
             LOG.debug(_('Declaring exchange %s'), exchange)
-            EXCHANGES[exchange] = Exchange(exchange, type)
+            EXCHANGES[exchange] = Exchange(exchange, type, durable,
+                                           auto_delete)
+        else:
+            EXCHANGES[exchange].check_declare(type, durable, auto_delete)
 
     def queue_bind(self, queue, exchange, routing_key, **kwargs):
         global EXCHANGES
@@ -101,23 +121,30 @@ class Backend(base.BaseBackend):
         self.current_callback = callback
 
     def consume(self, limit=None):
-        while True:
-            item = self.get(self.current_queue)
-            if item:
-                self.current_callback(item)
-                raise StopIteration()
-            greenthread.sleep(0)
+        """Blocks until messages are pushed to the queue, like amqplib"""
+        global QUEUES
+        queue = self.current_queue
+        received = 0
+        while limit is None or received < limit:
+            message = self._to_message(queue, QUEUES[queue].pop())
+            self.current_callback(message)
+            received += 1
+            yield True
 
     def get(self, queue, no_ack=False):
         global QUEUES
         if not queue in QUEUES or not QUEUES[queue].size():
             return None
-        (message_data, content_type, content_encoding) = QUEUES[queue].pop()
+        return self._to_message(queue, QUEUES[queue].pop())
+
+    def _to_message(self, queue, item):
+        (message_data, content_type, content_encoding) = item
         message = Message(backend=self, body=message_data,
                           content_type=content_type,
                           content_encoding=content_encoding)
         message.result = True
-        LOG.debug(_('Getting from %(queue)s: %(message)s') % locals())
+        LOG.debug(_('Getting from %(queue)s: %(message)s'),
+                  {'queue': queue, 'message': message})
         return message
 
     def prepare_message(self, message_data, delivery_mode,
@@ -293,6 +293,8 @@ DEFINE_string('rabbit_virtual_host', '/', 'rabbit virtual host')
 DEFINE_integer('rabbit_retry_interval', 10, 'rabbit connection retry interval')
 DEFINE_integer('rabbit_max_retries', 12, 'rabbit connection attempts')
 DEFINE_string('control_exchange', 'nova', 'the main exchange to connect to')
+DEFINE_list('memcached_servers', None,
+            'Memcached servers or None for in process cache.')
 DEFINE_string('ec2_host', '$my_ip', 'ip of api server')
 DEFINE_string('ec2_dmz_host', '$my_ip', 'internal ip of api server')
 DEFINE_integer('ec2_port', 8773, 'cloud controller port')
@@ -330,11 +332,29 @@ DEFINE_string('sqlite_db', 'nova.sqlite', 'file name for sqlite')
 DEFINE_string('sql_connection',
               'sqlite:///$state_path/$sqlite_db',
               'connection string for sql database')
+DEFINE_string('sql_slave_connection', '',
+              'connection string for a read-only replica of the sql'
+              ' database, used for listings when set')
 DEFINE_integer('sql_idle_timeout',
               3600,
               'timeout for idle sql database connections')
 DEFINE_integer('sql_max_retries', 12, 'sql connection attempts')
 DEFINE_integer('sql_retry_interval', 10, 'sql connection retry interval')
+DEFINE_integer('sql_pool_size', 5,
+               'number of sql connections kept open per process')
+DEFINE_integer('sql_max_overflow', 10,
+               'sql connections opened beyond sql_pool_size under load,'
+               ' -1 for no limit')
+DEFINE_integer('sql_pool_timeout', 30,
+               'seconds to wait for a free sql connection before failing')
+DEFINE_boolean('sql_pool_pre_ping', True,
+               'check sql connections are alive when checking them out of'
+               ' the pool, replacing dead ones')
+DEFINE_boolean('sql_use_tpool', False,
+               'run db api calls in native threads so slow queries do not'
+               ' block other green threads. eventlet starts as many threads'
+               ' as the EVENTLET_THREADPOOL_SIZE environment variable says'
+               ' (default 20), sql_pool_size is raised to match')
 
 DEFINE_string('compute_manager', 'nova.compute.manager.ComputeManager',
               'Manager for compute')
@@ -346,6 +366,11 @@ DEFINE_string('volume_manager', 'nova.volume.manager.VolumeManager',
               'Manager for volume')
 DEFINE_string('scheduler_manager', 'nova.scheduler.manager.SchedulerManager',
               'Manager for scheduler')
+DEFINE_boolean('scheduler_run_instances', False,
+               'Send a multi-instance launch to the scheduler as one '
+               'run_instances cast instead of one run_instance cast per '
+               'instance. Only enable once every scheduler understands '
+               'run_instances, older ones drop the message')
 
 # The service to use for image search and retrieval
 DEFINE_string('image_service', 'nova.image.local.LocalImageService',
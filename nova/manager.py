@@ -53,6 +53,7 @@ This module provides Manager, a base class for managers.
 
 from nova import utils
 from nova import flags
+from nova import stats
 from nova.db import base
 
 
@@ -74,3 +75,7 @@ class Manager(base.Base):
         """Do any initialization that needs to be run if this is a standalone
         service. Child classes should override this method."""
         pass
+
+    def report_stats(self, context=None):
+        """Returns the timings, counters and gauges of this service"""
+        return stats.report()
@@ -46,10 +46,15 @@ class API(base.Base):
         #             when we allocate, so just send it to any one.  This
         #             will probably need to move into a network supervisor
         #             at some point.
-        return rpc.call(context,
-                        FLAGS.network_topic,
-                        {"method": "allocate_floating_ip",
-                         "args": {"project_id": context.project_id}})
+        reservation = quota.reserve(context, floating_ips=1)
+        try:
+            address = rpc.call(context,
+                               FLAGS.network_topic,
+                               {"method": "allocate_floating_ip",
+                                "args": {"project_id": context.project_id}})
+        finally:
+            quota.release(context, reservation)
+        return address
 
     def release_floating_ip(self, context, address):
         floating_ip = self.db.floating_ip_get_by_address(context, address)
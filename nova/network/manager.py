@@ -47,6 +47,7 @@ topologies.  All of the network commands are issued to a subclass of
 import datetime
 import math
 import socket
+import struct
 
 import IPy
 
@@ -105,6 +106,21 @@ class AddressAlreadyAllocated(exception.Error):
     pass
 
 
+def _addresses(net):
+    """Yields every address of an IPy network as a string
+
+    Indexing IPy networks builds an IP object per address, which dominates
+    creating large networks, so IPv4 addresses are formatted directly.
+    """
+    if net.version() != 4:
+        for address in net:
+            yield str(address)
+        return
+    first = net.int()
+    for value in xrange(first, first + len(net)):
+        yield socket.inet_ntoa(struct.pack('!I', value))
+
+
 class NetworkManager(manager.Manager):
     """Implements common network manager functionality.
 
@@ -346,15 +362,16 @@ class NetworkManager(manager.Manager):
         top_reserved = self._top_reserved_ips
         project_net = IPy.IP(network_ref['cidr'])
         num_ips = len(project_net)
-        for index in range(num_ips):
-            address = str(project_net[index])
+        ips = []
+        for index, address in enumerate(_addresses(project_net)):
             if index < bottom_reserved or num_ips - index < top_reserved:
                 reserved = True
             else:
                 reserved = False
-            self.db.fixed_ip_create(context, {'network_id': network_id,
-                                              'address': address,
-                                              'reserved': reserved})
+            ips.append({'network_id': network_id,
+                        'address': address,
+                        'reserved': reserved})
+        self.db.fixed_ip_bulk_create(context, ips)
 
 
 class FlatManager(NetworkManager):
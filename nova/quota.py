@@ -17,6 +17,21 @@
 #    under the License.
 """
 Quotas for instances, volumes, and floating ips
+
+Usage is read from the quota_usages table, which the db calls creating
+and destroying instances, volumes and floating ips keep up to date.  To
+make sure concurrent requests can't overshoot a quota between checking it
+and creating the resources, callers reserve what they are about to create
+and release the reservation once they are done creating it::
+
+    reservation = quota.reserve(context, instances=1, cores=2)
+    try:
+        ...
+    finally:
+        quota.release(context, reservation)
+
+Reservations a caller never released, because its process died, are
+dropped by a later reserve once quota_reservation_expire has passed.
 """
 
 from nova import db
@@ -25,6 +40,9 @@ from nova import flags
 
 FLAGS = flags.FLAGS
 
+flags.DEFINE_integer('quota_reservation_expire', 3600,
+                     'seconds after which a project\'s reservations are '
+                     'dropped if its usage has not changed meanwhile')
 flags.DEFINE_integer('quota_instances', 10,
                      'number of instances allowed per project')
 flags.DEFINE_integer('quota_cores', 20,
@@ -63,12 +81,20 @@ def get_quota(context, project_id):
     return rval
 
 
+def get_usage(context, project_id):
+    """Returns {resource: amount in use or reserved} for a project"""
+    usages = db.quota_usage_get_all_by_project(context, project_id)
+    return dict((resource, usage['in_use'] + usage['reserved'])
+                for resource, usage in usages.iteritems())
+
+
 def allowed_instances(context, num_instances, instance_type):
     """Check quota and return min(num_instances, allowed_instances)"""
     project_id = context.project_id
     context = context.elevated()
-    used_instances, used_cores = db.instance_data_get_for_project(context,
-                                                                  project_id)
+    usage = get_usage(context, project_id)
+    used_instances = usage.get('instances', 0)
+    used_cores = usage.get('cores', 0)
     quota = get_quota(context, project_id)
     allowed_instances = quota['instances'] - used_instances
     allowed_cores = quota['cores'] - used_cores
@@ -82,8 +108,9 @@ def allowed_volumes(context, num_volumes, size):
     """Check quota and return min(num_volumes, allowed_volumes)"""
     project_id = context.project_id
     context = context.elevated()
-    used_volumes, used_gigabytes = db.volume_data_get_for_project(context,
-                                                                  project_id)
+    usage = get_usage(context, project_id)
+    used_volumes = usage.get('volumes', 0)
+    used_gigabytes = usage.get('gigabytes', 0)
     quota = get_quota(context, project_id)
     allowed_volumes = quota['volumes'] - used_volumes
     allowed_gigabytes = quota['gigabytes'] - used_gigabytes
@@ -98,7 +125,7 @@ def allowed_floating_ips(context, num_floating_ips):
     """Check quota and return min(num_floating_ips, allowed_floating_ips)"""
     project_id = context.project_id
     context = context.elevated()
-    used_floating_ips = db.floating_ip_count_by_project(context, project_id)
+    used_floating_ips = get_usage(context, project_id).get('floating_ips', 0)
     quota = get_quota(context, project_id)
     allowed_floating_ips = quota['floating_ips'] - used_floating_ips
     return min(num_floating_ips, allowed_floating_ips)
@@ -113,6 +140,35 @@ def allowed_metadata_items(context, num_metadata_items):
     return min(num_metadata_items, num_allowed_metadata_items)
 
 
+def reserve(context, **deltas):
+    """Reserve resources for the context's project, e.g. instances=2
+
+    Raises QuotaError, reserving nothing, if that would exceed a quota.
+    Returns the reservation to pass to release.
+    """
+    project_id = context.project_id
+    context = context.elevated()
+    try:
+        db.quota_reserve(context, project_id, deltas,
+                         get_quota(context, project_id),
+                         expire=FLAGS.quota_reservation_expire)
+    except db.QuotaUsageExceeded, e:
+        raise QuotaError(_("Quota exceeded for %(project_id)s, cannot "
+                           "reserve more %(e)s") % locals())
+    return {'project_id': project_id, 'deltas': deltas}
+
+
+def release(context, reservation):
+    """Drop a reservation once its resources are created or have failed
+
+    The db calls that create the resources add them to the usage
+    themselves, so whether creating them worked or not, all that is left
+    to do is drop the reservation.
+    """
+    db.quota_release(context.elevated(), reservation['project_id'],
+                     reservation['deltas'])
+
+
 def allowed_injected_files(context):
     """Return the number of injected files allowed"""
     return FLAGS.quota_max_injected_files
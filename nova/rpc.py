@@ -18,10 +18,12 @@
 
 """
 AMQP-based RPC. Queues have consumers and publishers.
-No fan-out support yet.
+Every service of a topic also binds to the topic's fanout exchange.
 """
 
+import inspect
 import json
+import marshal
 import sys
 import time
 import traceback
@@ -29,14 +31,20 @@ import uuid
 
 from carrot import connection as carrot_connection
 from carrot import messaging
+from carrot import serialization
 from eventlet import greenpool
 from eventlet import greenthread
+from eventlet import pools
+from eventlet import queue
+from eventlet import semaphore
+import greenlet
 
 from nova import context
 from nova import exception
 from nova import fakerabbit
 from nova import flags
 from nova import log as logging
+from nova import stats
 from nova import utils
 
 
@@ -44,10 +52,110 @@ FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.rpc')
 
 flags.DEFINE_integer('rpc_thread_pool_size', 1024, 'Size of RPC thread pool')
+flags.DEFINE_integer('rpc_conn_pool_size', 30,
+                     'Size of RPC connection pool used for publishing')
+flags.DEFINE_integer('rpc_response_timeout', 60,
+                     'Seconds to wait for a response from an rpc call')
+flags.DEFINE_integer('rpc_clock_skew', 5,
+                     'Seconds the clocks of two hosts may differ by. A call'
+                     ' is only dropped as expired once it has been queued'
+                     ' this much longer than its caller would wait')
+flags.DEFINE_boolean('rpc_shared_reply_queue', False,
+                     'Have rpc calls ask for their replies on one reply'
+                     ' queue per process instead of an exchange per call.'
+                     ' Services that predate the shared queue still reply'
+                     ' to the exchange, so the call times out: only enable'
+                     ' once every service is upgraded')
+flags.DEFINE_string('rpc_serializer', 'json',
+                    'Serializer for rpc messages this service sends: json or'
+                    ' marshal. Nothing is negotiated: replies use the'
+                    ' serializer of the request, but casts and calls use'
+                    ' this one, so only switch to marshal once every'
+                    ' service understands it. marshal carries only what json'
+                    ' can (tuples arrive as lists, strings as unicode) and'
+                    ' its format is tied to the Python release, so every'
+                    ' service must run the same one')
+flags.DEFINE_integer('rpc_prefetch_count', 32,
+                     'Messages a consumer may hold before it starts them.'
+                     ' Running calls are acked and do not count, calls'
+                     ' waiting on rpc_method_concurrency or a full pool do.'
+                     ' At most rpc_thread_pool_size')
+flags.DEFINE_list('rpc_method_concurrency', [],
+                  'Limits on concurrent calls per method in a service, as'
+                  ' method:limit pairs, e.g. run_instance:4')
+
+
+_MARSHAL_VERSION = 2
+_MARSHAL_SCALARS = (unicode, int, long, float, bool, type(None))
+
+
+def _marshal_key(key):
+    """Converts a dict key the way json does, keys are always strings"""
+    if isinstance(key, str):
+        return key.decode('utf-8')
+    if isinstance(key, unicode):
+        return key
+    return unicode(json.dumps(key))
+
+
+def _marshal_primitive(value):
+    """Converts value to what json would decode it as"""
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, _MARSHAL_SCALARS):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_marshal_primitive(item) for item in value]
+    if isinstance(value, dict):
+        return dict((_marshal_key(key), _marshal_primitive(item))
+                    for key, item in value.iteritems())
+    primitive = utils.to_primitive(value)
+    if primitive is value:
+        raise TypeError(_('%r can not be sent over rpc') % value)
+    return _marshal_primitive(primitive)
+
+
+def _marshal_check(value):
+    """Fails unless value holds only the types _marshal_primitive makes"""
+    if isinstance(value, list):
+        for item in value:
+            _marshal_check(item)
+    elif isinstance(value, dict):
+        for key, item in value.iteritems():
+            if not isinstance(key, unicode):
+                raise ValueError(_('Unexpected key in marshal data'))
+            _marshal_check(item)
+    elif not isinstance(value, _MARSHAL_SCALARS):
+        raise ValueError(_('Unexpected %s in marshal data') % type(value))
+
+
+def _marshal_encode(data):
+    """Marshals the json types of data, in a fixed marshal version"""
+    return marshal.dumps(_marshal_primitive(data), _MARSHAL_VERSION)
+
+
+def _marshal_decode(data):
+    """Unmarshals data, refusing anything but json types like code objects"""
+    value = marshal.loads(data)
+    _marshal_check(value)
+    return value
+
+
+# NOTE: carrot picks the decoder from the content type of each message it
+#       receives, so registering here is all consumers need
+serialization.registry.register('marshal', _marshal_encode, _marshal_decode,
+                                content_type='application/x-nova-marshal',
+                                content_encoding='binary')
+CONTENT_TYPES = {'application/json': 'json',
+                 'application/x-nova-marshal': 'marshal'}
 
 
 class Connection(carrot_connection.BrokerConnection):
     """Connection instance object"""
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+        self.publishers = {}
+
     @classmethod
     def instance(cls, new=True):
         """Returns the instance"""
@@ -77,6 +185,88 @@ class Connection(carrot_connection.BrokerConnection):
         del cls._instance
         return cls.instance()
 
+    def get_publisher(self, publisher_cls, topic):
+        """Returns a publisher_cls for topic, reusing it across sends
+
+        Every topic publisher publishes to control_exchange, so one of them
+        serves all topics and publish() puts the topic in the routing key
+        of each message.  Fanout exchanges are per topic, but there are
+        only as many of those as there are kinds of service.
+        """
+        key = publisher_cls
+        if publisher_cls.exchange_type == 'fanout':
+            key = (publisher_cls, topic)
+        if key not in self.publishers:
+            self.publishers[key] = publisher_cls(connection=self, topic=topic)
+        return self.publishers[key]
+
+    def publish(self, publisher_cls, topic, msg):
+        """Sends msg on topic with the publisher_cls of this connection"""
+        self.get_publisher(publisher_cls, topic).send(msg, routing_key=topic)
+
+    def close(self):
+        for publisher in self.publishers.values():
+            publisher.close()
+        self.publishers = {}
+        super(Connection, self).close()
+
+
+class Pool(pools.Pool):
+    """Bounded pool of connections used for publishing messages
+
+    Connections keep their publishers open between uses, so casts and
+    calls only pay for channel and exchange setup once per connection.
+    """
+    def create(self):
+        LOG.debug(_('Pool creating new connection'))
+        return Connection.instance(new=True)
+
+    @classmethod
+    def instance(cls):
+        """Returns the pool for this process, creating it if needed"""
+        if not hasattr(cls, '_instance'):
+            cls._instance = cls(max_size=FLAGS.rpc_conn_pool_size)
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        """Closes the pooled connections that are not checked out"""
+        if hasattr(cls, '_instance'):
+            while cls._instance.free_items:
+                _close_quietly(cls._instance.free_items.popleft())
+            del cls._instance
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:  # pylint: disable=W0703
+        LOG.exception(_("Failed to close connection"))
+
+
+def _publish(send):
+    """Runs send with a pooled connection, reconnecting once on failure
+
+    send is a function taking the connection to publish with. A failed
+    connection is replaced in the pool by a new one and send is retried.
+    """
+    pool = Pool.instance()
+    conn = pool.get()
+    try:
+        try:
+            return send(conn)
+        except TypeError:
+            # NOTE: the message could not be serialized, which has
+            #       nothing to do with the state of the connection
+            raise
+        except Exception:  # Catching all because carrot sucks
+            LOG.exception(_("Failed to publish message, reconnecting"))
+            _close_quietly(conn)
+            conn = Connection.instance(new=True)
+            return send(conn)
+    finally:
+        pool.put(conn)
+
 
 class Consumer(messaging.Consumer):
     """Consumer base class
@@ -106,18 +296,22 @@ class Consumer(messaging.Consumer):
                       FLAGS.rabbit_max_retries)
             sys.exit(1)
 
+    def reconnect(self):
+        """Recreates the connection and backend and redeclares the queue"""
+        # NOTE(vish): connection is defined in the parent class, we can
+        #             recreate it as long as we create the backend too
+        # pylint: disable=W0201
+        self.connection = Connection.recreate()
+        self.backend = self.connection.create_backend()
+        self.declare()
+
     def fetch(self, no_ack=None, auto_ack=None, enable_callbacks=False):
         """Wraps the parent fetch with some logic for failed connections"""
         # TODO(vish): the logic for failed connections and logging should be
         #             refactored into some sort of connection manager object
         try:
             if self.failed_connection:
-                # NOTE(vish): connection is defined in the parent class, we can
-                #             recreate it as long as we create the backend too
-                # pylint: disable=W0201
-                self.connection = Connection.recreate()
-                self.backend = self.connection.create_backend()
-                self.declare()
+                self.reconnect()
             super(Consumer, self).fetch(no_ack, auto_ack, enable_callbacks)
             if self.failed_connection:
                 LOG.error(_("Reconnected to queue"))
@@ -130,44 +324,116 @@ class Consumer(messaging.Consumer):
                 LOG.exception(_("Failed to fetch message from queue"))
                 self.failed_connection = True
 
+    def consume_forever(self):
+        """Processes messages as they arrive, reconnecting as fetch does
+
+        Blocks in the backend's consume, which yields to other green
+        threads until the broker delivers a message, instead of polling.
+        """
+        while True:
+            try:
+                if self.failed_connection:
+                    self.reconnect()
+                    LOG.error(_("Reconnected to queue"))
+                    self.failed_connection = False
+                self.wait()
+            except StopIteration:
+                pass
+            except Exception:  # pylint: disable=W0703
+                if not self.failed_connection:
+                    LOG.exception(_("Failed to consume message from queue"))
+                    self.failed_connection = True
+                greenthread.sleep(FLAGS.rabbit_retry_interval)
+
     def attach_to_eventlet(self):
-        """Only needed for unit tests!"""
-        timer = utils.LoopingCall(self.fetch, enable_callbacks=True)
-        timer.start(0.1)
-        return timer
+        """Starts consuming in a green thread and returns a handle to it"""
+        return ConsumerThread(self)
+
+
+class ConsumerThread(object):
+    """Green thread running Consumer.consume_forever
+
+    Has the same stop and wait interface as utils.LoopingCall so services
+    can keep it with their other timers.
+    """
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.thread = greenthread.spawn(consumer.consume_forever)
+
+    def stop(self):
+        self.thread.kill()
+
+    def wait(self):
+        try:
+            return self.thread.wait()
+        except greenlet.GreenletExit:
+            pass
 
 
 class Publisher(messaging.Publisher):
     """Publisher base class"""
-    pass
+    def __init__(self, *args, **kwargs):
+        if not kwargs.get('serializer'):
+            kwargs['serializer'] = FLAGS.rpc_serializer
+        super(Publisher, self).__init__(*args, **kwargs)
 
 
 class TopicConsumer(Consumer):
     """Consumes messages on a specific topic"""
     exchange_type = "topic"
 
-    def __init__(self, connection=None, topic="broadcast"):
+    def __init__(self, connection=None, topic="broadcast", **kwargs):
         self.queue = topic
         self.routing_key = topic
         self.exchange = FLAGS.control_exchange
         self.durable = False
-        super(TopicConsumer, self).__init__(connection=connection)
+        super(TopicConsumer, self).__init__(connection=connection, **kwargs)
 
 
 class AdapterConsumer(TopicConsumer):
     """Calls methods on a proxy object based on method and args"""
-    def __init__(self, connection=None, topic="broadcast", proxy=None):
+    def __init__(self, connection=None, topic="broadcast", proxy=None,
+                 **kwargs):
         LOG.debug(_('Initing the Adapter Consumer for %s') % topic)
         self.proxy = proxy
         self.pool = greenpool.GreenPool(FLAGS.rpc_thread_pool_size)
         super(AdapterConsumer, self).__init__(connection=connection,
-                                              topic=topic)
+                                              topic=topic, **kwargs)
+
+    def consume(self, no_ack=None):
+        """Declares the consumer, bounding the unacked messages it holds
+
+        Messages are acked when their call starts, so the prefetch count
+        bounds the calls waiting in this process for a pool slot or an
+        rpc_method_concurrency limit, not the calls running.  Keeping it
+        small leaves the backlog with the broker, where other consumers
+        of the topic can take it.
+        """
+        prefetch = min(FLAGS.rpc_prefetch_count, FLAGS.rpc_thread_pool_size)
+        self.backend.qos(prefetch_size=0, prefetch_count=prefetch)
+        super(AdapterConsumer, self).consume(no_ack)
 
     def receive(self, *args, **kwargs):
+        # NOTE: spawn_n blocks while the pool is full, which stops us from
+        #       taking more messages off the queue
         self.pool.spawn_n(self._receive, *args, **kwargs)
+        stats.gauge('rpc.%s.pool_in_use' % _stats_topic(self.routing_key),
+                    self.pool.running())
 
-    @exception.wrap_exception
     def _receive(self, message_data, message):
+        """Waits until the method may run another call, then runs it
+
+        The message is only acked once it may run, so messages held back
+        by rpc_method_concurrency count against the prefetch limit.
+        """
+        limit = _method_semaphore(message_data.get('method'))
+        if limit is None:
+            return self._process_data(message_data, message)
+        with limit:
+            return self._process_data(message_data, message)
+
+    @exception.wrap_exception
+    def _process_data(self, message_data, message):
         """Magically looks for a method on the proxy object and calls it
 
         Message data should be a dictionary with two keys:
@@ -176,37 +442,113 @@ class AdapterConsumer(TopicConsumer):
 
         Example: {'method': 'echo', 'args': {'value': 42}}
         """
-        LOG.debug(_('received %s') % message_data)
+        LOG.debug(_('received %s'), message_data)
+        message.ack()
+        serializer = CONTENT_TYPES.get(message.content_type, 'json')
         msg_id = message_data.pop('_msg_id', None)
+        reply_to = message_data.pop('_reply_to', None)
+        timeout = message_data.pop('_timeout', None)
+        sent_at = message_data.pop('_sent_at', None)
 
         ctxt = _unpack_context(message_data)
-
         method = message_data.get('method')
         args = message_data.get('args', {})
-        message.ack()
+        if timeout is not None:
+            # NOTE: sent_at is read off the caller's clock, so the time the
+            #       message queued only counts beyond rpc_clock_skew
+            queued = 0
+            if sent_at:
+                queued = max(time.time() - sent_at - FLAGS.rpc_clock_skew, 0)
+            ctxt.deadline = time.time() + timeout - queued
+            if queued > timeout:
+                LOG.warn(_('Dropping %(method)s, its caller stopped waiting'
+                           ' for it %(late).1f seconds ago')
+                         % {'method': method, 'late': queued - timeout})
+                return
         if not method:
             # NOTE(vish): we may not want to ack here, but that means that bad
             #             messages stay in the queue indefinitely, so for now
             #             we just log the message and send an error string
             #             back to the caller
             LOG.warn(_('no method for message: %s') % message_data)
-            msg_reply(msg_id, _('No method for message: %s') % message_data)
+            msg_reply(msg_id, _('No method for message: %s') % message_data,
+                      reply_to=reply_to, serializer=serializer)
             return
 
+        key = 'rpc.%s.%s' % (_stats_topic(self.routing_key), method)
+        if sent_at:
+            stats.timing('%s.queued' % key, time.time() - sent_at)
         node_func = getattr(self.proxy, str(method))
         node_args = dict((str(k), v) for k, v in args.iteritems())
+        stats.incr('%s.in_flight' % key)
+        start = time.time()
         # NOTE(vish): magic is fun!
         try:
             rval = node_func(context=ctxt, **node_args)
-            if msg_id:
-                msg_reply(msg_id, rval, None)
+            if inspect.isgenerator(rval):
+                # NOTE: stream each item as it is produced, then tell
+                #       multicall there is nothing more to come
+                for item in rval:
+                    if msg_id:
+                        msg_reply(msg_id, item, None, reply_to=reply_to,
+                                  serializer=serializer, ending=False)
+                if msg_id:
+                    msg_reply(msg_id, reply_to=reply_to,
+                              serializer=serializer, ending=True)
+            elif msg_id:
+                msg_reply(msg_id, rval, None, reply_to=reply_to,
+                          serializer=serializer)
         except Exception as e:
+            stats.incr('%s.failures' % key)
             logging.exception("Exception during message handling")
             if msg_id:
-                msg_reply(msg_id, None, sys.exc_info())
+                msg_reply(msg_id, None, sys.exc_info(), reply_to=reply_to,
+                          serializer=serializer)
+        finally:
+            stats.incr('%s.in_flight' % key, -1)
+            stats.timing('%s.execute' % key, time.time() - start)
         return
 
 
+_METHOD_SEMAPHORES = None
+
+
+def _method_semaphore(method):
+    """Returns the semaphore limiting concurrent calls to method, if any
+
+    The semaphores are shared by every consumer in the process, so the
+    limits hold across the topic, host and fanout queues of a service.
+    """
+    global _METHOD_SEMAPHORES
+    if _METHOD_SEMAPHORES is None:
+        _METHOD_SEMAPHORES = {}
+        for pair in FLAGS.rpc_method_concurrency:
+            name, _sep, limit = pair.partition(':')
+            _METHOD_SEMAPHORES[name.strip()] = semaphore.Semaphore(int(limit))
+    return _METHOD_SEMAPHORES.get(method)
+
+
+class FanoutAdapterConsumer(AdapterConsumer):
+    """Calls methods on a proxy object for messages fanned out to a topic
+
+    Each consumer gets its own exclusive queue bound to the topic's fanout
+    exchange, so every service of the topic receives every message.  The
+    exchange is declared exactly as FanoutPublisher declares it, a broker
+    refuses a redeclaration with other flags.
+    """
+    def __init__(self, connection=None, topic="broadcast", proxy=None):
+        super(FanoutAdapterConsumer, self).__init__(
+                connection=connection,
+                topic=topic,
+                proxy=proxy,
+                queue='%s_fanout_%s' % (topic, uuid.uuid4().hex),
+                exchange='%s_fanout' % topic,
+                exchange_type='fanout',
+                durable=False,
+                auto_delete=True,
+                exclusive=True)
+
+
 class TopicPublisher(Publisher):
     """Publishes messages on a specific topic"""
     exchange_type = "topic"
@@ -218,6 +560,18 @@ class TopicPublisher(Publisher):
         super(TopicPublisher, self).__init__(connection=connection)
 
 
+class FanoutPublisher(Publisher):
+    """Publishes messages to every consumer of a topic"""
+    exchange_type = "fanout"
+
+    def __init__(self, connection=None, topic="broadcast"):
+        self.routing_key = topic
+        self.exchange = '%s_fanout' % topic
+        self.durable = False
+        self.auto_delete = True
+        super(FanoutPublisher, self).__init__(connection=connection)
+
+
 class DirectConsumer(Consumer):
     """Consumes messages directly on a channel specified by msg_id"""
     exchange_type = "direct"
@@ -235,17 +589,141 @@ class DirectPublisher(Publisher):
     """Publishes messages directly on a channel specified by msg_id"""
     exchange_type = "direct"
 
-    def __init__(self, connection=None, msg_id=None):
+    def __init__(self, connection=None, msg_id=None, serializer=None):
         self.routing_key = msg_id
         self.exchange = msg_id
         self.auto_delete = True
-        super(DirectPublisher, self).__init__(connection=connection)
+        super(DirectPublisher, self).__init__(connection=connection,
+                                              serializer=serializer)
 
 
-def msg_reply(msg_id, reply=None, failure=None):
+class ReplyWaiter(object):
+    """Hands replies from one shared reply queue to the waiting callers
+
+    Each process declares a single long-lived direct queue for replies.
+    Callers register their msg_id before sending and then read the replies
+    tagged with that msg_id from their own in-memory queue, so concurrent
+    calls share one consumer instead of declaring one each.
+    """
+    def __init__(self, connection=None, reply_to=None):
+        self.reply_to = reply_to or 'reply_%s' % uuid.uuid4().hex
+        self._waiters = {}
+        self.consumer = DirectConsumer(connection=connection,
+                                       msg_id=self.reply_to)
+        self.consumer.register_callback(self._dispatch)
+        self.thread = self.consumer.attach_to_eventlet()
+
+    @classmethod
+    def instance(cls):
+        """Returns the waiter for this process, creating it if needed"""
+        if not hasattr(cls, '_instance'):
+            cls._instance = cls(connection=Connection.instance(new=True))
+        return cls._instance
+
+    @classmethod
+    def reset(cls):
+        """Closes the waiter so the next call declares a new reply queue"""
+        if hasattr(cls, '_instance'):
+            cls._instance.close()
+            del cls._instance
+
+    def _dispatch(self, data, message):
+        """Acks the reply and hands it to the caller waiting for it"""
+        message.ack()
+        self._put(data.get('_msg_id'), data)
+
+    def _put(self, msg_id, data):
+        """Queues the reply data for the caller of msg_id"""
+        replies = self._waiters.get(msg_id)
+        if replies is None:
+            LOG.warn(_("No caller waiting for reply to %s, dropping it"),
+                     msg_id)
+            return
+        if data['failure']:
+            replies.put((True, RemoteError(*data['failure']), True))
+        else:
+            # NOTE: replies without 'ending' come from plain methods (or
+            #       services predating multicall) and are the only reply
+            ending = data.get('ending')
+            replies.put(('result' in data, data.get('result'),
+                         ending is not False))
+
+    def register(self, msg_id):
+        """Starts listening for the replies to msg_id"""
+        self._waiters[msg_id] = queue.LightQueue()
+
+    def cancel(self, msg_id):
+        """Stops listening for the replies to msg_id"""
+        self._waiters.pop(msg_id, None)
+
+    def iter_replies(self, msg_id, deadline):
+        """Yields the replies to msg_id as they arrive
+
+        Raises Timeout if the last reply hasn't arrived by deadline and
+        RemoteError if the callee failed.
+        """
+        replies = self._waiters[msg_id]
+        try:
+            while True:
+                timeout = max(deadline - time.time(), 0)
+                try:
+                    has_result, result, ending = replies.get(timeout=timeout)
+                except queue.Empty:
+                    raise Timeout(_('Timed out after %(timeout).1f seconds'
+                                    ' waiting for reply to %(msg_id)s')
+                                  % locals())
+                if isinstance(result, RemoteError):
+                    raise result
+                if has_result:
+                    yield result
+                if ending:
+                    return
+        finally:
+            self.cancel(msg_id)
+
+    def close(self):
+        self.thread.stop()
+        self.consumer.close()
+
+
+class MsgIdReplyWaiter(ReplyWaiter):
+    """Waits for the replies to a single call on an exchange of its own
+
+    Every call waited this way before the shared reply queue, and services
+    that predate it reply nowhere else, so it is used unless
+    rpc_shared_reply_queue is set.  Those services don't tag their replies
+    with _msg_id, but nothing else is sent to this exchange anyway.
+    """
+    def __init__(self, msg_id):
+        self.msg_id = msg_id
+        super(MsgIdReplyWaiter, self).__init__(
+                connection=Connection.instance(new=True), reply_to=msg_id)
+
+    def _dispatch(self, data, message):
+        message.ack()
+        self._put(self.msg_id, data)
+
+    def cancel(self, msg_id):
+        """Stops listening, the exchange serves no other call"""
+        super(MsgIdReplyWaiter, self).cancel(msg_id)
+        self.close()
+
+    def close(self):
+        super(MsgIdReplyWaiter, self).close()
+        self.consumer.connection.close()
+
+
+def msg_reply(msg_id, reply=None, failure=None, reply_to=None,
+              serializer=None, ending=None):
     """Sends a reply or an error on the channel signified by msg_id
 
-    failure should be a sys.exc_info() tuple.
+    failure should be a sys.exc_info() tuple. If reply_to is given the
+    reply is sent to that shared reply queue, tagged with msg_id.
+    serializer should be one the caller understands, so pass the one its
+    request was sent with.
+
+    A single reply leaves ending as None. Streamed replies are sent with
+    ending=False and followed by ending=True, which carries no result.
 
     """
     if failure:
@@ -254,16 +732,31 @@ def msg_reply(msg_id, reply=None, failure=None):
         LOG.error(_("Returning exception %s to caller"), message)
         LOG.error(tb)
         failure = (failure[0].__name__, str(failure[1]), tb)
-    conn = Connection.instance()
-    publisher = DirectPublisher(connection=conn, msg_id=msg_id)
-    try:
-        publisher.send({'result': reply, 'failure': failure})
-    except TypeError:
-        publisher.send(
-                {'result': dict((k, repr(v))
-                                for k, v in reply.__dict__.iteritems()),
-                 'failure': failure})
-    publisher.close()
+
+    def _send(conn):
+        publisher = DirectPublisher(connection=conn,
+                                    msg_id=reply_to or msg_id,
+                                    serializer=serializer)
+        body = {'failure': failure, '_msg_id': msg_id}
+        if ending is not None:
+            body['ending'] = ending
+        if not ending:
+            body['result'] = reply
+        try:
+            publisher.send(body)
+        except TypeError:
+            body['result'] = dict((k, repr(v))
+                                  for k, v in reply.__dict__.iteritems())
+            publisher.send(body)
+        finally:
+            publisher.close()
+
+    _publish(_send)
+
+
+class Timeout(exception.TimeoutException):
+    """Signifies that an rpc call got no reply before its deadline"""
+    pass
 
 
 class RemoteError(exception.Error):
@@ -303,61 +796,92 @@ def _pack_context(msg, context):
     context out into a bunch of separate keys. If we want to support
     more arguments in rabbit messages, we may want to do the same
     for args at some point.
+
+    The send time goes along too, so the receiver can tell how long the
+    message sat in the queue.
     """
     context = dict([('_context_%s' % key, value)
                    for (key, value) in context.to_dict().iteritems()])
     msg.update(context)
+    msg['_sent_at'] = time.time()
 
 
-def call(context, topic, msg):
-    """Sends a message on a topic and wait for a response"""
+def _stats_topic(topic):
+    """Strips the host from topic so all hosts share the same stats keys"""
+    return topic.partition('.')[0]
+
+
+def multicall(context, topic, msg, timeout=None):
+    """Sends a message on a topic and returns an iterator over the replies
+
+    If the method returns a generator, each item it yields is sent back as
+    its own reply, so the caller can process them before the callee is
+    done. Otherwise the iterator yields the single return value.
+
+    Raises Timeout if the last reply hasn't arrived within timeout
+    seconds, which defaults to FLAGS.rpc_response_timeout. The time left
+    is sent along with the message, and a deadline already set on the
+    context (because we are handling a call ourselves) is never extended.
+    It is sent as seconds rather than a time, which the callee's clock
+    may not agree with.
+    """
     LOG.debug(_("Making asynchronous call on %s ..."), topic)
+    deadline = time.time() + (timeout or FLAGS.rpc_response_timeout)
+    if getattr(context, 'deadline', None):
+        deadline = min(deadline, context.deadline)
     msg_id = uuid.uuid4().hex
-    msg.update({'_msg_id': msg_id})
-    LOG.debug(_("MSG_ID is %s") % (msg_id))
+    if FLAGS.rpc_shared_reply_queue:
+        waiter = ReplyWaiter.instance()
+        msg['_reply_to'] = waiter.reply_to
+    else:
+        waiter = MsgIdReplyWaiter(msg_id)
+    msg.update({'_msg_id': msg_id, '_timeout': deadline - time.time()})
+    LOG.debug(_("MSG_ID is %s"), msg_id)
     _pack_context(msg, context)
 
-    class WaitMessage(object):
-        def __call__(self, data, message):
-            """Acks message and sets result."""
-            message.ack()
-            if data['failure']:
-                self.result = RemoteError(*data['failure'])
-            else:
-                self.result = data['result']
+    waiter.register(msg_id)
+    try:
+        _publish(lambda conn: conn.publish(TopicPublisher, topic, msg))
+    except Exception:
+        waiter.cancel(msg_id)
+        raise
+    return waiter.iter_replies(msg_id, deadline)
 
-    wait_msg = WaitMessage()
-    conn = Connection.instance()
-    consumer = DirectConsumer(connection=conn, msg_id=msg_id)
-    consumer.register_callback(wait_msg)
 
-    conn = Connection.instance()
-    publisher = TopicPublisher(connection=conn, topic=topic)
-    publisher.send(msg)
-    publisher.close()
+def call(context, topic, msg, timeout=None):
+    """Sends a message on a topic and wait for a response
 
+    Returns the last reply when the method streams several, see multicall
+    for timeouts.
+    """
+    start = time.time()
+    key = 'rpc.call.%s.%s' % (_stats_topic(topic), msg.get('method'))
+    result = None
     try:
-        consumer.wait(limit=1)
-    except StopIteration:
-        pass
-    consumer.close()
-    # NOTE(termie): this is a little bit of a change from the original
-    #               non-eventlet code where returning a Failure
-    #               instance from a deferred call is very similar to
-    #               raising an exception
-    if isinstance(wait_msg.result, Exception):
-        raise wait_msg.result
-    return wait_msg.result
+        for result in multicall(context, topic, msg, timeout):
+            pass
+    except Timeout:
+        stats.incr('%s.timeouts' % key)
+        raise
+    stats.timing(key, time.time() - start)
+    return result
 
 
 def cast(context, topic, msg):
     """Sends a message on a topic without waiting for a response"""
     LOG.debug(_("Making asynchronous cast on %s..."), topic)
+    start = time.time()
     _pack_context(msg, context)
-    conn = Connection.instance()
-    publisher = TopicPublisher(connection=conn, topic=topic)
-    publisher.send(msg)
-    publisher.close()
+    _publish(lambda conn: conn.publish(TopicPublisher, topic, msg))
+    stats.timing('rpc.cast.%s.%s' % (_stats_topic(topic), msg.get('method')),
+                 time.time() - start)
+
+
+def fanout_cast(context, topic, msg):
+    """Sends a message to every service of a topic without waiting"""
+    LOG.debug(_("Making asynchronous fanout cast on %s..."), topic)
+    _pack_context(msg, context)
+    _publish(lambda conn: conn.publish(FanoutPublisher, topic, msg))
 
 
 def generic_response(message_data, message):
@@ -21,18 +21,17 @@
 Scheduler base class that all Schedulers should inherit from
 """
 
-import datetime
-
 from nova import db
 from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import rpc
+from nova import servicegroup
 from nova.compute import power_state
+from nova.scheduler import host_state
 
 FLAGS = flags.FLAGS
-flags.DEFINE_integer('service_down_time', 60,
-                     'maximum time since last checkin for up service')
+flags.DECLARE('service_down_time', 'nova.servicegroup.api')
 flags.DECLARE('instances_path', 'nova.compute.manager')
 
 
@@ -49,21 +48,18 @@ class WillNotSchedule(exception.Error):
 class Scheduler(object):
     """The base class that all Scheduler clases should inherit from."""
 
-    @staticmethod
-    def service_is_up(service):
+    def __init__(self):
+        self.servicegroup_api = servicegroup.API()
+        self.host_state_manager = host_state.HostStateManager()
+
+    def service_is_up(self, service):
         """Check whether a service is up based on last heartbeat."""
-        last_heartbeat = service['updated_at'] or service['created_at']
-        # Timestamps in DB are UTC.
-        elapsed = datetime.datetime.utcnow() - last_heartbeat
-        return elapsed < datetime.timedelta(seconds=FLAGS.service_down_time)
+        return self.servicegroup_api.is_up(service)
 
     def hosts_up(self, context, topic):
         """Return the list of hosts that have a running service for topic."""
-
-        services = db.service_get_all_by_topic(context, topic)
-        return [service.host
-                for service in services
-                if self.service_is_up(service)]
+        return [service['host'] for service in
+                self.servicegroup_api.get_all_up(context, topic)]
 
     def schedule(self, context, topic, *_args, **_kwargs):
         """Must override at least this method for scheduler to work."""
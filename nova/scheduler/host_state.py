@@ -0,0 +1,85 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+HostStateManager keeps the capacity and usage of each compute host in memory.
+
+Compute hosts publish their resources to the schedulers every
+periodic_interval, and each placement adds the instance to its host right
+away, so scheduling doesn't have to sum the instances table.  Whether a host
+is up is left to the servicegroup API.
+"""
+
+from nova import log as logging
+
+LOG = logging.getLogger('nova.scheduler.host_state')
+
+RESOURCES = ('vcpus', 'memory_mb', 'local_gb',
+             'vcpus_used', 'memory_mb_used', 'local_gb_used')
+
+
+class HostState(object):
+    """Holds the capacity and usage of a compute host."""
+    def __init__(self, host):
+        self.host = host
+        self.disabled = False
+        self.instance_cores = 0
+        self.resources = dict((key, 0) for key in RESOURCES)
+
+    def update(self, capabilities):
+        """Replaces our state with the state the host published."""
+        self.disabled = capabilities.get('disabled', False)
+        self.instance_cores = capabilities.get('instance_cores', 0)
+        for key in RESOURCES:
+            self.resources[key] = capabilities.get(key) or 0
+
+    def consume(self, instance_ref):
+        """Adds an instance placed on the host until the host publishes."""
+        vcpus = instance_ref['vcpus'] or 0
+        self.instance_cores += vcpus
+        self.resources['vcpus_used'] += vcpus
+        self.resources['memory_mb_used'] += instance_ref['memory_mb'] or 0
+        self.resources['local_gb_used'] += instance_ref['local_gb'] or 0
+
+
+class HostStateManager(object):
+    """Keeps the states of the compute hosts updated."""
+    def __init__(self):
+        self.host_states = {}
+
+    def update(self, host, capabilities):
+        """Stores the capabilities a compute host published."""
+        if host not in self.host_states:
+            LOG.debug(_("New compute host %s"), host)
+            self.host_states[host] = HostState(host)
+        self.host_states[host].update(capabilities)
+
+    def consume(self, host, instance_ref):
+        """Accounts for instance_ref being placed on host."""
+        if host in self.host_states:
+            self.host_states[host].consume(instance_ref)
+
+    def get_hosts_up(self, hosts_up):
+        """Returns the enabled states of hosts_up, least busy first."""
+        hosts = [self.host_states[host] for host in hosts_up
+                 if host in self.host_states
+                 and not self.host_states[host].disabled]
+        return sorted(hosts, key=lambda state: state.instance_cores)
+
+    def get_hosts_without_state(self, hosts_up):
+        """Returns the hosts of hosts_up that never published a state."""
+        return [host for host in hosts_up if host not in self.host_states]
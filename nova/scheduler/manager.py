@@ -55,10 +55,26 @@ class SchedulerManager(manager.Manager):
         """Poll child zones periodically to get status."""
         self.zone_manager.ping(context)
 
+    def run_instances(self, context, topic, instance_ids, **kwargs):
+        """Schedules each instance of a multi-instance launch"""
+        for instance_id in instance_ids:
+            try:
+                self._schedule('run_instance', context, topic,
+                               instance_id=instance_id, **kwargs)
+            except Exception:
+                # NOTE: one instance failing to schedule shouldn't stop
+                #       the rest of the launch
+                LOG.exception(_('Failed to schedule instance %s'),
+                              instance_id)
+
     def get_zone_list(self, context=None):
         """Get a list of zones from the ZoneManager."""
         return self.zone_manager.get_zone_list()
 
+    def update_host_state(self, context, host, capabilities):
+        """Stores the capacity and usage a compute host published."""
+        self.driver.host_state_manager.update(host, capabilities)
+
     def _schedule(self, method, context, topic, *args, **kwargs):
         """Tries to call schedule_* method on the driver to retrieve host.
 
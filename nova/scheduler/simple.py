@@ -42,7 +42,9 @@ class SimpleScheduler(chance.ChanceScheduler):
 
     def schedule_run_instance(self, context, instance_id, *_args, **_kwargs):
         """Picks a host that is up and has the fewest running instances."""
-        instance_ref = db.instance_get(context, instance_id)
+        instance_ref = db.instance_get(context, instance_id,
+                                       columns=('availability_zone', 'vcpus',
+                                                'memory_mb', 'local_gb'))
         if (instance_ref['availability_zone']
             and ':' in instance_ref['availability_zone']
             and context.is_admin):
@@ -57,7 +59,16 @@ class SimpleScheduler(chance.ChanceScheduler):
             now = datetime.datetime.utcnow()
             db.instance_update(context, instance_id, {'host': host,
                                                       'scheduled_at': now})
+            self.host_state_manager.consume(host, instance_ref)
             return host
+        hosts_up = self.hosts_up(context, 'compute')
+        host_states = self.host_state_manager.get_hosts_up(hosts_up)
+        if host_states:
+            return self._schedule_on_host_states(context, instance_id,
+                                                 instance_ref, hosts_up,
+                                                 host_states)
+        # NOTE: no compute host that is up has published its state, so
+        #       the instance cores have to be summed in the db
         results = db.service_get_all_compute_sorted(context)
         for result in results:
             (service, instance_cores) = result
@@ -74,6 +85,27 @@ class SimpleScheduler(chance.ChanceScheduler):
                 return service['host']
         raise driver.NoValidHost(_("No hosts found"))
 
+    def _schedule_on_host_states(self, context, instance_id, instance_ref,
+                                 hosts_up, host_states):
+        """Picks the least busy of hosts_up, using host_states if it can.
+
+        Hosts whose driver reports no resources, like xenapi, never publish
+        a state, so their instance cores are still summed in the db.
+        """
+        candidates = [(state.instance_cores, state.host)
+                      for state in host_states]
+        for host in self.host_state_manager.get_hosts_without_state(hosts_up):
+            instance_cores = db.instance_get_vcpu_sum_by_host(context, host)
+            candidates.append((int(instance_cores), host))
+        instance_cores, host = min(candidates, key=lambda c: c[0])
+        if instance_cores + instance_ref['vcpus'] > FLAGS.max_cores:
+            raise driver.NoValidHost(_("All hosts have too many cores"))
+        now = datetime.datetime.utcnow()
+        db.instance_update(context, instance_id, {'host': host,
+                                                  'scheduled_at': now})
+        self.host_state_manager.consume(host, instance_ref)
+        return host
+
     def schedule_create_volume(self, context, volume_id, *_args, **_kwargs):
         """Picks a host that is up and has the fewest volumes."""
         volume_ref = db.volume_get(context, volume_id)
@@ -24,7 +24,6 @@ Availability Zone Scheduler implementation
 import random
 
 from nova.scheduler import driver
-from nova import db
 
 
 class ZoneScheduler(driver.Scheduler):
@@ -38,11 +37,10 @@ class ZoneScheduler(driver.Scheduler):
         if zone is None:
             return self.hosts_up(context, topic)
 
-        services = db.service_get_all_by_topic(context, topic)
+        services = self.servicegroup_api.get_all_up(context, topic)
         return [service.host
                 for service in services
-                if self.service_is_up(service)
-                and service.availability_zone == zone]
+                if service.availability_zone == zone]
 
     def schedule(self, context, topic, *_args, **_kwargs):
         """Picks a host that is up at random in selected
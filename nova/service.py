@@ -38,6 +38,7 @@ from nova import exception
 from nova import log as logging
 from nova import flags
 from nova import rpc
+from nova import servicegroup
 from nova import utils
 from nova import version
 from nova import wsgi
@@ -76,6 +77,7 @@ class Service(object):
         super(Service, self).__init__(*args, **kwargs)
         self.saved_args, self.saved_kwargs = args, kwargs
         self.timers = []
+        self.servicegroup_api = servicegroup.API()
 
     def start(self):
         vcs_string = version.version_string_with_vcs()
@@ -97,6 +99,7 @@ class Service(object):
 
         conn1 = rpc.Connection.instance(new=True)
         conn2 = rpc.Connection.instance(new=True)
+        conn3 = rpc.Connection.instance(new=True)
         if self.report_interval:
             consumer_all = rpc.AdapterConsumer(
                     connection=conn1,
@@ -106,10 +109,16 @@ class Service(object):
                     connection=conn2,
                     topic='%s.%s' % (self.topic, self.host),
                     proxy=self)
+            consumer_fanout = rpc.FanoutAdapterConsumer(
+                    connection=conn3,
+                    topic=self.topic,
+                    proxy=self)
 
             self.timers.append(consumer_all.attach_to_eventlet())
             self.timers.append(consumer_node.attach_to_eventlet())
+            self.timers.append(consumer_fanout.attach_to_eventlet())
 
+            self.servicegroup_api.join(ctxt, self)
             pulse = utils.LoopingCall(self.report_state)
             pulse.start(interval=self.report_interval, now=False)
             self.timers.append(pulse)
@@ -200,16 +209,12 @@ class Service(object):
         ctxt = context.get_admin_context()
         try:
             try:
-                service_ref = db.service_get(ctxt, self.service_id)
+                self.servicegroup_api.heartbeat(ctxt, self)
             except exception.NotFound:
                 logging.debug(_("The service database object disappeared, "
                                 "Recreating it."))
                 self._create_service_ref(ctxt)
-                service_ref = db.service_get(ctxt, self.service_id)
-
-            db.service_update(ctxt,
-                             self.service_id,
-                             {'report_count': service_ref['report_count'] + 1})
+                self.servicegroup_api.heartbeat(ctxt, self)
 
             # TODO(termie): make this pattern be more elegant.
             if getattr(self, "model_disconnected", False):
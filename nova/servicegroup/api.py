@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Tracks which services are alive.
+"""
+
+from nova import flags
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('servicegroup_driver',
+                    'nova.servicegroup.driver.DbDriver',
+                    'Driver that records service heartbeats and answers '
+                    'which services are up')
+flags.DEFINE_integer('service_down_time', 60,
+                     'maximum time since last checkin for up service')
+
+
+class API(object):
+    """API for service liveness.
+
+    A service joins when it starts and then sends a heartbeat every
+    report_interval.  It is up while its last heartbeat is less than
+    service_down_time old.
+    """
+
+    def __init__(self, driver=None):
+        if not driver:
+            driver = FLAGS.servicegroup_driver
+        self.driver = utils.import_object(driver)
+
+    def join(self, context, service):
+        """Marks service, a running nova.service.Service, as up."""
+        return self.driver.join(context, service)
+
+    def heartbeat(self, context, service):
+        """Records that service is still alive."""
+        return self.driver.heartbeat(context, service)
+
+    def is_up(self, service_ref):
+        """Checks whether the service of a services table row is up."""
+        return self.driver.is_up(service_ref)
+
+    def get_all_up(self, context, topic):
+        """Returns the enabled services rows for topic that are up."""
+        return self.driver.get_all_up(context, topic)
@@ -0,0 +1,100 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Drivers for service liveness.
+
+"""
+
+import datetime
+
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import utils
+
+
+LOG = logging.getLogger('nova.servicegroup.driver')
+FLAGS = flags.FLAGS
+flags.DECLARE('service_down_time', 'nova.servicegroup.api')
+
+
+class ServiceGroupDriver(object):
+    """Base class for service liveness drivers."""
+
+    def join(self, context, service):
+        """Marks service as up straight away."""
+        self.heartbeat(context, service)
+
+    def heartbeat(self, context, service):
+        raise NotImplementedError()
+
+    def is_up(self, service_ref):
+        raise NotImplementedError()
+
+    def get_all_up(self, context, topic):
+        services = db.service_get_all_by_topic(context, topic)
+        return [service for service in services if self.is_up(service)]
+
+
+class DbDriver(ServiceGroupDriver):
+    """Keeps heartbeats in the updated_at column of the services table."""
+
+    def heartbeat(self, context, service):
+        db.service_heartbeat(context, service.service_id)
+
+    def is_up(self, service_ref):
+        last_heartbeat = service_ref['updated_at'] or \
+                         service_ref['created_at']
+        # Timestamps in DB are UTC.
+        elapsed = utils.utcnow() - last_heartbeat
+        return elapsed < datetime.timedelta(seconds=FLAGS.service_down_time)
+
+
+class MemcachedDriver(ServiceGroupDriver):
+    """Keeps heartbeats in memcached, where they expire on their own.
+
+    A heartbeat is a single set of a key that lives for service_down_time,
+    so the services table is only read, never written, to track liveness.
+    """
+
+    def __init__(self):
+        if FLAGS.memcached_servers:
+            import memcache
+        else:
+            from nova import fakememcache as memcache
+        self.mc = memcache.Client(FLAGS.memcached_servers, debug=0)
+
+    @staticmethod
+    def _key(service_ref):
+        return str('servicegroup-%s-%s' % (service_ref['topic'],
+                                           service_ref['host']))
+
+    def heartbeat(self, context, service):
+        key = self._key({'topic': service.topic, 'host': service.host})
+        if not self.mc.set(key, utils.utcnow_ts(),
+                           time=FLAGS.service_down_time):
+            LOG.warn(_('Failed to record heartbeat of %s'), key)
+
+    def is_up(self, service_ref):
+        return self.mc.get(self._key(service_ref)) is not None
+
+    def get_all_up(self, context, topic):
+        services = db.service_get_all_by_topic(context, topic)
+        alive = self.mc.get_multi([self._key(service)
+                                   for service in services])
+        return [service for service in services
+                if self._key(service) in alive]
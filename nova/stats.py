@@ -0,0 +1,136 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process statistics: timings, counters and gauges.
+
+Code records samples through the module level functions, which hand them to
+the sink named by FLAGS.stats_sink.  The default RingBufferSink keeps the
+most recent timings per key in memory so a service can report them on
+demand, e.g. for nova-manage service stats.
+"""
+
+import collections
+
+from nova import flags
+from nova import utils
+
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('stats_sink', 'nova.stats.RingBufferSink',
+                    'Class that records timings, counters and gauges')
+flags.DEFINE_integer('stats_ring_size', 1024,
+                     'Number of timings kept per key by RingBufferSink')
+
+
+class Sink(object):
+    """Base class for stats sinks, which throws everything away"""
+
+    def timing(self, key, seconds):
+        """Records how long one occurrence of key took"""
+        pass
+
+    def incr(self, key, delta=1):
+        """Adds delta to the counter key"""
+        pass
+
+    def gauge(self, key, value):
+        """Sets the current value of key"""
+        pass
+
+    def report(self):
+        """Returns a dictionary describing everything recorded so far"""
+        return {}
+
+
+class RingBufferSink(Sink):
+    """Keeps the latest timings per key plus all counters and gauges"""
+
+    def __init__(self, size=None):
+        self.size = size or FLAGS.stats_ring_size
+        self.timings = {}
+        self.counters = collections.defaultdict(int)
+        self.gauges = {}
+
+    def timing(self, key, seconds):
+        if key not in self.timings:
+            self.timings[key] = collections.deque(maxlen=self.size)
+        self.timings[key].append(seconds)
+
+    def incr(self, key, delta=1):
+        self.counters[key] += delta
+
+    def gauge(self, key, value):
+        self.gauges[key] = value
+
+    def report(self):
+        report = dict(self.counters)
+        report.update(self.gauges)
+        for key, samples in self.timings.iteritems():
+            report[key] = summarize(samples)
+        return report
+
+
+def percentile(samples, fraction):
+    """Returns the sample below which fraction of sorted samples fall"""
+    if not samples:
+        return None
+    return samples[int(round(fraction * (len(samples) - 1)))]
+
+
+def summarize(samples):
+    """Returns count, mean, p50, p99 and max of a list of timings"""
+    samples = sorted(samples)
+    count = len(samples)
+    return {'count': count,
+            'mean': count and sum(samples) / float(count),
+            'p50': percentile(samples, 0.5),
+            'p99': percentile(samples, 0.99),
+            'max': count and samples[-1]}
+
+
+_SINK = None
+
+
+def get_sink():
+    """Returns the sink for this process, creating it if needed"""
+    global _SINK
+    if _SINK is None:
+        _SINK = utils.import_object(FLAGS.stats_sink)
+    return _SINK
+
+
+def reset():
+    """Drops everything recorded so far"""
+    global _SINK
+    _SINK = None
+
+
+def timing(key, seconds):
+    get_sink().timing(key, seconds)
+
+
+def incr(key, delta=1):
+    get_sink().incr(key, delta)
+
+
+def gauge(key, value):
+    get_sink().gauge(key, value)
+
+
+def report():
+    return get_sink().report()
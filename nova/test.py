@@ -39,6 +39,8 @@ from nova import fakerabbit
 from nova import flags
 from nova import rpc
 from nova import service
+from nova.db import cache
+from nova.db import querycount
 
 
 FLAGS = flags.FLAGS
@@ -70,6 +72,8 @@ class TestCase(unittest.TestCase):
         self.start = datetime.datetime.utcnow()
         shutil.copyfile(os.path.join(FLAGS.state_path, FLAGS.sqlite_clean_db),
                         os.path.join(FLAGS.state_path, FLAGS.sqlite_db))
+        # NOTE: the database was just replaced under the cache
+        cache.reset()
 
         # emulate some of the mox stuff, we can't use the metaclass
         # because it screws with our generators
@@ -91,6 +95,10 @@ class TestCase(unittest.TestCase):
             self.mox.VerifyAll()
             super(TestCase, self).tearDown()
         finally:
+            # Drop the shared rpc reply queue and pooled connections
+            rpc.ReplyWaiter.reset()
+            rpc.Pool.reset()
+
             # Clean out fake_rabbit's queue if we used it
             if FLAGS.fake_rabbit:
                 fakerabbit.reset_all()
@@ -131,6 +139,36 @@ class TestCase(unittest.TestCase):
         for k, v in self._original_flags.iteritems():
             setattr(FLAGS, k, v)
 
+    def assertQueriesDoNotGrow(self, populate, call, sizes=(10, 1000),
+                               max_queries=None):
+        """Fails if call runs more sql statements as the fixture grows
+
+        populate(size) is called to grow the fixture to size rows before
+        each measured call, so per-row lookups (N+1 queries) in call fail
+        the test.  max_queries also bounds the count for every size.
+        """
+        counts = []
+        for size in sizes:
+            populate(size)
+            with querycount.counting() as count:
+                call()
+            counts.append(count)
+            if max_queries is not None and count.queries > max_queries:
+                self.fail(_('%(queries)d sql statements for %(size)d rows, '
+                            'expected at most %(max_queries)d: %(functions)s')
+                          % {'queries': count.queries, 'size': size,
+                             'max_queries': max_queries,
+                             'functions': count.functions})
+        if counts[-1].queries > counts[0].queries:
+            self.fail(_('sql statements grew from %(first)d to %(last)d as '
+                        'the fixture grew from %(small)d to %(large)d rows: '
+                        '%(before)s -> %(after)s')
+                      % {'first': counts[0].queries,
+                         'last': counts[-1].queries,
+                         'small': sizes[0], 'large': sizes[-1],
+                         'before': counts[0].functions,
+                         'after': counts[-1].functions})
+
     def start_service(self, name, host=None, **kwargs):
         host = host and host or uuid.uuid4().hex
         kwargs.setdefault('host', host)
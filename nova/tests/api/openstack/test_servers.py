@@ -58,6 +58,17 @@ def return_servers(context, user_id=1):
     return [stub_instance(i, user_id) for i in xrange(5)]
 
 
+def return_servers_by_filters(context, filters, limit=None, marker=None,
+                              offset=None, sort_dir='asc', columns=None):
+    servers = return_servers(context)
+    if marker is not None:
+        servers = [server for server in servers if server['id'] > marker]
+    servers = servers[offset or 0:]
+    if limit is not None:
+        servers = servers[:limit]
+    return servers
+
+
 def return_security_group(context, instance_id, security_group_id):
     pass
 
@@ -131,10 +142,9 @@ class ServersTest(test.TestCase):
         fakes.stub_out_auth(self.stubs)
         fakes.stub_out_key_pair_funcs(self.stubs)
         fakes.stub_out_image_service(self.stubs)
-        self.stubs.Set(nova.db.api, 'instance_get_all', return_servers)
+        self.stubs.Set(nova.db.api, 'instance_get_all_by_filters',
+                       return_servers_by_filters)
         self.stubs.Set(nova.db.api, 'instance_get', return_server)
-        self.stubs.Set(nova.db.api, 'instance_get_all_by_user',
-                       return_servers)
         self.stubs.Set(nova.db.api, 'instance_add_security_group',
                        return_security_group)
         self.stubs.Set(nova.db.api, 'instance_update', instance_update)
@@ -239,11 +249,26 @@ class ServersTest(test.TestCase):
         servers = json.loads(res.body)['servers']
         self.assertEqual([s['id'] for s in servers], [1, 2])
 
+    def test_get_servers_with_marker(self):
+        req = webob.Request.blank('/v1.0/servers?limit=2&marker=1')
+        res = req.get_response(fakes.wsgi_app())
+        servers = json.loads(res.body)['servers']
+        self.assertEqual([s['id'] for s in servers], [2, 3])
+
+        req = webob.Request.blank('/v1.0/servers?marker=aaa')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 400)
+        self.assertTrue('marker' in res.body)
+
     def _test_create_instance_helper(self):
         """Shared implementation for tests below that create instance"""
         def instance_create(context, inst):
             return {'id': '1', 'display_name': 'server_test'}
 
+        def instance_create_many(context, values_list, **kwargs):
+            return [instance_create(context, values)
+                    for values in values_list]
+
         def server_update(context, id, params):
             return instance_create(context, id)
 
@@ -264,6 +289,8 @@ class ServersTest(test.TestCase):
 
         self.stubs.Set(nova.db.api, 'project_get_network', project_get_network)
         self.stubs.Set(nova.db.api, 'instance_create', instance_create)
+        self.stubs.Set(nova.db.api, 'instance_create_many',
+                       instance_create_many)
         self.stubs.Set(nova.rpc, 'cast', fake_method)
         self.stubs.Set(nova.rpc, 'call', fake_method)
         self.stubs.Set(nova.db.api, 'instance_update',
@@ -398,10 +425,10 @@ class ServersTest(test.TestCase):
             return Instance(id=id, state=0, image_id=10, user_id=user_id,
                 display_name='server%s' % id, host='host%s' % (id % 2))
 
-        def return_servers_with_host(context, user_id=1):
+        def return_servers_with_host(context, *args, **kwargs):
             return [stub_instance(i) for i in xrange(5)]
 
-        self.stubs.Set(nova.db.api, 'instance_get_all_by_user',
+        self.stubs.Set(nova.db.api, 'instance_get_all_by_filters',
             return_servers_with_host)
 
         req = webob.Request.blank('/v1.0/servers/detail')
@@ -353,6 +353,26 @@ class CloudTestCase(test.TestCase):
         self.assertEqual('', img.metadata['description'])
         shutil.rmtree(pathdir)
 
+    def test_describe_instances_queries_do_not_grow(self):
+        """Makes sure describe_instances doesn't query once per instance"""
+        created = []
+
+        def _populate(size):
+            values = [{'reservation_id': 'r-%d' % size,
+                       'project_id': self.project.id,
+                       'user_id': self.user.id,
+                       'image_id': 1,
+                       'host': 'host%d' % (i % 3)}
+                      for i in xrange(size - len(created))]
+            created.extend(db.instance_create_many(self.context, values))
+
+        # NOTE: one listing, and one zone lookup for each of the 3 hosts
+        self.assertQueriesDoNotGrow(
+                _populate, lambda: self.cloud.describe_instances(self.context),
+                max_queries=4)
+        for instance in created:
+            db.instance_destroy(self.context, instance['id'])
+
     def test_update_of_instance_display_fields(self):
         inst = db.instance_create(self.context, {})
         ec2_id = ec2utils.id_to_ec2_id(inst['id'])
@@ -147,6 +147,71 @@ class ComputeTestCase(test.TestCase):
             db.security_group_destroy(self.context, group['id'])
             db.instance_destroy(self.context, ref[0]['id'])
 
+    def test_create_multiple_instances_in_one_batch(self):
+        """Make sure a multi-instance launch is created at once"""
+        group = self._create_group()
+        casts = []
+        self.stubs.Set(rpc, 'cast',
+                       lambda context, topic, msg: casts.append(msg))
+        refs = self.compute_api.create(
+                self.context,
+                instance_type=FLAGS.default_instance_type,
+                image_id=None,
+                min_count=3,
+                max_count=3,
+                display_name=None,
+                security_group=['testgroup'],
+                metadata=[{'key': 'batch', 'value': 'yes'}])
+        instance_ids = [ref['id'] for ref in refs]
+        try:
+            self.assertEqual([0, 1, 2], [ref['launch_index'] for ref in refs])
+            for ref in refs:
+                instance = db.instance_get(self.context, ref['id'])
+                self.assertEqual(str(ref['id']), instance['hostname'])
+                self.assertEqual('Server %s' % ref['id'],
+                                 instance['display_name'])
+                self.assertEqual(['testgroup'],
+                                 [g['name'] for g in
+                                  instance['security_groups']])
+                self.assertEqual([('batch', 'yes')],
+                                 [(m['key'], m['value'])
+                                  for m in instance['metadata']])
+            self.assertEqual([{'method': 'run_instance',
+                               'args': {'topic': FLAGS.compute_topic,
+                                        'instance_id': instance_id,
+                                        'availability_zone': None,
+                                        'injected_files': None}}
+                              for instance_id in instance_ids],
+                             casts)
+        finally:
+            db.security_group_destroy(self.context, group['id'])
+            for instance_id in instance_ids:
+                db.instance_destroy(self.context, instance_id)
+
+    def test_create_multiple_instances_with_one_cast(self):
+        """Make sure scheduler_run_instances sends a single cast"""
+        self.flags(scheduler_run_instances=True)
+        casts = []
+        self.stubs.Set(rpc, 'cast',
+                       lambda context, topic, msg: casts.append(msg))
+        refs = self.compute_api.create(
+                self.context,
+                instance_type=FLAGS.default_instance_type,
+                image_id=None,
+                min_count=2,
+                max_count=2)
+        instance_ids = [ref['id'] for ref in refs]
+        try:
+            self.assertEqual([{'method': 'run_instances',
+                               'args': {'topic': FLAGS.compute_topic,
+                                        'instance_ids': instance_ids,
+                                        'availability_zone': None,
+                                        'injected_files': None}}],
+                             casts)
+        finally:
+            for instance_id in instance_ids:
+                db.instance_destroy(self.context, instance_id)
+
     def test_destroy_instance_disassociates_security_groups(self):
         """Make sure destroying disassociates security groups"""
         group = self._create_group()
@@ -583,6 +648,42 @@ class ComputeTestCase(test.TestCase):
         ret = self.compute.live_migration(c, i_ref['id'], i_ref['host'])
         self.assertEqual(ret, None)
 
+    def test_update_available_resource_publishes_host_state(self):
+        """Ensures compute hosts publish their state to the schedulers"""
+        c = context.get_admin_context()
+        service_ref = db.service_create(c, {'host': self.compute.host,
+                                            'binary': 'nova-compute',
+                                            'topic': 'compute'})
+        instance_id = self._create_instance({'host': self.compute.host,
+                                             'vcpus': 2})
+        self.stubs.Set(self.compute.driver, 'update_available_resource',
+                       lambda context, host: {'vcpus': 4,
+                                              'cpu_info': 'fake'})
+        self.mox.StubOutWithMock(rpc, 'fanout_cast')
+        rpc.fanout_cast(c, FLAGS.scheduler_topic,
+                        {'method': 'update_host_state',
+                         'args': {'host': self.compute.host,
+                                  'capabilities': {'vcpus': 4,
+                                                   'disabled': False,
+                                                   'instance_cores': 2}}})
+        self.mox.ReplayAll()
+        self.compute.periodic_tasks(c)
+        db.instance_destroy(c, instance_id)
+        db.service_destroy(c, service_ref['id'])
+
+    def test_periodic_tasks_survive_driver_errors(self):
+        """Ensures hosts without resources neither publish nor stop"""
+        c = context.get_admin_context()
+        self.mox.StubOutWithMock(rpc, 'fanout_cast')
+        self.mox.ReplayAll()
+        self.compute.periodic_tasks(c)
+
+        def _fail(context, host):
+            raise AttributeError()
+        self.stubs.Set(self.compute.driver, 'update_available_resource',
+                       _fail)
+        self.compute.periodic_tasks(c)
+
     def test_post_live_migration_working_correctly(self):
         """Confirm post_live_migration() works as expected correctly."""
         dest = 'desthost'
@@ -0,0 +1,577 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for nova.db.api
+"""
+
+import datetime
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from eventlet import greenthread
+from eventlet import patcher
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import flags
+from nova import stats
+from nova import test
+from nova.db import api as db_api
+from nova.db import querycount
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+
+
+FLAGS = flags.FLAGS
+# NOTE: stands in for driver I/O, which eventlet can't make cooperative
+blocking_sleep = patcher.original('time').sleep
+
+
+class SlowBackend(object):
+    """Backend whose calls block the calling native thread"""
+
+    @staticmethod
+    def slow(seconds):
+        blocking_sleep(seconds)
+        return seconds
+
+    @staticmethod
+    def fail():
+        raise exception.NotFound('gone')
+
+
+class TpoolBackendTestCase(test.TestCase):
+    """Test running db api calls in native threads"""
+    def setUp(self):
+        super(TpoolBackendTestCase, self).setUp()
+        self.backend = db_api.TpoolBackend(SlowBackend())
+        self.context = context.get_admin_context()
+
+    def _ticks_during_slow_call(self):
+        ticks = []
+
+        def _tick():
+            while True:
+                ticks.append(time.time())
+                greenthread.sleep(0.01)
+
+        ticker = greenthread.spawn(_tick)
+        greenthread.sleep(0)
+        self.assertEqual(0.2, self.backend.slow(0.2))
+        ticker.kill()
+        return len(ticks)
+
+    def test_calls_block_hub_without_tpool(self):
+        self.flags(sql_use_tpool=False)
+        self.assertEqual(1, self._ticks_during_slow_call())
+
+    def test_calls_do_not_block_hub_with_tpool(self):
+        self.flags(sql_use_tpool=True)
+        self.assertTrue(self._ticks_during_slow_call() > 5)
+
+    def test_exceptions_are_reraised(self):
+        self.flags(sql_use_tpool=True)
+        self.assertRaises(exception.NotFound, self.backend.fail)
+
+    def test_db_api_with_tpool(self):
+        self.flags(sql_use_tpool=True)
+        instance = db.instance_create(self.context, {'host': 'tpool'})
+        self.assertEqual('tpool',
+                         db.instance_get(self.context, instance['id'])['host'])
+        self.assertRaises(exception.NotFound,
+                          db.instance_get, self.context, -1)
+
+
+class QueryCountTestCase(test.TestCase):
+    """Test counting sql statements per db api function"""
+    def setUp(self):
+        super(QueryCountTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.instance = db.instance_create(self.context, {'host': 'count'})
+
+    def _count_instance_get(self):
+        with querycount.counting() as count:
+            db.instance_get(self.context, self.instance['id'])
+        return count
+
+    def test_counts_statements_per_function(self):
+        count = self._count_instance_get()
+        self.assertTrue(count.queries > 0)
+        self.assertEqual(['instance_get'], count.functions.keys())
+        self.assertEqual(count.queries, count.functions['instance_get'][0])
+
+    def test_nested_counting(self):
+        with querycount.counting() as outer:
+            db.instance_get_all(self.context)
+            inner = self._count_instance_get()
+        self.assertEqual(['instance_get'], inner.functions.keys())
+        self.assertEqual(['instance_get', 'instance_get_all'],
+                         sorted(outer.functions.keys()))
+        self.assertTrue(outer.queries > inner.queries)
+
+    def test_counting_with_tpool(self):
+        self.flags(sql_use_tpool=True)
+        count = self._count_instance_get()
+        self.assertTrue(count.queries > 0)
+        self.assertEqual(['instance_get'], count.functions.keys())
+
+    def test_no_counting_outside_block(self):
+        count = self._count_instance_get()
+        db.instance_get_all(self.context)
+        self.assertEqual(['instance_get'], count.functions.keys())
+
+    def test_query_stats(self):
+        self.flags(sql_query_stats=True)
+        stats.reset()
+        count = self._count_instance_get()
+        self.assertEqual(count.queries,
+                         stats.report()['sql.queries.instance_get'])
+
+
+class FixedIpTestCase(test.TestCase):
+    """Test fixed ip db api calls"""
+    def test_fixed_ip_bulk_create(self):
+        ctxt = context.get_admin_context()
+        addresses = ['10.99.0.%d' % i for i in xrange(5)]
+        db_api.IMPL.fixed_ip_bulk_create(ctxt,
+                                         [{'address': address,
+                                           'reserved': address.endswith('0')}
+                                          for address in addresses],
+                                         chunk_size=2)
+        for address in addresses:
+            fixed_ip = db.fixed_ip_get_by_address(ctxt, address)
+            self.assertEqual(address.endswith('0'), fixed_ip['reserved'])
+            self.assertEqual(False, fixed_ip['deleted'])
+            self.assertNotEqual(None, fixed_ip['created_at'])
+
+    def _network_with_ips(self, ctxt, count):
+        network = db.network_create_safe(ctxt, {'cidr': '10.98.0.0/16'})
+        db_api.IMPL.fixed_ip_bulk_create(ctxt,
+                                         [{'address': '10.98.%d.%d' %
+                                                      divmod(i, 256),
+                                           'network_id': network['id']}
+                                          for i in xrange(count)])
+        return network['id']
+
+    def test_fixed_ip_associate_pool_retries_lost_races(self):
+        ctxt = context.get_admin_context()
+        network_id = self._network_with_ips(ctxt, 2)
+        winner = db.instance_create(ctxt, {})['id']
+        loser = db.instance_create(ctxt, {})['id']
+        choices = []
+
+        def _steal_first_choice(free):
+            choices.append(free)
+            if len(choices) == 1:
+                db.fixed_ip_associate(ctxt, free[0][1], winner)
+            return free[0]
+
+        self.stubs.Set(random, 'choice', _steal_first_choice)
+        stats.reset()
+        address = db.fixed_ip_associate_pool(ctxt, network_id, loser)
+        self.assertEqual([1, 1], [len(free) for free in choices])
+        self.assertEqual(loser, db.fixed_ip_get_instance(ctxt, address)['id'])
+        self.assertEqual(1, stats.report()[
+                'db.fixed_ip_associate_pool.conflicts'])
+        self.assertRaises(db.NoMoreAddresses, db.fixed_ip_associate_pool,
+                          ctxt, network_id, loser)
+
+    def test_fixed_ip_associate_pool_hands_out_each_ip_once(self):
+        ctxt = context.get_admin_context()
+        threads, per_thread = 4, 3
+        network_id = self._network_with_ips(ctxt, threads * per_thread)
+        instance_ids = [db.instance_create(ctxt, {})['id']
+                        for i in xrange(threads)]
+
+        def _allocate(instance_id):
+            return [db.fixed_ip_associate_pool(ctxt, network_id, instance_id)
+                    for i in xrange(per_thread)]
+
+        pool = [greenthread.spawn(_allocate, instance_id)
+                for instance_id in instance_ids]
+        addresses = sum([thread.wait() for thread in pool], [])
+        self.assertEqual(threads * per_thread, len(set(addresses)))
+        self.assertRaises(db.NoMoreAddresses, db.fixed_ip_associate_pool,
+                          ctxt, network_id, instance_ids[0])
+
+
+class InstancePaginationTestCase(test.TestCase):
+    """Test paging through instances in the database"""
+    def setUp(self):
+        super(InstancePaginationTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        created_at = datetime.datetime(2011, 4, 1)
+        self.ids = []
+        for i in xrange(5):
+            # NOTE: pairs share a created_at so the id breaks the tie
+            instance = db.instance_create(self.context,
+                {'project_id': 'pages', 'user_id': 'fake',
+                 'created_at': created_at +
+                               datetime.timedelta(seconds=i / 2)})
+            self.ids.append(instance['id'])
+
+    def _ids(self, **kwargs):
+        return [instance['id'] for instance in
+                db.instance_get_all_by_filters(self.context,
+                                               {'project_id': 'pages'},
+                                               **kwargs)]
+
+    def test_limit_and_marker(self):
+        self.assertEqual(self.ids, self._ids())
+        self.assertEqual(self.ids[:2], self._ids(limit=2))
+        self.assertEqual(self.ids[2:4], self._ids(limit=2,
+                                                  marker=self.ids[1]))
+        self.assertEqual(self.ids[3:], self._ids(marker=self.ids[2]))
+        self.assertEqual(self.ids[1:3], self._ids(limit=2, offset=1))
+
+    def test_descending(self):
+        ids = list(reversed(self.ids))
+        self.assertEqual(ids[:3], self._ids(limit=3, sort_dir='desc'))
+        self.assertEqual(ids[2:], self._ids(marker=ids[1], sort_dir='desc'))
+
+    def test_unknown_marker(self):
+        self.assertRaises(exception.NotFound, self._ids, marker=-1)
+
+    def test_marker_must_be_listed(self):
+        other = db.instance_create(self.context, {'project_id': 'other',
+                                                  'user_id': 'fake'})
+        self.assertRaises(exception.NotFound, self._ids, marker=other['id'])
+        db.instance_destroy(self.context, self.ids[0])
+        self.assertRaises(exception.NotFound, self._ids, marker=self.ids[0])
+
+    def test_admin_lists_without_filters(self):
+        instances = db.instance_get_all_by_filters(self.context, {})
+        self.assertEqual(self.ids, [instance['id'] for instance in instances])
+
+    def test_filters_are_authorized(self):
+        ctxt = context.RequestContext('fake', 'other')
+        self.assertRaises(exception.NotAuthorized,
+                          db.instance_get_all_by_filters, ctxt,
+                          {'project_id': 'pages'})
+        self.assertRaises(exception.NotAuthorized,
+                          db.instance_get_all_by_filters, ctxt, {})
+
+
+class InstanceColumnsTestCase(test.TestCase):
+    """Test loading just some columns of instances"""
+    def setUp(self):
+        super(InstanceColumnsTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.instance = db.instance_create(self.context,
+                                           {'host': 'light',
+                                            'project_id': 'light',
+                                            'image_id': 'ami-light'})
+
+    def _assert_light(self, instance_ref):
+        self.assertEqual('light', instance_ref['host'])
+        self.assertEqual(FLAGS.instance_name_template % self.instance['id'],
+                         instance_ref.name)
+        for key in ('image_id', 'fixed_ip', 'volumes', 'metadata'):
+            self.assertFalse(key in instance_ref.__dict__)
+
+    def test_instance_get_columns(self):
+        self._assert_light(db.instance_get(self.context,
+                                           self.instance['id'],
+                                           columns=('host',)))
+        self.assertEqual('ami-light',
+                         db.instance_get(self.context,
+                                         self.instance['id'])['image_id'])
+
+    def test_instance_get_all_by_filters_columns(self):
+        instances = db.instance_get_all_by_filters(self.context,
+                                                   {'project_id': 'light'},
+                                                   columns=('host',))
+        self.assertEqual(1, len(instances))
+        self._assert_light(instances[0])
+
+    def test_instance_set_state(self):
+        db.instance_set_state(self.context, self.instance['id'], 1, 'up')
+        instance_ref = db.instance_get(self.context, self.instance['id'])
+        self.assertEqual(1, instance_ref['state'])
+        self.assertEqual('up', instance_ref['state_description'])
+        self.assertEqual('ami-light', instance_ref['image_id'])
+
+
+class CacheTestCase(test.TestCase):
+    """Test caching rows of rarely changing tables"""
+    def setUp(self):
+        super(CacheTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.user_context = context.RequestContext('fake', 'fake')
+        self.backend = self.mox.CreateMockAnything()
+        self.stubs.Set(db_api, 'IMPL', self.backend)
+        stats.reset()
+
+    def test_getters_are_cached(self):
+        self.backend.instance_type_get_by_name(self.context, 'm1.tiny').\
+                AndReturn({'name': 'm1.tiny'})
+        self.mox.ReplayAll()
+        for i in xrange(3):
+            inst_type = db.instance_type_get_by_name(self.context, 'm1.tiny')
+            self.assertEqual({'name': 'm1.tiny'}, inst_type)
+            # NOTE: callers get their own copy to change
+            inst_type['name'] = 'changed'
+        report = stats.report()
+        self.assertEqual(1, report['db.cache.instance_types.misses'])
+        self.assertEqual(2, report['db.cache.instance_types.hits'])
+
+    def test_writes_invalidate(self):
+        self.backend.zone_get(self.context, 1).AndReturn('before')
+        self.backend.zone_update(self.context, 1, {})
+        self.backend.zone_get(self.context, 1).AndReturn('after')
+        self.mox.ReplayAll()
+        self.assertEqual('before', db.zone_get(self.context, 1))
+        self.assertEqual('before', db.zone_get(self.context, 1))
+        db.zone_update(self.context, 1, {})
+        self.assertEqual('after', db.zone_get(self.context, 1))
+
+    def test_entries_expire(self):
+        self.flags(db_cache_ttl=1)
+        now = time.time()
+        self.stubs.Set(time, 'time', lambda: now)
+        self.backend.zone_get(self.context, 1).AndReturn('before')
+        self.backend.zone_get(self.context, 1).AndReturn('after')
+        self.mox.ReplayAll()
+        self.assertEqual('before', db.zone_get(self.context, 1))
+        now += 2
+        self.assertEqual('after', db.zone_get(self.context, 1))
+
+    def test_contexts_are_kept_apart(self):
+        user_context = self.user_context
+        self.backend.zone_get(self.context, 1).AndReturn('admin')
+        self.backend.zone_get(user_context, 1).AndReturn('user')
+        deleted_context = context.get_admin_context(read_deleted=True)
+        self.backend.zone_get(deleted_context, 1).AndReturn('deleted')
+        self.mox.ReplayAll()
+        self.assertEqual('admin', db.zone_get(self.context, 1))
+        self.assertEqual('user', db.zone_get(user_context, 1))
+        self.assertEqual('deleted', db.zone_get(deleted_context, 1))
+
+    def test_keyword_arguments(self):
+        self.backend.instance_type_get_all(self.context, True).\
+                AndReturn({'m1.tiny': {'deleted': True}})
+        self.backend.instance_type_get_all(self.context, False).\
+                AndReturn({})
+        self.mox.ReplayAll()
+        for i in xrange(2):
+            self.assertEqual({'m1.tiny': {'deleted': True}},
+                             db.instance_type_get_all(self.context,
+                                                      inactive=True))
+        self.assertEqual({}, db.instance_type_get_all(self.context))
+
+    def test_networks_are_not_cached_by_default(self):
+        self.backend.network_get(self.context, 1).AndReturn('before')
+        self.backend.network_get(self.context, 1).AndReturn('after')
+        self.mox.ReplayAll()
+        self.assertEqual('before', db.network_get(self.context, 1))
+        self.assertEqual('after', db.network_get(self.context, 1))
+
+    def test_models_are_copied(self):
+        self.backend.zone_get_all(self.context).\
+                AndReturn([models.Zone(id=1, api_url='http://one')])
+        self.mox.ReplayAll()
+        zones = db.zone_get_all(self.context)
+        zones[0].api_url = 'http://changed'
+        self.assertEqual('http://one',
+                         db.zone_get_all(self.context)[0].api_url)
+
+    def test_disabled(self):
+        self.flags(db_cache_ttl=0)
+        self.backend.zone_get_all(self.context).AndReturn([])
+        self.backend.zone_get_all(self.context).AndReturn([])
+        self.mox.ReplayAll()
+        db.zone_get_all(self.context)
+        db.zone_get_all(self.context)
+
+
+class ZoneTestCase(test.TestCase):
+    """Test zone db api calls"""
+    def test_zone_create_and_update(self):
+        ctxt = context.get_admin_context()
+        zone = db.zone_create(ctxt, {'api_url': 'http://one'})
+        db.zone_update(ctxt, zone['id'], {'api_url': 'http://two'})
+        self.assertEqual('http://two', db.zone_get(ctxt, zone['id']).api_url)
+
+
+class ArchiveTestCase(test.TestCase):
+    """Test moving soft-deleted rows to the shadow tables"""
+    def setUp(self):
+        super(ArchiveTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        old = datetime.datetime.utcnow() - datetime.timedelta(days=10)
+        recent = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        metadata = [{'key': 'archived', 'value': 'yes',
+                     'deleted': True, 'deleted_at': old}]
+        self.archived = [self._instance(deleted=True, deleted_at=old,
+                                        metadata=metadata),
+                         self._instance(deleted=True, deleted_at=old),
+                         self._instance(deleted=True, deleted_at=old)]
+        self.kept = [self._instance(deleted=True, deleted_at=recent),
+                     self._instance(deleted=False),
+                     self._instance(deleted=True, deleted_at=old)]
+        db.fixed_ip_create(self.context, {'address': '10.0.0.9',
+                                          'instance_id': self.kept[2]})
+
+    def _instance(self, **values):
+        return db.instance_create(self.context, values)['id']
+
+    def _ids(self, table):
+        rows = session.get_session().execute('SELECT id FROM %s' % table)
+        return sorted(row[0] for row in rows)
+
+    def test_archive_deleted_rows(self):
+        stats.reset()
+        batches = db.archive_deleted_rows(self.context, 7, batch_size=2)
+        self.assertEqual(sorted(self.kept), self._ids('instances'))
+        self.assertEqual(sorted(self.archived), self._ids('shadow_instances'))
+        self.assertEqual([], self._ids('instance_metadata'))
+        self.assertEqual(1, len(self._ids('shadow_instance_metadata')))
+        self.assertEqual([('instance_metadata', 1), ('instances', 2),
+                          ('instances', 1)],
+                         [batch[:2] for batch in batches])
+        self.assertEqual(3, stats.report()['db.archive.instances'])
+        self.assertEqual([], db.archive_deleted_rows(self.context, 7))
+
+    def test_archive_stops_after_max_batches(self):
+        batches = db.archive_deleted_rows(self.context, 7, batch_size=1,
+                                          max_batches=2)
+        self.assertEqual(2, len(batches))
+
+
+class SessionPoolTestCase(test.TestCase):
+    """Test the sql connection pool set up by get_session"""
+    def setUp(self):
+        super(SessionPoolTestCase, self).setUp()
+        stats.reset()
+
+    def _pool(self, **kwargs):
+        return session.StatsQueuePool(lambda: sqlite3.connect(':memory:'),
+                                      **kwargs)
+
+    def test_engine_kwargs_from_flags(self):
+        self.flags(sql_connection='mysql://nova@localhost/nova',
+                   sql_pool_size=7, sql_max_overflow=3, sql_pool_timeout=5)
+        kwargs = session._engine_kwargs(FLAGS.sql_connection)
+        self.assertEqual(session.StatsQueuePool, kwargs['poolclass'])
+        self.assertEqual(7, kwargs['pool_size'])
+        self.assertEqual(3, kwargs['max_overflow'])
+        self.assertEqual(5, kwargs['pool_timeout'])
+        self.assertTrue(isinstance(kwargs['listeners'][0],
+                                   session.PingListener))
+
+    def test_pool_size_matches_tpool(self):
+        self.flags(sql_connection='mysql://nova@localhost/nova',
+                   sql_pool_size=5, sql_use_tpool=True)
+        self.stubs.Set(os, 'environ', {'EVENTLET_THREADPOOL_SIZE': '12'})
+        kwargs = session._engine_kwargs(FLAGS.sql_connection)
+        self.assertEqual(12, kwargs['pool_size'])
+
+    def test_pool_records_size_and_waits(self):
+        pool = self._pool(pool_size=1, max_overflow=0, timeout=0.1)
+        conn = pool.connect()
+        report = stats.report()
+        self.assertEqual(1, report['sql.pool.size'])
+        self.assertEqual(1, report['sql.pool.checked_out'])
+        self.assertRaises(exc.TimeoutError, pool.connect)
+        self.assertEqual(1, stats.report()['sql.pool.waits'])
+        conn.close()
+        self.assertEqual(0, stats.report()['sql.pool.checked_out'])
+
+    def test_pool_recreate_keeps_stats(self):
+        pool = self._pool(pool_size=2, max_overflow=1)
+        self.assertTrue(isinstance(pool.recreate(), session.StatsQueuePool))
+
+    def test_dead_connections_are_replaced(self):
+        pool = session.StatsQueuePool(FakeConnection, pool_size=1,
+                                      max_overflow=0,
+                                      listeners=[session.PingListener()])
+        conn = pool.connect()
+        dead = conn.connection
+        dead.alive = False
+        conn.close()
+        conn = pool.connect()
+        self.assertNotEqual(dead, conn.connection)
+        self.assertTrue(conn.connection.alive)
+        self.assertEqual(1, stats.report()['sql.pool.reconnects'])
+
+
+class ReadReplicaTestCase(test.TestCase):
+    """Test that listings can be sent to a read replica"""
+    def setUp(self):
+        super(ReadReplicaTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        (fd, self.replica) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        models.BASE.metadata.create_all(create_engine('sqlite:///%s' %
+                                                      self.replica))
+        self.stubs.Set(session, '_SLAVE_ENGINE', None)
+        self.stubs.Set(session, '_SLAVE_MAKER', None)
+
+    def tearDown(self):
+        os.unlink(self.replica)
+        super(ReadReplicaTestCase, self).tearDown()
+
+    def test_listings_read_from_replica(self):
+        self.flags(sql_slave_connection='sqlite:///%s' % self.replica)
+        instance = db.instance_create(self.context, {'host': 'replica',
+                                                     'project_id': 'replica'})
+        self.assertEqual([], db.instance_get_all_by_project(self.context,
+                                                            'replica'))
+        self.assertEqual('replica',
+                         db.instance_get(self.context, instance['id'])['host'])
+
+    def test_decisions_read_from_primary(self):
+        self.flags(sql_slave_connection='sqlite:///%s' % self.replica)
+        db.instance_create(self.context, {'host': 'replica', 'vcpus': 2,
+                                          'reservation_id': 'r-replica'})
+        self.assertEqual(1, len(db.instance_get_all_by_reservation(
+                self.context, 'r-replica')))
+        self.assertEqual(1, len(db.instance_get_all_by_host(self.context,
+                                                            'replica')))
+        self.assertEqual(2, db.instance_get_vcpu_sum_by_host(self.context,
+                                                             'replica'))
+
+    def test_primary_used_without_replica(self):
+        db.instance_create(self.context, {'host': 'replica',
+                                          'project_id': 'replica'})
+        self.assertEqual(1, len(db.instance_get_all_by_project(self.context,
+                                                               'replica')))
+
+
+class FakeConnection(object):
+    """DB-API connection whose server can go away"""
+    def __init__(self):
+        self.alive = True
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        if not self.alive:
+            raise sqlite3.OperationalError('server has gone away')
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
@@ -23,6 +23,19 @@ import os
 
 from nova import test
 from nova.network import linux_net
+from nova.network import manager as network_manager
+
+
+class AddressesTestCase(test.TestCase):
+    def test_ipv4_addresses_match_ipy(self):
+        net = IPy.IP('10.0.0.0/28')
+        self.assertEqual([str(address) for address in net],
+                         list(network_manager._addresses(net)))
+
+    def test_ipv6_addresses_match_ipy(self):
+        net = IPy.IP('fd00::/124')
+        self.assertEqual([str(address) for address in net],
+                         list(network_manager._addresses(net)))
 
 
 class IptablesManagerTestCase(test.TestCase):
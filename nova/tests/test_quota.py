@@ -16,6 +16,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
 from nova import compute
 from nova import context
 from nova import db
@@ -27,6 +29,7 @@ from nova import utils
 from nova import volume
 from nova.auth import manager
 from nova.compute import instance_types
+from nova.db.sqlalchemy import api as sqlalchemy_api
 
 
 FLAGS = flags.FLAGS
@@ -188,6 +191,68 @@ class QuotaTestCase(test.TestCase):
                           self.context)
         db.floating_ip_destroy(context.get_admin_context(), address)
 
+    def test_usage_follows_creates_and_destroys(self):
+        instance_id = self._create_instance(cores=2)
+        volume_id = self._create_volume(size=10)
+        admin_context = context.get_admin_context()
+        usage = quota.get_usage(admin_context, self.project.id)
+        self.assertEqual({'instances': 1, 'cores': 2,
+                          'volumes': 1, 'gigabytes': 10}, usage)
+        db.instance_update(admin_context, instance_id, {'vcpus': 3})
+        db.instance_destroy(self.context, instance_id)
+        db.instance_destroy(self.context, instance_id)
+        db.volume_destroy(admin_context, volume_id)
+        usage = quota.get_usage(admin_context, self.project.id)
+        self.assertEqual({'instances': 0, 'cores': 0,
+                          'volumes': 0, 'gigabytes': 0}, usage)
+
+    def test_reservations_count_against_quota(self):
+        small = self._get_instance_type('m1.small')
+        reservation = quota.reserve(self.context, instances=2, cores=2)
+        self.assertEqual(0, quota.allowed_instances(self.context, 1, small))
+        self.assertRaises(quota.QuotaError, quota.reserve, self.context,
+                          instances=1, cores=1)
+        quota.release(self.context, reservation)
+        self.assertEqual(2, quota.allowed_instances(self.context, 2, small))
+
+    def test_failed_reservation_reserves_nothing(self):
+        self.assertRaises(quota.QuotaError, quota.reserve, self.context,
+                          volumes=1, gigabytes=100)
+        usage = quota.get_usage(context.get_admin_context(), self.project.id)
+        self.assertEqual(0, usage.get('volumes', 0))
+
+    def _lose_first_insert(self, reserved):
+        insert = sqlalchemy_api._quota_usage_insert
+
+        def _lost_race(session, project_id, resource, values):
+            insert(session, project_id, resource, {'reserved': reserved})
+            return False
+
+        self.stubs.Set(sqlalchemy_api, '_quota_usage_insert', _lost_race)
+
+    def test_reserve_after_losing_first_insert(self):
+        self._lose_first_insert(reserved=1)
+        quota.reserve(self.context, cores=1)
+        usage = quota.get_usage(context.get_admin_context(), self.project.id)
+        self.assertEqual(2, usage['cores'])
+
+    def test_reserve_after_losing_first_insert_checks_quota(self):
+        self._lose_first_insert(reserved=FLAGS.quota_cores)
+        self.assertRaises(quota.QuotaError, quota.reserve, self.context,
+                          cores=1)
+
+    def test_stale_reservations_expire(self):
+        quota.reserve(self.context, instances=2, cores=2)
+        utils.utcnow.override_time = datetime.datetime.utcnow() + \
+                datetime.timedelta(seconds=FLAGS.quota_reservation_expire + 1)
+        try:
+            quota.reserve(self.context, instances=1, cores=1)
+        finally:
+            utils.utcnow.override_time = None
+        usage = quota.get_usage(context.get_admin_context(), self.project.id)
+        self.assertEqual(1, usage['instances'])
+        self.assertEqual(1, usage['cores'])
+
     def test_too_many_metadata_items(self):
         metadata = {}
         for i in range(FLAGS.quota_metadata_items + 1):
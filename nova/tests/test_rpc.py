@@ -19,11 +19,21 @@
 Unit Tests for remote procedure calls using queue
 """
 
+import datetime
+import json
+import marshal
+import time
+
+from eventlet import greenthread
+
 from nova import context
+from nova import fakerabbit
 from nova import flags
 from nova import log as logging
 from nova import rpc
+from nova import stats
 from nova import test
+from nova import utils
 
 
 FLAGS = flags.FLAGS
@@ -80,6 +90,342 @@ class RpcTestCase(test.TestCase):
         except rpc.RemoteError as exc:
             self.assertEqual(int(exc.value), value)
 
+    def test_concurrent_calls_share_reply_queue(self):
+        """Test that concurrent calls get their own replies from one queue"""
+        self.flags(rpc_shared_reply_queue=True)
+        def _call(value):
+            return rpc.call(self.context, 'test', {"method": "echo",
+                                                   "args": {"value": value}})
+
+        threads = [greenthread.spawn(_call, value) for value in xrange(10)]
+        results = [thread.wait() for thread in threads]
+        self.assertEqual(range(10), results)
+        reply_queues = [name for name in fakerabbit.QUEUES
+                        if name.startswith('reply_')]
+        self.assertEqual(1, len(reply_queues))
+
+    def test_call_to_service_predating_shared_reply_queue(self):
+        """Test that calls get the replies older services send"""
+        orig_send = rpc.DirectPublisher.send
+
+        def _old_send(publisher, body, *args, **kwargs):
+            # NOTE: older services reply to the msg_id exchange and
+            #       don't tag their replies
+            body.pop('_msg_id')
+            return orig_send(publisher, body, *args, **kwargs)
+
+        self.stubs.Set(rpc.DirectPublisher, 'send', _old_send)
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": 42}})
+        self.assertEqual(42, result)
+        self.assertEqual([], [name for name in fakerabbit.QUEUES
+                              if name.startswith('reply_')])
+
+    def test_call_timeout(self):
+        """Test that a call with no timely reply raises rpc.Timeout"""
+        self.flags(rpc_shared_reply_queue=True)
+        self.assertRaises(rpc.Timeout,
+                          rpc.call,
+                          self.context,
+                          'test',
+                          {"method": "sleep",
+                           "args": {"value": 0.5}},
+                          timeout=0.1)
+        self.assertEqual({}, rpc.ReplyWaiter.instance()._waiters)
+
+    def test_expired_call_is_dropped(self):
+        """Test that callees skip calls whose caller stopped waiting"""
+        self.context.deadline = time.time() - 1
+        self.assertRaises(rpc.Timeout,
+                          rpc.call,
+                          self.context,
+                          'test',
+                          {"method": "record",
+                           "args": {"value": 42}})
+        greenthread.sleep(0.1)
+        self.assertEqual([], self.receiver.calls)
+
+    def _skew_sent_at(self, seconds):
+        orig_pack_context = rpc._pack_context
+
+        def _pack_context(msg, context):
+            orig_pack_context(msg, context)
+            msg['_sent_at'] += seconds
+
+        self.stubs.Set(rpc, '_pack_context', _pack_context)
+
+    def test_call_survives_clock_skew(self):
+        """Test that a caller's clock running behind doesn't expire calls"""
+        self._skew_sent_at(-(FLAGS.rpc_clock_skew - 1))
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": 42}},
+                          timeout=0.5)
+        self.assertEqual(42, result)
+
+    def test_call_queued_past_timeout_is_dropped(self):
+        """Test that a call queued longer than its timeout is skipped"""
+        self._skew_sent_at(-(FLAGS.rpc_clock_skew + 1))
+        self.assertRaises(rpc.Timeout,
+                          rpc.call,
+                          self.context,
+                          'test',
+                          {"method": "record",
+                           "args": {"value": 42}},
+                          timeout=0.5)
+        greenthread.sleep(0.1)
+        self.assertEqual([], self.receiver.calls)
+
+    def test_nested_call_inherits_deadline(self):
+        """Test that a callee sees the deadline of its caller"""
+        deadline = rpc.call(self.context, 'test', {"method": "deadline",
+                                                   "args": {"value": None}},
+                            timeout=30)
+        self.assertTrue(time.time() < deadline <= time.time() + 30)
+
+    def test_call_records_stats(self):
+        """Test that callers and callees record timings per method"""
+        stats.reset()
+        rpc.call(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        self.assertRaises(rpc.RemoteError, rpc.call, self.context, 'test',
+                          {"method": "fail", "args": {"value": 42}})
+        report = stats.report()
+        self.assertEqual(1, report['rpc.call.test.echo']['count'])
+        self.assertEqual(1, report['rpc.test.echo.queued']['count'])
+        self.assertEqual(1, report['rpc.test.echo.execute']['count'])
+        self.assertEqual(0, report['rpc.test.echo.in_flight'])
+        self.assertEqual(1, report['rpc.test.fail.failures'])
+        self.assertTrue('rpc.test.pool_in_use' in report)
+
+    def test_method_concurrency_limit(self):
+        """Test that rpc_method_concurrency caps concurrent calls"""
+        self.flags(rpc_method_concurrency=['busy:2'])
+        self.stubs.Set(rpc, '_METHOD_SEMAPHORES', None)
+        for value in xrange(5):
+            rpc.cast(self.context, 'test', {"method": "busy",
+                                            "args": {"value": 0.05}})
+        greenthread.sleep(0.3)
+        self.assertEqual(5, len(self.receiver.calls))
+        self.assertEqual(2, self.receiver.max_busy)
+
+    def _consumer_prefetch(self, topic):
+        prefetch = []
+
+        def _qos(backend, prefetch_size, prefetch_count, apply_global=False):
+            prefetch.append(prefetch_count)
+
+        self.stubs.Set(fakerabbit.Backend, 'qos', _qos)
+        consumer = rpc.AdapterConsumer(connection=self.conn, topic=topic,
+                                       proxy=self.receiver)
+        consumer.attach_to_eventlet()
+        greenthread.sleep(0)
+        return set(prefetch)
+
+    def test_prefetch_count(self):
+        """Test that the consumer holds at most rpc_prefetch_count"""
+        self.flags(rpc_prefetch_count=4)
+        self.assertEqual(set([4]), self._consumer_prefetch('prefetch'))
+
+    def test_prefetch_at_most_pool_size(self):
+        """Test that the consumer asks for no more than its pool can run"""
+        self.flags(rpc_thread_pool_size=8)
+        self.assertEqual(set([8]), self._consumer_prefetch('prefetch'))
+
+    def test_consumer_does_not_poll(self):
+        """Test that sequential calls are not delayed by a polling loop"""
+        start = time.time()
+        for value in xrange(20):
+            rpc.call(self.context, 'test', {"method": "echo",
+                                            "args": {"value": value}})
+        self.assertTrue(time.time() - start < 1.0)
+
+    def test_casts_reuse_pooled_publisher(self):
+        """Test that casts on every topic share one publisher"""
+        created = []
+        orig_init = rpc.TopicPublisher.__init__
+
+        def _counting_init(publisher, *args, **kwargs):
+            created.append(kwargs['topic'])
+            orig_init(publisher, *args, **kwargs)
+
+        self.stubs.Set(rpc.TopicPublisher, '__init__', _counting_init)
+        for value in xrange(5):
+            rpc.cast(self.context, 'test', {"method": "echo",
+                                            "args": {"value": value}})
+        self.assertEqual(['test'], created)
+        for host in ('host1', 'host2'):
+            rpc.cast(self.context, 'test.%s' % host,
+                     {"method": "echo", "args": {"value": 1}})
+        self.assertEqual(['test'], created)
+
+    def test_shared_publisher_routes_by_topic(self):
+        """Test that a shared publisher still delivers to each topic"""
+        receiver = TestReceiver()
+        consumer = rpc.AdapterConsumer(connection=rpc.Connection.instance(),
+                                       topic='other',
+                                       proxy=receiver)
+        consumer.attach_to_eventlet()
+        rpc.cast(self.context, 'test', {"method": "record",
+                                        "args": {"value": 1}})
+        rpc.cast(self.context, 'other', {"method": "record",
+                                         "args": {"value": 2}})
+        greenthread.sleep(0.1)
+        self.assertEqual([1], self.receiver.calls)
+        self.assertEqual([2], receiver.calls)
+
+    def test_cast_reconnects_after_failure(self):
+        """Test that a broken pooled connection is replaced"""
+        def _broken_send(*args, **kwargs):
+            raise IOError('connection reset')
+
+        conn = rpc.Pool.instance().get()
+        conn.get_publisher(rpc.TopicPublisher, 'test').send = _broken_send
+        rpc.Pool.instance().put(conn)
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": 42}})
+        self.assertEqual(42, result)
+        self.assertNotEqual(conn, rpc.Pool.instance().get())
+
+    def test_fanout_cast_reaches_every_consumer(self):
+        """Test that a fanout cast is delivered to each service of a topic"""
+        receivers = [TestReceiver(), TestReceiver()]
+        for receiver in receivers:
+            conn = rpc.Connection.instance(True)
+            consumer = rpc.FanoutAdapterConsumer(connection=conn,
+                                                 topic='test',
+                                                 proxy=receiver)
+            consumer.attach_to_eventlet()
+        rpc.fanout_cast(self.context, 'test', {"method": "record",
+                                               "args": {"value": 42}})
+        greenthread.sleep(0.1)
+        self.assertEqual([[42], [42]], [r.calls for r in receivers])
+        self.assertEqual([], self.receiver.calls)
+
+    def test_fanout_publisher_and_consumer_declare_alike(self):
+        """Test that both ends declare the fanout exchange the same way"""
+        conn = rpc.Connection.instance(True)
+        rpc.FanoutAdapterConsumer(connection=conn, topic='alike',
+                                  proxy=TestReceiver())
+        rpc.FanoutPublisher(connection=conn, topic='alike')
+        exchange = fakerabbit.EXCHANGES['alike_fanout']
+        self.assertEqual(('fanout', False, True),
+                         (exchange.exchange_type, exchange.durable,
+                          exchange.auto_delete))
+
+    def test_mismatched_exchange_redeclare_fails(self):
+        """Test that fakerabbit refuses redeclarations a broker refuses"""
+        backend = fakerabbit.Backend(rpc.Connection.instance(True))
+        backend.exchange_declare(exchange='strict', type='fanout',
+                                 durable=False, auto_delete=True)
+        backend.exchange_declare(exchange='strict', type='fanout',
+                                 durable=False, auto_delete=True)
+        self.assertRaises(fakerabbit.PreconditionFailed,
+                          backend.exchange_declare, exchange='strict',
+                          type='fanout', durable=False, auto_delete=False)
+
+    def test_multicall_streams_generator_results(self):
+        """Test that each item a method yields arrives as its own reply"""
+        self.flags(rpc_shared_reply_queue=True)
+        result = rpc.multicall(self.context, 'test', {"method": "stream",
+                                                      "args": {"value": 3}})
+        self.assertEqual([0, 1, 2], list(result))
+        self.assertEqual({}, rpc.ReplyWaiter.instance()._waiters)
+
+    def test_multicall_empty_generator(self):
+        """Test that a generator yielding nothing ends the stream"""
+        result = rpc.multicall(self.context, 'test', {"method": "stream",
+                                                      "args": {"value": 0}})
+        self.assertEqual([], list(result))
+
+    def test_multicall_plain_method(self):
+        """Test that multicall yields the result of a plain method once"""
+        result = rpc.multicall(self.context, 'test', {"method": "echo",
+                                                      "args": {"value": 42}})
+        self.assertEqual([42], list(result))
+
+    def test_multicall_failure_mid_stream(self):
+        """Test that a failing generator raises after the earlier items"""
+        result = rpc.multicall(self.context, 'test',
+                               {"method": "stream_fail",
+                                "args": {"value": 42}})
+        self.assertEqual(42, result.next())
+        self.assertRaises(rpc.RemoteError, result.next)
+
+    def test_call_returns_last_streamed_result(self):
+        """Test that call on a generator method returns its last item"""
+        result = rpc.call(self.context, 'test', {"method": "stream",
+                                                 "args": {"value": 3}})
+        self.assertEqual(2, result)
+
+    def test_cast_runs_generator(self):
+        """Test that casting to a generator method still runs it"""
+        rpc.cast(self.context, 'test', {"method": "stream",
+                                        "args": {"value": 3}})
+        greenthread.sleep(0.1)
+        self.assertEqual([0, 1, 2], self.receiver.calls)
+
+    def test_services_sharing_topic_get_each_call_once(self):
+        """Test that a second consumer on a topic doesn't duplicate calls"""
+        conn = rpc.Connection.instance(True)
+        consumer = rpc.AdapterConsumer(connection=conn, topic='test',
+                                       proxy=self.receiver)
+        consumer.attach_to_eventlet()
+        for value in xrange(5):
+            rpc.call(self.context, 'test', {"method": "record",
+                                            "args": {"value": value}})
+        greenthread.sleep(0.1)
+        self.assertEqual(range(5), sorted(self.receiver.calls))
+
+    def test_call_with_marshal_serializer(self):
+        """Test that a call round trips with the marshal serializer"""
+        self.flags(rpc_serializer='marshal')
+        value = {'name': u'instance-1', 'files': [('/etc/motd', 'x' * 64)]}
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(value['name'], result['name'])
+        self.assertEqual(value['files'][0][1], result['files'][0][1])
+
+    def test_marshal_serializer_matches_json(self):
+        """Test that marshal decodes to exactly what json decodes to"""
+        value = {'files': [('/etc/motd', 'x')], 1: None, 'up': True,
+                 'at': datetime.datetime(2011, 4, 1, 12, 0, 0)}
+        self.assertEqual(json.loads(utils.dumps(value)),
+                         rpc._marshal_decode(rpc._marshal_encode(value)))
+
+    def test_marshal_decode_refuses_other_types(self):
+        """Test that unmarshalling data from the broker can't build code"""
+        code = compile('1', '<rpc>', 'eval')
+        self.assertRaises(ValueError, rpc._marshal_decode,
+                          marshal.dumps({u'code': code}))
+        self.assertRaises(ValueError, rpc._marshal_decode,
+                          marshal.dumps(('tuple',)))
+
+    def test_marshal_serializer_converts_unknown_types(self):
+        """Test that marshal falls back to primitives for e.g. datetimes"""
+        self.flags(rpc_serializer='marshal')
+        value = datetime.datetime(2011, 4, 1, 12, 0, 0)
+        result = rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(str(value), result)
+
+    def test_reply_uses_request_serializer(self):
+        """Test that replies are encoded the way the request was"""
+        serializers = []
+        orig_msg_reply = rpc.msg_reply
+
+        def _recording_msg_reply(*args, **kwargs):
+            serializers.append(kwargs.get('serializer'))
+            return orig_msg_reply(*args, **kwargs)
+
+        self.stubs.Set(rpc, 'msg_reply', _recording_msg_reply)
+        rpc.call(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        self.flags(rpc_serializer='marshal')
+        rpc.Pool.reset()
+        rpc.call(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        self.assertEqual(['json', 'marshal'], serializers)
+
     def test_nested_calls(self):
         """Test that we can do an rpc.call inside another call"""
         class Nested(object):
@@ -112,7 +458,12 @@ class RpcTestCase(test.TestCase):
 class TestReceiver(object):
     """Simple Proxy class so the consumer has methods to call
 
-    Uses static methods because we aren't actually storing any state"""
+    Uses static methods except where calls need to be tracked"""
+
+    def __init__(self):
+        self.calls = []
+        self.busy_count = 0
+        self.max_busy = 0
 
     @staticmethod
     def echo(context, value):
@@ -126,6 +477,42 @@ class TestReceiver(object):
         LOG.debug(_("Received %s"), context)
         return context.to_dict()
 
+    @staticmethod
+    def sleep(context, value):
+        """Sleeps for value seconds before replying"""
+        greenthread.sleep(value)
+        return value
+
+    @staticmethod
+    def deadline(context, value):
+        """Returns the deadline the caller sent along"""
+        return context.deadline
+
+    def record(self, context, value):
+        """Remembers that it has been called"""
+        self.calls.append(value)
+        return value
+
+    def busy(self, context, value):
+        """Sleeps for value seconds, tracking how many calls overlap"""
+        self.busy_count += 1
+        self.max_busy = max(self.max_busy, self.busy_count)
+        greenthread.sleep(value)
+        self.busy_count -= 1
+        self.calls.append(value)
+
+    def stream(self, context, value):
+        """Yields 0 to value - 1, remembering how far it got"""
+        for i in xrange(value):
+            self.calls.append(i)
+            yield i
+
+    @staticmethod
+    def stream_fail(context, value):
+        """Yields value and then raises an exception"""
+        yield value
+        raise Exception(value)
+
     @staticmethod
     def fail(context, value):
         """Raises an exception with the value sent in"""
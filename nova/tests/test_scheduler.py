@@ -229,6 +229,29 @@ class ZoneSchedulerTestCase(test.TestCase):
                                instance_id='i-ffffffff',
                                availability_zone='zone1')
 
+    def test_run_instances(self):
+        scheduler = manager.SchedulerManager()
+        ctxt = context.get_admin_context()
+        self.mox.StubOutWithMock(scheduler.driver, 'schedule')
+        self.mox.StubOutWithMock(rpc, 'cast', use_mock_anything=True)
+        for instance_id, host in ((1, 'host1'), (2, 'host2')):
+            # NOTE: the scheduler driver is handed an elevated copy
+            scheduler.driver.schedule(mox.IsA(context.RequestContext),
+                                      'compute',
+                                      instance_id=instance_id,
+                                      availability_zone=None).\
+                                      AndReturn(host)
+            rpc.cast(ctxt,
+                     'compute.%s' % host,
+                     {'method': 'run_instance',
+                      'args': {'instance_id': instance_id,
+                               'availability_zone': None}})
+        self.mox.ReplayAll()
+        scheduler.run_instances(ctxt,
+                                'compute',
+                                instance_ids=[1, 2],
+                                availability_zone=None)
+
 
 class SimpleDriverTestCase(test.TestCase):
     """Test case for simple driver"""
@@ -458,6 +481,87 @@ class SimpleDriverTestCase(test.TestCase):
         compute1.kill()
         compute2.kill()
 
+    def _update_host_state(self, host, **kwargs):
+        capabilities = {'instance_cores': 0, 'vcpus': 16}
+        capabilities.update(kwargs)
+        self.scheduler.update_host_state(self.context, host, capabilities)
+        return self._create_compute_service(host=host)
+
+    def _stub_compute_sorted(self):
+        def _fail(context):
+            self.fail(_('Summed instance cores with host states present'))
+        self.stubs.Set(db, 'service_get_all_compute_sorted', _fail)
+
+    def test_least_busy_host_state_gets_instance(self):
+        """Ensures published host states are used instead of the db"""
+        self._stub_compute_sorted()
+        s_ref1 = self._update_host_state('host1', instance_cores=2)
+        s_ref2 = self._update_host_state('host2', instance_cores=0)
+        instance_ids = [self._create_instance(), self._create_instance()]
+        hosts = [self.scheduler.driver.schedule_run_instance(self.context,
+                                                             instance_id)
+                 for instance_id in instance_ids]
+        self.assertEqual(['host2', 'host2'], hosts)
+        host_state_manager = self.scheduler.driver.host_state_manager
+        host2 = host_state_manager.host_states['host2']
+        self.assertEqual(2, host2.instance_cores)
+        self.assertEqual(40, host2.resources['memory_mb_used'])
+        for instance_id in instance_ids:
+            db.instance_destroy(self.context, instance_id)
+        db.service_destroy(self.context, s_ref1['id'])
+        db.service_destroy(self.context, s_ref2['id'])
+
+    def test_host_state_too_many_cores(self):
+        """Ensures we don't go over max cores with host states"""
+        self._stub_compute_sorted()
+        s_ref1 = self._update_host_state('host1',
+                                         instance_cores=FLAGS.max_cores)
+        s_ref2 = self._update_host_state('host2',
+                                         instance_cores=FLAGS.max_cores - 1)
+        instance_id = self._create_instance()
+        host = self.scheduler.driver.schedule_run_instance(self.context,
+                                                           instance_id)
+        self.assertEqual('host2', host)
+        instance_id2 = self._create_instance()
+        self.assertRaises(driver.NoValidHost,
+                          self.scheduler.driver.schedule_run_instance,
+                          self.context,
+                          instance_id2)
+        db.instance_destroy(self.context, instance_id)
+        db.instance_destroy(self.context, instance_id2)
+        db.service_destroy(self.context, s_ref1['id'])
+        db.service_destroy(self.context, s_ref2['id'])
+
+    def test_host_without_state_is_still_used(self):
+        """Ensures hosts that don't publish a state aren't left out"""
+        self._stub_compute_sorted()
+        s_ref1 = self._update_host_state('host1', instance_cores=2)
+        s_ref2 = self._create_compute_service(host='host2')
+        instance_id = self._create_instance()
+        host = self.scheduler.driver.schedule_run_instance(self.context,
+                                                           instance_id)
+        self.assertEqual('host2', host)
+        db.instance_destroy(self.context, instance_id)
+        db.service_destroy(self.context, s_ref1['id'])
+        db.service_destroy(self.context, s_ref2['id'])
+
+    def test_disabled_and_down_host_states_are_skipped(self):
+        """Ensures host states are only used for hosts that are up"""
+        s_ref1 = self._update_host_state('host1', disabled=True)
+        s_ref2 = self._update_host_state('host2', instance_cores=1)
+        s_ref3 = self._update_host_state('host3')
+        past = datetime.datetime.utcnow() - \
+               datetime.timedelta(seconds=FLAGS.service_down_time + 1)
+        db.service_update(self.context, s_ref3['id'],
+                          {'created_at': past, 'updated_at': past})
+        self.scheduler.update_host_state(self.context, 'host4', {})
+        hosts = self.scheduler.driver.host_state_manager.get_hosts_up(
+                self.scheduler.driver.hosts_up(self.context, 'compute'))
+        self.assertEqual(['host2'], [state.host for state in hosts])
+        db.service_destroy(self.context, s_ref1['id'])
+        db.service_destroy(self.context, s_ref2['id'])
+        db.service_destroy(self.context, s_ref3['id'])
+
     def test_least_busy_host_gets_volume(self):
         """Ensures the host with less gigabytes gets the next one"""
         volume1 = service.Service('host1',
@@ -31,6 +31,7 @@ from nova import test
 from nova import service
 from nova import manager
 from nova.compute import manager as compute_manager
+from nova.servicegroup import driver as servicegroup_driver
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string("fake_manager", "nova.tests.test_service.FakeManager",
@@ -98,6 +99,7 @@ class ServiceTestCase(test.TestCase):
     def setUp(self):
         super(ServiceTestCase, self).setUp()
         self.mox.StubOutWithMock(service, 'db')
+        self.mox.StubOutWithMock(servicegroup_driver, 'db')
 
     def test_create(self):
         host = 'foo'
@@ -121,8 +123,17 @@ class ServiceTestCase(test.TestCase):
                             proxy=mox.IsA(service.Service)).AndReturn(
                                     rpc.AdapterConsumer)
 
+        self.mox.StubOutWithMock(rpc,
+                                 'FanoutAdapterConsumer',
+                                 use_mock_anything=True)
+        rpc.FanoutAdapterConsumer(connection=mox.IgnoreArg(),
+                                  topic=topic,
+                                  proxy=mox.IsA(service.Service)).AndReturn(
+                                          rpc.FanoutAdapterConsumer)
+
         rpc.AdapterConsumer.attach_to_eventlet()
         rpc.AdapterConsumer.attach_to_eventlet()
+        rpc.FanoutAdapterConsumer.attach_to_eventlet()
 
         service_create = {'host': host,
                           'binary': binary,
@@ -139,6 +150,8 @@ class ServiceTestCase(test.TestCase):
                                        binary).AndRaise(exception.NotFound())
         service.db.service_create(mox.IgnoreArg(),
                                   service_create).AndReturn(service_ref)
+        servicegroup_driver.db.service_heartbeat(mox.IgnoreArg(),
+                                                 service_ref['id'])
         self.mox.ReplayAll()
 
         app.start()
@@ -170,10 +183,42 @@ class ServiceTestCase(test.TestCase):
                                       binary).AndRaise(exception.NotFound())
         service.db.service_create(mox.IgnoreArg(),
                                   service_create).AndReturn(service_ref)
-        service.db.service_get(mox.IgnoreArg(),
-                               service_ref['id']).AndReturn(service_ref)
-        service.db.service_update(mox.IgnoreArg(), service_ref['id'],
-                                  mox.ContainsKeyValue('report_count', 1))
+        servicegroup_driver.db.service_heartbeat(mox.IgnoreArg(),
+                                                 service_ref['id'])
+
+        self.mox.ReplayAll()
+        serv = service.Service(host,
+                               binary,
+                               topic,
+                               'nova.tests.test_service.FakeManager')
+        serv.start()
+        serv.report_state()
+
+    def test_report_state_recreates_service(self):
+        host = 'foo'
+        binary = 'bar'
+        topic = 'test'
+        service_create = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova'}
+        service_ref = {'host': host,
+                          'binary': binary,
+                          'topic': topic,
+                          'report_count': 0,
+                          'availability_zone': 'nova',
+                          'id': 1}
+
+        service.db.service_get_by_args(mox.IgnoreArg(),
+                                      host,
+                                      binary).AndReturn(service_ref)
+        servicegroup_driver.db.service_heartbeat(
+                mox.IgnoreArg(), 1).AndRaise(exception.NotFound())
+        service.db.service_create(mox.IgnoreArg(),
+                                  service_create).AndReturn(
+                                          dict(service_ref, id=2))
+        servicegroup_driver.db.service_heartbeat(mox.IgnoreArg(), 2)
 
         self.mox.ReplayAll()
         serv = service.Service(host,
@@ -182,6 +227,8 @@ class ServiceTestCase(test.TestCase):
                                'nova.tests.test_service.FakeManager')
         serv.start()
         serv.report_state()
+        self.assertEqual(2, serv.service_id)
+        self.assert_(not serv.model_disconnected)
 
     def test_report_state_newly_disconnected(self):
         host = 'foo'
@@ -204,8 +251,8 @@ class ServiceTestCase(test.TestCase):
                                       binary).AndRaise(exception.NotFound())
         service.db.service_create(mox.IgnoreArg(),
                                   service_create).AndReturn(service_ref)
-        service.db.service_get(mox.IgnoreArg(),
-                               mox.IgnoreArg()).AndRaise(Exception())
+        servicegroup_driver.db.service_heartbeat(
+                mox.IgnoreArg(), mox.IgnoreArg()).AndRaise(Exception())
 
         self.mox.ReplayAll()
         serv = service.Service(host,
@@ -237,10 +284,8 @@ class ServiceTestCase(test.TestCase):
                                       binary).AndRaise(exception.NotFound())
         service.db.service_create(mox.IgnoreArg(),
                                   service_create).AndReturn(service_ref)
-        service.db.service_get(mox.IgnoreArg(),
-                               service_ref['id']).AndReturn(service_ref)
-        service.db.service_update(mox.IgnoreArg(), service_ref['id'],
-                                  mox.ContainsKeyValue('report_count', 1))
+        servicegroup_driver.db.service_heartbeat(mox.IgnoreArg(),
+                                                 service_ref['id'])
 
         self.mox.ReplayAll()
         serv = service.Service(host,
@@ -279,6 +324,7 @@ class ServiceTestCase(test.TestCase):
         self.mox.StubOutWithMock(service.rpc.Connection, 'instance')
         service.rpc.Connection.instance(new=mox.IgnoreArg())
         service.rpc.Connection.instance(new=mox.IgnoreArg())
+        service.rpc.Connection.instance(new=mox.IgnoreArg())
         self.mox.StubOutWithMock(serv.manager.driver,
                                  'update_available_resource')
         serv.manager.driver.update_available_resource(mox.IgnoreArg(), host)
@@ -0,0 +1,109 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For service liveness drivers
+"""
+
+import datetime
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import flags
+from nova import servicegroup
+from nova import test
+from nova import utils
+
+FLAGS = flags.FLAGS
+
+
+class FakeService(object):
+    """Stands in for a running nova.service.Service"""
+    def __init__(self, service_ref):
+        self.service_id = service_ref['id']
+        self.host = service_ref['host']
+        self.topic = service_ref['topic']
+
+
+class _ServiceGroupTestCase(object):
+    """Tests every liveness driver has to pass"""
+    driver = None
+
+    def setUp(self):
+        super(_ServiceGroupTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.api = servicegroup.API(self.driver)
+        self.services = [db.service_create(self.context,
+                                           {'host': 'host%d' % i,
+                                            'binary': 'nova-compute',
+                                            'topic': 'compute',
+                                            'report_count': 0})
+                         for i in xrange(3)]
+
+    def tearDown(self):
+        utils.utcnow.override_time = None
+        super(_ServiceGroupTestCase, self).tearDown()
+
+    def _advance(self, seconds):
+        utils.utcnow.override_time = datetime.datetime.utcnow() + \
+                                     datetime.timedelta(seconds=seconds)
+
+    def _up_hosts(self):
+        return sorted(service['host'] for service in
+                      self.api.get_all_up(self.context, 'compute'))
+
+    def test_heartbeats_keep_services_up(self):
+        self._advance(FLAGS.service_down_time + 1)
+        self.assertEqual([], self._up_hosts())
+        self.api.join(self.context, FakeService(self.services[0]))
+        self.api.heartbeat(self.context, FakeService(self.services[2]))
+        self.assertEqual(['host0', 'host2'], self._up_hosts())
+        service_ref = db.service_get(self.context, self.services[2]['id'])
+        self.assertTrue(self.api.is_up(service_ref))
+        self.assertFalse(self.api.is_up(self.services[1]))
+
+    def test_services_go_down_without_heartbeats(self):
+        self.api.join(self.context, FakeService(self.services[0]))
+        self._advance(FLAGS.service_down_time + 1)
+        self.assertEqual([], self._up_hosts())
+
+
+class DbDriverTestCase(_ServiceGroupTestCase, test.TestCase):
+    driver = 'nova.servicegroup.driver.DbDriver'
+
+    def test_heartbeat_bumps_report_count(self):
+        service = FakeService(self.services[0])
+        self.api.heartbeat(self.context, service)
+        self.api.heartbeat(self.context, service)
+        service_ref = db.service_get(self.context, service.service_id)
+        self.assertEqual(2, service_ref['report_count'])
+
+    def test_heartbeat_of_missing_service(self):
+        db.service_destroy(self.context, self.services[0]['id'])
+        self.assertRaises(exception.NotFound, self.api.heartbeat,
+                          self.context, FakeService(self.services[0]))
+
+
+class MemcachedDriverTestCase(_ServiceGroupTestCase, test.TestCase):
+    driver = 'nova.servicegroup.driver.MemcachedDriver'
+
+    def test_heartbeat_does_not_write_services(self):
+        service = FakeService(self.services[0])
+        self.api.heartbeat(self.context, service)
+        service_ref = db.service_get(self.context, service.service_id)
+        self.assertEqual(0, service_ref['report_count'])
+        self.assertEqual(None, service_ref['updated_at'])
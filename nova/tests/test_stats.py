@@ -0,0 +1,76 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2011 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Unit Tests for nova.stats
+"""
+
+from nova import stats
+from nova import test
+
+
+class RingBufferSinkTestCase(test.TestCase):
+    """Test cases for the in-memory stats sink"""
+    def test_timings_are_summarized(self):
+        sink = stats.RingBufferSink()
+        for value in xrange(1, 101):
+            sink.timing('key', value)
+        summary = sink.report()['key']
+        self.assertEqual(100, summary['count'])
+        self.assertEqual(50.5, summary['mean'])
+        self.assertEqual(51, summary['p50'])
+        self.assertEqual(99, summary['p99'])
+        self.assertEqual(100, summary['max'])
+
+    def test_ring_keeps_latest_samples(self):
+        sink = stats.RingBufferSink(size=3)
+        for value in xrange(10):
+            sink.timing('key', value)
+        summary = sink.report()['key']
+        self.assertEqual(3, summary['count'])
+        self.assertEqual(8, summary['p50'])
+        self.assertEqual(9, summary['max'])
+
+    def test_counters_and_gauges(self):
+        sink = stats.RingBufferSink()
+        sink.incr('count')
+        sink.incr('count', 2)
+        sink.gauge('level', 5)
+        sink.gauge('level', 3)
+        self.assertEqual({'count': 3, 'level': 3}, sink.report())
+
+
+class StatsTestCase(test.TestCase):
+    """Test cases for the module level stats functions"""
+    def setUp(self):
+        super(StatsTestCase, self).setUp()
+        stats.reset()
+
+    def tearDown(self):
+        stats.reset()
+        super(StatsTestCase, self).tearDown()
+
+    def test_sink_is_pluggable(self):
+        self.flags(stats_sink='nova.stats.Sink')
+        stats.timing('key', 1)
+        stats.incr('count')
+        self.assertEqual({}, stats.report())
+
+    def test_default_sink_records(self):
+        stats.timing('key', 1)
+        stats.incr('count')
+        self.assertEqual(1, stats.report()['count'])
+        self.assertEqual(1, stats.report()['key']['count'])
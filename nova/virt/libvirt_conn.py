@@ -1079,6 +1079,7 @@ class LibvirtConnection(object):
 
         :param ctxt: security context
         :param host: hostname that compute manager is currently running
+        :returns: the resource info written to the ComputeNode table
 
         """
 
@@ -1108,6 +1109,7 @@ class LibvirtConnection(object):
         else:
             LOG.info(_('Compute_service record updated for %s ') % host)
             db.compute_node_update(ctxt, compute_node_ref[0]['id'], dic)
+        return dic
 
     def compare_cpu(self, cpu_info):
         """Checks the host cpu is compatible to a cpu given by xml.
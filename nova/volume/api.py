@@ -57,7 +57,11 @@ class API(base.Base):
             'display_name': name,
             'display_description': description}
 
-        volume = self.db.volume_create(context, options)
+        reservation = quota.reserve(context, volumes=1, gigabytes=int(size))
+        try:
+            volume = self.db.volume_create(context, options)
+        finally:
+            quota.release(context, reservation)
         rpc.cast(context,
                  FLAGS.scheduler_topic,
                  {"method": "create_volume",